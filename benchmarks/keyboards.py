@@ -0,0 +1,68 @@
+# Import necessary modules, classes and functions
+import os
+import sys
+from argparse import ArgumentParser
+from statistics import median
+from time import process_time_ns
+
+# Define the root directory of the bot
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telebot.apihelper import _convert_markup
+from utils import telegram_inline_keyboards as keyboards
+
+# Define the user whose menus are generated
+USER_ID = 123456789
+
+# Define the keyboards sent by the menu navigation callbacks: the name, the keyboard built as before and the precomputed one
+KEYBOARDS = [
+    ('user categories', lambda: keyboards.BuildKBUserCategoties(), lambda: keyboards.GenKBUserCategoties()),
+    ('settings', lambda: keyboards.BuildKBSettings(), lambda: keyboards.GenKBSettings()),
+    ('language (general)', lambda: keyboards.BuildKBLanguageGeneral(), lambda: keyboards.GenKBLanguageGeneral()),
+    ('language (settings)', lambda: keyboards.BuildKBLanguageSettings(), lambda: keyboards.GenKBLanguageSettings()),
+    ('model (settings)', lambda: keyboards.BuildKBModelSettings(), lambda: keyboards.GenKBModelSettings()),
+    ('admin', lambda: keyboards.BuildKBAdmin(USER_ID), lambda: keyboards.GenKBAdmin(USER_ID)),
+    ('user', lambda: keyboards.BuildKBUser(USER_ID), lambda: keyboards.GenKBUser(USER_ID)),
+    ('banned user', lambda: keyboards.BuildKBBanned(USER_ID), lambda: keyboards.GenKBBanned(USER_ID)),
+    ('user language', lambda: keyboards.BuildKBLanguage(USER_ID), lambda: keyboards.GenKBLanguage(USER_ID)),
+    ('user model', lambda: keyboards.BuildKBModel(USER_ID), lambda: keyboards.GenKBModel(USER_ID)),
+    ('user budget', lambda: keyboards.BuildKBBudget(USER_ID), lambda: keyboards.GenKBBudget(USER_ID)),
+    ('delete user', lambda: keyboards.BuildKBDeleteUser(USER_ID), lambda: keyboards.GenKBDeleteUser(USER_ID)),
+]
+
+# Measure the CPU time of getting the keyboard and converting it to the Bot API parameter (in microseconds per callback)
+def Measure(generate, iterations: int, runs: int) -> float:
+    times = []
+
+    for _ in range(runs):
+        started = process_time_ns()
+
+        for _ in range(iterations):
+            _convert_markup(generate())
+
+        times.append((process_time_ns() - started) / iterations / 1000)
+
+    return median(times)
+
+# Measure the keyboards of the menu navigation and print the report
+def main():
+    parser = ArgumentParser(description="Compare the CPU time per callback of building the inline keyboards and of the precomputed ones")
+    parser.add_argument('--iterations', type=int, default=2000, help="number of keyboards generated in one run")
+    parser.add_argument('--runs', type=int, default=5, help="number of runs for every keyboard")
+    args = parser.parse_args()
+
+    print(f"{'keyboard':<24}{'built, us':>12}{'precomputed, us':>18}{'speedup':>10}")
+
+    for name, build, generate in KEYBOARDS:
+        # Both ways have to send exactly the same keyboard
+        assert _convert_markup(build()) == _convert_markup(generate()), name
+
+        built = Measure(build, args.iterations, args.runs)
+        precomputed = Measure(generate, args.iterations, args.runs)
+
+        print(f"{name:<24}{built:>12.2f}{precomputed:>18.2f}{built / precomputed:>9.0f}x")
+
+
+if __name__ == '__main__':
+    main()
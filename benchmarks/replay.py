@@ -0,0 +1,386 @@
+# Import necessary modules, classes and functions
+import os
+import sys
+import json
+import tempfile
+import threading
+from argparse import ArgumentParser
+from collections import Counter
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from statistics import median
+from time import perf_counter, process_time
+from typing import Callable
+from urllib.parse import urlsplit, parse_qsl
+
+# Define the root directory of the bot
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Define the users of the replayed updates (the owner is created by the bot itself)
+OWNER_ID = 100
+ADMIN_ID = 101
+USER_ID = 102
+BANNED_ID = 103
+TARGET_ID = 104
+REMOVED_ID = 105
+
+# Define the number of the extra users, so the users' menus have several pages
+PAGE_USERS = 30
+
+# Define the maximum numbers of the round trips (DB reads and writes and Telegram calls) of one update of every type (with the users read from the database)
+# Every update is claimed by its update_id with one conditional write before it is handled
+ROUND_TRIP_BUDGETS = {
+    'text': 8,
+    'message:photo': 3,
+    'command:/start': 3,
+    'command:/help': 3,
+    'command:/language': 3,
+    'command:/budget': 3,
+    'command:/reset': 4,
+    'command:/summarize': 4,
+    'command:/settings': 3,
+    'command:/users': 3,
+    'callback:outdated': 3,
+    'callback:language': 5,
+    'callback:settings': 3,
+    'callback:settings_language': 3,
+    'callback:settings_language_set': 5,
+    'callback:settings_model': 3,
+    'callback:settings_model_set': 5,
+    'callback:manage': 3,
+    'callback:manage_role': 4,
+    'callback:manage_page': 4,
+    'callback:manage_user': 4,
+    'callback:manage_set_role': 6,
+    'callback:manage_language': 4,
+    'callback:manage_language_set': 6,
+    'callback:manage_model': 4,
+    'callback:manage_model_set': 6,
+    'callback:manage_budget': 4,
+    'callback:manage_budget_change': 6,
+    'callback:manage_delete': 4,
+    'callback:manage_remove': 7,
+}
+
+# Define the queries of the storage backends which only read the data (the others write it)
+READ_QUERIES = ('query_find', 'query_find_batch', 'query_search', 'query_search_page', 'query_load_history', 'query_get_cache')
+
+# Define the reply of the chat model stand-in
+CHAT_REPLY = "This is the replayed answer of the chat model."
+
+
+# The in-process Bot API server (every call is counted by its method and answered at once)
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    calls = Counter()
+    lock = threading.Lock()
+    message_ids = count(1000)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        method = url.path.rsplit('/', 1)[-1]
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        params = dict(parse_qsl(url.query)) | dict(parse_qsl(body))
+
+        with self.lock:
+            self.calls[method] += 1
+
+        response = json.dumps({'ok': True, 'result': self.result(method, params)}).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_GET = do_POST
+
+    # Get the result of the Bot API method
+    def result(self, method: str, params: dict):
+        match method:
+            case 'editMessageText' | 'sendMessage' | 'sendPhoto' | 'sendAudio' | 'sendVideo' | 'sendDocument' | 'sendDice':
+                return {
+                    'message_id': next(self.message_ids), 'date': 0, 'text': params.get('text', ''),
+                    'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'}
+                }
+            case 'getChatMember':
+                user_id = int(params.get('user_id', 0))
+                return {'status': 'member', 'user': {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': f'user{user_id}'}}
+            case _:
+                return True
+
+    def log_message(self, format, *args):
+        pass
+
+# The storage backend counting the reads and the writes of the wrapped one
+class CountingBackend():
+    def __init__(self, backend):
+        self.backend = backend
+        self.reads = 0
+        self.writes = 0
+
+    def __getattr__(self, name: str):
+        query = getattr(self.backend, name)
+
+        if not name.startswith('query_'):
+            return query
+
+        def counted(*args, **kwargs):
+            if name in READ_QUERIES:
+                self.reads += 1
+            else:
+                self.writes += 1
+
+            return query(*args, **kwargs)
+
+        return counted
+
+    # Reset the counters before the next update
+    def reset(self):
+        self.reads = 0
+        self.writes = 0
+
+# Start the Bot API server and the storage stand-in, and import the bot configured to use them
+def StartBot(database: str):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBotAPIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # The bot reads its configuration on import, and the embedded SQLite backend stands in for DocAPI
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': '1:replay',
+        'OWNER_TELEGRAM_ID': str(OWNER_ID),
+        'OWNER_TELEGRAM_NAME': 'owner',
+        'STORAGE_BACKEND': 'sqlite',
+        'SQLITE_PATH': database,
+        'WEBHOOK_REPLY': '',
+        'RESPONSE_CACHE': '',
+    })
+
+    from telebot import apihelper
+    apihelper.API_URL = f"http://127.0.0.1:{server.server_port}/bot{{0}}/{{1}}"
+
+    import main
+    import bot
+
+    # The chat model answers at once with the same text
+    def get_chat_response_stream(model, messages, tools=None, tool_calls=None):
+        yield CHAT_REPLY, None
+        yield '', {'prompt_tokens': 10, 'completion_tokens': 10}
+
+    def get_chat_response(model, messages):
+        return CHAT_REPLY, {'prompt_tokens': 10, 'completion_tokens': 10}
+
+    bot.openai_helper.get_chat_response_stream = get_chat_response_stream
+    bot.openai_helper.get_chat_response = get_chat_response
+
+    return main
+
+# Create the users of the replayed updates
+def SeedUsers():
+    from utils.storage import query_upsert
+
+    for user_id, role in ((ADMIN_ID, 'admin'), (USER_ID, 'user'), (BANNED_ID, 'banned'), (TARGET_ID, 'user')):
+        query_upsert(Decimal(user_id), {'role': role}, name=f'user{user_id}', language='en', model='gpt-3.5-turbo', budget=Decimal(1000))
+
+    for user_id in range(1000, 1000 + PAGE_USERS):
+        query_upsert(Decimal(user_id), {'role': 'user'}, name=f'user{user_id}', language='en', model='gpt-3.5-turbo', budget=Decimal(1))
+
+# Create the user deleted by the replayed update
+def SeedRemovedUser():
+    from utils.storage import query_upsert
+
+    query_upsert(Decimal(REMOVED_ID), {'role': 'user'}, name=f'user{REMOVED_ID}', language='en', model='gpt-3.5-turbo', budget=Decimal(1))
+
+# Reset the conversation before the replayed message, so every message has the same history
+def ResetUserHistory():
+    from utils.telegram import ResetHistory
+
+    ResetHistory(USER_ID)
+
+# Create the update of the message
+def NewMessage(user_id: int, text: str | None = None, **fields) -> dict:
+    message = {
+        'message_id': 1, 'date': 0,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': f'user{user_id}'},
+    } | fields
+
+    if text is not None:
+        message['text'] = text
+
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+
+    return {'update_id': 0, 'message': message}
+
+# Create the update of the callback query
+def NewCallback(user_id: int, data: str) -> dict:
+    return {
+        'update_id': 0,
+        'callback_query': {
+            'id': '1', 'chat_instance': 'replay', 'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': f'user{user_id}'},
+            'message': {'message_id': 1, 'date': 0, 'text': 'menu', 'chat': {'id': user_id, 'type': 'private'}}
+        }
+    }
+
+# Get the synthetic updates: the update and the preparation made before every replay of it (not measured)
+def GetSyntheticUpdates() -> list[tuple[dict, Callable | None]]:
+    from utils.telegram_callbacks import CALLBACK_ACTIONS, EncodeCallback
+
+    # The arguments of every callback action emitted by the inline keyboards
+    callbacks = {
+        'language': ('en',),
+        'settings': (),
+        'settings_language': (),
+        'settings_language_set': ('en',),
+        'settings_model': (),
+        'settings_model_set': ('gpt35',),
+        'manage': (),
+        'manage_role': ('user',),
+        'manage_page': ('user', 'next', 1000 + PAGE_USERS // 2),
+        'manage_user': ('user', TARGET_ID),
+        'manage_set_role': ('user', TARGET_ID),
+        'manage_language': (TARGET_ID,),
+        'manage_language_set': ('en', TARGET_ID),
+        'manage_model': (TARGET_ID,),
+        'manage_model_set': ('gpt35', TARGET_ID),
+        'manage_budget': (TARGET_ID,),
+        'manage_budget_change': ('increase', TARGET_ID),
+        'manage_delete': ('user', TARGET_ID),
+        'manage_remove': ('user', REMOVED_ID),
+    }
+
+    # A new callback action has to be replayed too
+    missing = set(CALLBACK_ACTIONS) - set(callbacks)
+    if missing:
+        raise RuntimeError(f"There are no replayed updates for the callback actions {', '.join(sorted(missing))}")
+
+    updates = [
+        (NewMessage(USER_ID, "What is the capital of France?"), ResetUserHistory),
+        (NewMessage(USER_ID, photo=[{'file_id': 'photo', 'file_unique_id': 'photo', 'width': 1, 'height': 1}]), None),
+    ]
+
+    for command in ('/start', '/help', '/language', '/budget', '/reset', '/summarize', '/settings', '/users'):
+        updates.append((NewMessage(OWNER_ID, command), None))
+
+    updates.append((NewCallback(OWNER_ID, 'outdated'), None))
+
+    for action, args in callbacks.items():
+        updates.append((NewCallback(OWNER_ID, EncodeCallback(action, *args)), SeedRemovedUser if action == 'manage_remove' else None))
+
+    return updates
+
+# Get the recorded updates (one JSON update per line)
+def GetRecordedUpdates(path: str) -> list[tuple[dict, Callable | None]]:
+    with open(path, encoding='utf-8') as file:
+        return [(json.loads(line), None) for line in file if line.strip()]
+
+# Get the type of the update the results are grouped by
+def GetUpdateType(update: dict) -> str:
+    from utils.telegram_callbacks import DecodeCallback
+
+    if 'callback_query' in update:
+        callback = DecodeCallback(update['callback_query'].get('data') or '')
+        return f"callback:{callback[0]}" if callback else 'callback:outdated'
+
+    message = update.get('message') or {}
+
+    if 'text' in message:
+        return f"command:{message['text'].split()[0].split('@')[0]}" if message['text'].startswith('/') else 'text'
+
+    content_type = next((field for field in ('photo', 'audio', 'voice', 'video', 'video_note', 'document', 'dice', 'sticker') if field in message), 'other')
+
+    return f"message:{content_type}"
+
+# Replay the update through the function handler and measure it
+def Replay(bot_main, storage, update: dict, update_id: int, cold: bool) -> dict:
+    from utils import telegram
+
+    # The cold replay reads the users from the database, like the first update of a new function instance
+    if cold:
+        telegram.user_cache.clear()
+
+    storage.backend.reset()
+    FakeBotAPIHandler.calls.clear()
+
+    event = {'body': json.dumps(update | {'update_id': update_id})}
+
+    started, started_cpu = perf_counter(), process_time()
+    bot_main.handler(event, None)
+    wall, cpu = perf_counter() - started, process_time() - started_cpu
+
+    return {
+        'wall': wall * 1000,
+        'cpu': cpu * 1000,
+        'db_reads': storage.backend.reads,
+        'db_writes': storage.backend.writes,
+        'telegram': sum(FakeBotAPIHandler.calls.values()),
+    }
+
+# Replay the updates and print the report (the exit status is 1 if any round trip budget is exceeded)
+def main():
+    parser = ArgumentParser(description="Replay the updates through main.handler with the local Bot API and storage stand-ins and measure every update type")
+    parser.add_argument('--updates', help="file with the recorded updates (one JSON update per line) instead of the synthetic ones")
+    parser.add_argument('--iterations', type=int, default=20, help="number of replays of every update")
+    parser.add_argument('--cold', action='store_true', help="clear the users' cache before every replay")
+    parser.add_argument('--budgets', help="JSON file with the maximum round trips of every update type instead of the default ones")
+    args = parser.parse_args()
+
+    budgets = ROUND_TRIP_BUDGETS
+
+    if args.budgets:
+        with open(args.budgets, encoding='utf-8') as file:
+            budgets = json.load(file)
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot_main = StartBot(os.path.join(directory, 'replay.sqlite3'))
+        SeedUsers()
+
+        from utils import storage
+        storage.backend = CountingBackend(storage.backend)
+
+        updates = GetRecordedUpdates(args.updates) if args.updates else GetSyntheticUpdates()
+        update_ids = count(1)
+        results = {}
+
+        for update, prepare in updates:
+            measurements = []
+
+            # The first replay warms up the caches and is not measured
+            for iteration in range(args.iterations + 1):
+                if prepare:
+                    prepare()
+
+                measurement = Replay(bot_main, storage, update, next(update_ids), args.cold)
+
+                if iteration:
+                    measurements.append(measurement)
+
+            results.setdefault(GetUpdateType(update), []).extend(measurements)
+
+    print(f"{'update type':<34}{'wall, ms':>10}{'cpu, ms':>10}{'db reads':>10}{'db writes':>11}{'telegram':>10}{'budget':>8}")
+
+    exceeded = []
+
+    for update_type, measurements in results.items():
+        reads = max(measurement['db_reads'] for measurement in measurements)
+        writes = max(measurement['db_writes'] for measurement in measurements)
+        calls = max(measurement['telegram'] for measurement in measurements)
+        budget = budgets.get(update_type, None)
+
+        if budget is not None and reads + writes + calls > budget:
+            exceeded.append(f"{update_type}: {reads + writes + calls} round trips, the budget is {budget}")
+
+        print(f"{update_type:<34}{median(measurement['wall'] for measurement in measurements):>10.2f}"
+              f"{median(measurement['cpu'] for measurement in measurements):>10.2f}"
+              f"{reads:>10}{writes:>11}{calls:>10}{'-' if budget is None else budget:>8}")
+
+    if exceeded:
+        print("\nThe round trip budgets are exceeded:\n" + "\n".join(exceeded))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
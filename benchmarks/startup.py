@@ -0,0 +1,116 @@
+# Import necessary modules, classes and functions
+import os
+import sys
+import json
+import subprocess
+import tempfile
+from argparse import ArgumentParser
+from statistics import median
+
+# Define the root directory of the bot
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Define the modules whose import time is measured
+MODULES = [
+    'telebot', 'boto3', 'openai', 'wolframalpha', 'duckduckgo_search',
+    'utils.yandexcloud', 'utils.storage', 'utils.telegram', 'utils.telegram_inline_keyboards', 'utils.openai', 'utils.plugins',
+    'bot',
+]
+
+# Define the code measuring the import time of the module in a fresh interpreter
+IMPORT_CODE = """
+import sys, time
+started = time.perf_counter()
+__import__(sys.argv[1])
+print((time.perf_counter() - started) * 1000)
+"""
+
+# Define the code measuring the time to the first handled update in a fresh interpreter (Bot API calls are faked)
+FIRST_UPDATE_CODE = """
+import time
+started = time.perf_counter()
+
+import json
+from telebot import apihelper
+
+class FakeResponse():
+    status_code = 200
+    reason = 'OK'
+
+    def __init__(self, result):
+        self.text = json.dumps({'ok': True, 'result': result})
+
+    def json(self):
+        return json.loads(self.text)
+
+def FakeRequestSender(method, url, **kwargs):
+    if url.endswith('/sendMessage'):
+        return FakeResponse({'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'}, 'text': ''})
+
+    return FakeResponse(True)
+
+apihelper.CUSTOM_REQUEST_SENDER = FakeRequestSender
+
+import main
+imported = time.perf_counter()
+
+update = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1, 'date': 0, 'text': '/start',
+        'chat': {'id': main.env_vars['OWNER_TELEGRAM_ID'], 'type': 'private'},
+        'from': {'id': main.env_vars['OWNER_TELEGRAM_ID'], 'is_bot': False, 'first_name': 'Owner'},
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+    }
+}
+main.handler({'body': json.dumps(update)}, None)
+handled = time.perf_counter()
+
+print(json.dumps({'init': (imported - started) * 1000, 'first_update': (handled - started) * 1000}))
+"""
+
+# Run the code in a fresh interpreter and get its output (with the additional environment variables)
+def RunFresh(code: str, *args: str, env: dict | None = None) -> str:
+    result = subprocess.run([sys.executable, '-c', code, *args], cwd=ROOT, capture_output=True, text=True, check=True,
+                            env={**os.environ, **(env or {})})
+
+    return result.stdout.strip().splitlines()[-1]
+
+# Measure the startup of the bot and print the report
+def main():
+    parser = ArgumentParser(description="Measure the cold start of the bot: import time per module and time to the first handled update")
+    parser.add_argument('--runs', type=int, default=5, help="number of fresh interpreters for every measurement")
+    parser.add_argument('--backend', choices=('sqlite', 'docapi'), default='sqlite',
+                        help="storage of the first update: a temporary embedded database or DocAPI from DOCAPI_ENDPOINT")
+    args = parser.parse_args()
+
+    print(f"{'module':<36}{'import, ms':>12}")
+
+    for module in MODULES:
+        times = [float(RunFresh(IMPORT_CODE, module)) for _ in range(args.runs)]
+        print(f"{module:<36}{median(times):>12.1f}")
+
+    # DocAPI has to be configured (e.g. a local DynamoDB-compatible one), and the embedded database is created for every run
+    if args.backend == 'docapi' and not os.environ.get('DOCAPI_ENDPOINT'):
+        print("\nDOCAPI_ENDPOINT is not set, the time to the first handled update is not measured")
+        return
+
+    env = {
+        'TELEGRAM_BOT_TOKEN': os.environ.get('TELEGRAM_BOT_TOKEN') or '1:startup',
+        'OWNER_TELEGRAM_ID': os.environ.get('OWNER_TELEGRAM_ID') or '1',
+        'OWNER_TELEGRAM_NAME': os.environ.get('OWNER_TELEGRAM_NAME') or 'owner',
+        'STORAGE_BACKEND': args.backend,
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = [
+            json.loads(RunFresh(FIRST_UPDATE_CODE, env=dict(env, SQLITE_PATH=os.path.join(directory, f'startup-{run}.sqlite3'))))
+            for run in range(args.runs)
+        ]
+
+    print(f"\n{'main.py initialization, ms':<36}{median(result['init'] for result in results):>12.1f}")
+    print(f"{'time to the first handled update, ms':<36}{median(result['first_update'] for result in results):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
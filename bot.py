@@ -2,20 +2,28 @@
 from decimal import Decimal
 from telebot import TeleBot
 from telebot.types import Message, CallbackQuery
-from utils.openai import OpenAIHelper
+from utils.openai import OpenAIHelper, EstimateCost, GetCost, GetHistoryTokenLimit, GetSummaryMessages, GetToolCallsMessage
+from utils.openai import SUMMARY_MODEL
 from utils.plugins import PluginManager
-from utils.telegram_inline_keyboards import (GenKBUserCategoties, GenKBAdmins, GenKBUsers, GenKBBannedUsers,
+from utils.tracing import IsTracingEnabled, AnnotateTrace
+from utils.telegram_callbacks import CallbackRouter, CALLBACK_OUTDATED
+from utils.telegram_inline_keyboards import (GenKBUserCategoties, GenKBUsersPage,
                                              GenKBAdmin, GenKBUser, GenKBBanned, GenKBLanguage, GenKBModel, GenKBBudget,
                                              GenKBDeleteAdmin, GenKBDeleteUser, GenKBDeleteBanned,
                                              GenKBLanguageGeneral, GenKBLanguageSettings, GenKBModelSettings, GenKBSettings)
 from utils.telegram import (GetName, GetCategory, GetLanguage, GetModel, GetBudget,
-                            SetName, SetCategory, SetLanguage, SetModel, SetBudget,
-                            DeleteUserInfo)
-from utils.telegram import BASE_COMMANDS
+                            SetCategory, SetLanguage, SetModel,
+                            IncreaseBudget, DecreaseBudget, ReserveBudget, CommitBudget, GetUserContext, GetUserInfo, SetUserInfo, DeleteUserInfo)
+from utils.telegram import BASE_COMMANDS, GetStartupMarker, StreamMessage, SendMessage
+from utils.telegram import GetResponseCacheKey, GetCachedResponse, SetCachedResponse
+from utils.telegram import AppendHistory, LoadHistory, GetHistory, HistoryToMessages, GetHistoryToSummarize, SaveHistorySummary, ResetHistory
+from utils.telegram import TraceBotAPI
 from utils.telegram import InitEnvVars as InitTelegramEnvVars
-from utils.yandexcloud import InitEnvVars as InitYandexCloudEnvVars
+from utils.storage import InitEnvVars as InitStorageEnvVars
+from utils.tracing import InitEnvVars as InitTracingEnvVars
 from utils.openai import InitEnvVars as InitOpenAIEnvVars
 from utils.plugins import InitEnvVars as InitPluginEnvVars
+from utils.workqueue import InitEnvVars as InitWorkQueueEnvVars
 
 # Define services
 openai_helper: OpenAIHelper | None = None
@@ -23,8 +31,11 @@ plugin_manager: PluginManager | None = None
 
 # Initialize environment variables
 def InitServiceVars(vars: dict):
-    for InitFunc in (InitYandexCloudEnvVars, InitTelegramEnvVars, InitOpenAIEnvVars, InitPluginEnvVars):
+    for InitFunc in (InitTracingEnvVars, InitStorageEnvVars, InitTelegramEnvVars, InitOpenAIEnvVars, InitPluginEnvVars, InitWorkQueueEnvVars):
         InitFunc(vars)
+
+    if IsTracingEnabled():
+        TraceBotAPI()
     
     global openai_helper, plugin_manager
 
@@ -33,23 +44,28 @@ def InitServiceVars(vars: dict):
 
 # Initialize the bot
 def InitBot(vars: dict) -> TeleBot:
-    telegram_bot = TeleBot(vars['TELEGRAM_BOT_TOKEN'])
-    telegram_bot.set_my_commands(commands=BASE_COMMANDS)
-    
-    SetCategory(vars['OWNER_TELEGRAM_ID'], 'owner')
-    SetName(vars['OWNER_TELEGRAM_ID'], vars['OWNER_TELEGRAM_NAME'])
+    # The updates are handled synchronously, so the function returns only after all replies are sent
+    telegram_bot = TeleBot(vars['TELEGRAM_BOT_TOKEN'], threaded=False)
+
+    owner = GetUserInfo(vars['OWNER_TELEGRAM_ID'])
+    marker = GetStartupMarker(vars['OWNER_TELEGRAM_ID'], vars['OWNER_TELEGRAM_NAME'])
+
+    # The startup work is done once for every configuration of the bot, not on every container start
+    if owner is None or owner['info'].get('role') != 'owner' or owner['info'].get('startup') != marker:
+        telegram_bot.set_my_commands(commands=BASE_COMMANDS)
+        SetUserInfo(vars['OWNER_TELEGRAM_ID'], owner, role='owner', name=vars['OWNER_TELEGRAM_NAME'], startup=marker)
 
     return telegram_bot
 
 # Handle incoming messages
-def HandleMessage(telegram_bot: TeleBot, message: Message):
-    if GetCategory(message.from_user.id) in ('banned', 'unknown'):
+def HandleMessage(telegram_bot: TeleBot, message: Message, user: dict):
+    if GetCategory(message.from_user.id, user) in ('banned', 'unknown'):
         SendBannedResponse(telegram_bot, message)
         return
 
     match message.content_type:
         case 'text':
-            HandleTextMessage(telegram_bot, message)
+            HandleTextMessage(telegram_bot, message, user)
         case 'photo':
             HandlePhotoMessage(telegram_bot, message)
         case 'audio' | 'voice':
@@ -64,8 +80,111 @@ def HandleMessage(telegram_bot: TeleBot, message: Message):
             SendDefaultResponse(telegram_bot, message)
 
 # Handle text messages
-def HandleTextMessage(telegram_bot: TeleBot, message: Message):
-    telegram_bot.send_message(message.chat.id, reply_to_message_id=message.message_id, text=message.text)
+def HandleTextMessage(telegram_bot: TeleBot, message: Message, user: dict):
+    chat_id = message.chat.id
+    model = GetModel(message.from_user.id, user)
+
+    request = {'role': 'user', 'content': message.text}
+    turns = LoadHistory(chat_id, GetHistoryTokenLimit(model, [request]))
+
+    cache_key = GetResponseCacheKey(model, request, turns)
+    usage = SendChatResponse(telegram_bot, message, user, model, HistoryToMessages(turns) + [request], cache_key)
+
+    if usage is None:
+        return
+
+    response = {'role': 'assistant', 'content': usage.pop('content')}
+
+    if usage['completion_tokens']:
+        response['tokens'] = usage['completion_tokens']
+
+    turns += AppendHistory(chat_id, [request, response])
+
+    # The history is compacted only after the reply has been sent
+    CompactHistory(chat_id, turns)
+
+# Send the streamed response of the chat model to the user (the usage of the tokens and the text are returned)
+def SendChatResponse(telegram_bot: TeleBot, message: Message, user: dict, model: str, messages: list[dict], cache_key: str | None = None) -> dict | None:
+    user_id = message.from_user.id
+
+    # The cached response costs nothing, so nothing is reserved from the budget for it
+    cached = GetCachedResponse(cache_key) if cache_key else None
+
+    if cached is not None:
+        return {'prompt_tokens': 0, 'completion_tokens': 0, 'content': SendMessage(telegram_bot, message, cached)}
+
+    # The maximum cost of the request is reserved from the budget (the owner and the admins are not limited by it)
+    reserved = EstimateCost(model, messages) if GetCategory(user_id, user) == 'user' else Decimal(0)
+
+    if reserved and not ReserveBudget(user_id, reserved, user):
+        telegram_bot.send_message(message.chat.id, "Sorry, your remaining budget is not enough for this request. Please contact the bot owner for more information.")
+        return None
+
+    usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'tool_calls': 0, 'reserved': reserved}
+
+    try:
+        usage['content'] = StreamMessage(telegram_bot, message, StreamChatResponse(model, messages, usage, user))
+    except Exception:
+        telegram_bot.send_message(message.chat.id, "Something went wrong inside the bot. Try to repeat the request later or contact the bot owner for more information.")
+        return None
+    finally:
+        # The reserved amount includes the rounds of the plugins' calls reserved while streaming
+        reserved = usage.pop('reserved')
+
+        if reserved:
+            CommitBudget(user_id, reserved, GetCost(model, usage['prompt_tokens'], usage['completion_tokens']), user)
+
+    # The responses based on the plugins' results (like the current time) are never cached
+    if cache_key and usage['content'] and not usage['tool_calls']:
+        SetCachedResponse(cache_key, usage['content'])
+
+    return usage
+
+# Fold the oldest turns of the conversation into the running summary when the history grows too long
+def CompactHistory(chat_id: int, turns: list[dict]):
+    folded = GetHistoryToSummarize(turns)
+
+    if not folded:
+        return
+
+    # The reply is already sent, so a failed compaction is just repeated after the next message
+    try:
+        summary, usage = openai_helper.get_chat_response(SUMMARY_MODEL, GetSummaryMessages(HistoryToMessages(folded)))
+    except Exception:
+        return
+
+    SaveHistorySummary(chat_id, folded[-1]['turn'], summary, usage['completion_tokens'])
+
+# Get the text of the chat model's response in parts (the usage of the tokens is saved when the response ends)
+def StreamChatResponse(model: str, messages: list[dict], usage: dict, user: dict):
+    tools = plugin_manager.get_tools()
+
+    for round in range(plugin_manager.max_rounds + 1):
+        tool_calls = []
+
+        # The plugins are not offered in the last round, so the chat model has to answer with the text
+        for content, chunk_usage in openai_helper.get_chat_response_stream(model, messages, tools if round < plugin_manager.max_rounds else None, tool_calls):
+            if chunk_usage:
+                usage['prompt_tokens'] += chunk_usage['prompt_tokens']
+                usage['completion_tokens'] += chunk_usage['completion_tokens']
+
+            yield content
+
+        if not tool_calls:
+            return
+
+        # The plugins requested in one round are called concurrently, and their results are sent in the next round
+        usage['tool_calls'] += len(tool_calls)
+        messages = messages + [GetToolCallsMessage(tool_calls)] + plugin_manager.call_tools(tool_calls)
+
+        if usage['reserved']:
+            amount = EstimateCost(model, messages)
+
+            if not ReserveBudget(int(user['id']), amount, user):
+                yield "Sorry, your remaining budget is not enough to use the plugins for this request. Please contact the bot owner for more information."
+                return
+
+            usage['reserved'] += amount
 
 # Handle photo messages
 def HandlePhotoMessage(telegram_bot: TeleBot, message: Message):
@@ -103,48 +222,57 @@ def SendBannedResponse(telegram_bot: TeleBot, message: Message):
 
 
 # Send a start message to the user
-def Start(telegram_bot: TeleBot, message: Message):
+def Start(telegram_bot: TeleBot, message: Message, user: dict):
     telegram_bot.send_message(message.chat.id, "Hello! I'm ChatGPT Telegram Bot. I can help you with your questions and tasks. Just send me a message and I'll do my best to answer it.")
 
 # Send a help message to the user
-def Help(telegram_bot: TeleBot, message: Message):
+def Help(telegram_bot: TeleBot, message: Message, user: dict):
     telegram_bot.send_message(message.chat.id, "I can help you with your questions and tasks. Just send me a message and I'll do my best to answer it.")
 
 # Change the bot's language for the user
-def Language(telegram_bot: TeleBot, message: Message):
+def Language(telegram_bot: TeleBot, message: Message, user: dict):
     telegram_bot.send_message(message.chat.id, "Which language do you want to choose for the bot?", reply_markup=GenKBLanguageGeneral())
 
 # Get the bot's budget for the user
-def Budget(telegram_bot: TeleBot, message: Message):
-    telegram_bot.send_message(message.chat.id, f"Your current budget for the bot is {GetBudget(message.from_user.id)}$")
+def Budget(telegram_bot: TeleBot, message: Message, user: dict):
+    telegram_bot.send_message(message.chat.id, f"Your current budget for the bot is {GetBudget(message.from_user.id, user)}$")
 
 # Reset the conversation history
-def Reset(telegram_bot: TeleBot, message: Message):
-    if GetCategory(message.from_user.id) not in ('owner', 'admin', 'user'):
+def Reset(telegram_bot: TeleBot, message: Message, user: dict):
+    if GetCategory(message.from_user.id, user) not in ('owner', 'admin', 'user'):
         SendDisallowedResponse(telegram_bot, message)
         return
     
-    telegram_bot.send_message(message.chat.id, "# in the future you will be able to reset the conversation history #")
+    ResetHistory(message.chat.id)
+    telegram_bot.send_message(message.chat.id, "The conversation history was reset. Let's start a new conversation!")
 
 # Summarize the conversation
-def Summarize(telegram_bot: TeleBot, message: Message):
-    if GetCategory(message.from_user.id) not in ('owner', 'admin', 'user'):
+def Summarize(telegram_bot: TeleBot, message: Message, user: dict):
+    if GetCategory(message.from_user.id, user) not in ('owner', 'admin', 'user'):
         SendDisallowedResponse(telegram_bot, message)
         return
     
-    telegram_bot.send_message(message.chat.id, "# in the future you will be able to summarize the conversation #")
+    # Only the running summary and the newer turns are read, not the whole conversation
+    model = GetModel(message.from_user.id, user)
+    messages = GetHistory(message.chat.id, GetHistoryTokenLimit(model, []))
+
+    if not messages:
+        telegram_bot.send_message(message.chat.id, "There is nothing to summarize yet. Just send me a message to start the conversation.")
+        return
+
+    SendChatResponse(telegram_bot, message, user, model, GetSummaryMessages(messages))
 
 # Get the bot's settings
-def Settings(telegram_bot: TeleBot, message: Message):
-    if GetCategory(message.from_user.id) not in ('owner', 'admin'):
+def Settings(telegram_bot: TeleBot, message: Message, user: dict):
+    if GetCategory(message.from_user.id, user) not in ('owner', 'admin'):
         SendDisallowedResponse(telegram_bot, message)
         return
     
     telegram_bot.send_message(message.chat.id, "Which settings do you want to change for the bot?", reply_markup=GenKBSettings())
 
 # Manage users and admins of the bot
-def Users(telegram_bot: TeleBot, message: Message):
-    if GetCategory(message.from_user.id) != 'owner':
+def Users(telegram_bot: TeleBot, message: Message, user: dict):
+    if GetCategory(message.from_user.id, user) != 'owner':
         SendDisallowedResponse(telegram_bot, message)
         return
     
@@ -154,181 +282,247 @@ def Users(telegram_bot: TeleBot, message: Message):
 def SendDisallowedResponse(telegram_bot: TeleBot, message: Message):
     telegram_bot.send_message(message.chat.id, "Sorry, you are not allowed to use this command. Please contact the bot owner for more information.")
 
-# Handle the callback query
-def HandleCallbackQuery(telegram_bot: TeleBot, call: CallbackQuery):
-    call_id = call.id
-    message = call.message
-    data = call.data
-    chat_id = message.chat.id
-    message_id = message.message_id
-    user = call.from_user
-    user_id = user.id
-
-    if data.startswith('language'):
-        if data == 'language_en':
-            SetLanguage(user_id, 'en')
-            telegram_bot.answer_callback_query(call_id, f"Bot language was set to English")
-        elif data == 'language_ru':
-            SetLanguage(user_id, 'ru')
-            telegram_bot.answer_callback_query(call_id, f"Bot language was set to Russian")
-        
-        telegram_bot.edit_message_text(f"Which language do you want to choose for the bot?",
-                                       chat_id, message_id, reply_markup=GenKBLanguageGeneral())
-
-    elif data.startswith('settings'):
-        if GetCategory(user_id) not in ('owner', 'admin'):
-            telegram_bot.answer_callback_query(call_id, "Sorry, you are not allowed to use this command. Please contact the bot owner for more information.", show_alert=True)
-            return
+# Define the router of the callback queries
+callback_router = CallbackRouter()
+
+# Define the chat models by their codes in the callback data
+CALLBACK_MODELS = {
+    'gpt35': 'gpt-3.5-turbo',
+    'gpt4': 'gpt-4',
+}
+
+# Define the languages by their codes in the callback data
+CALLBACK_LANGUAGES = {
+    'en': 'English',
+    'ru': 'Russian',
+}
+
+# Define the titles of the menus managing the users of every category
+MANAGE_TITLES = {
+    'admin': "Managing admins of the Bot:",
+    'user': "Managing users of the Bot:",
+    'banned': "Managing banned users of the Bot:",
+}
+
+# Handle the callback query (the route is found by the callback data, and its permission is checked once)
+def HandleCallbackQuery(telegram_bot: TeleBot, call: CallbackQuery, user: dict):
+    route = callback_router.resolve(call.data)
+
+    # The buttons of the messages sent before the callback data encoding was changed cannot be handled
+    if route is CALLBACK_OUTDATED:
+        telegram_bot.answer_callback_query(call.id, "This menu is outdated. Please open it again with the command.", show_alert=True)
+        return
 
-        if data.startswith('settings_language'):
-            if data == 'settings_language_en':
-                SetLanguage(user_id, 'en')
-                telegram_bot.answer_callback_query(call_id, f"Bot language was set to English")
-
-            elif data == 'settings_language_ru':
-                SetLanguage(user_id, 'ru')
-                telegram_bot.answer_callback_query(call_id, f"Bot language was set to Russian")
-
-            telegram_bot.edit_message_text(f"Which language do you want to choose for the bot?",
-                                           chat_id, message_id, reply_markup=GenKBLanguageSettings())
-            
-        elif data.startswith('settings_model'):
-            if data == 'settings_model_gpt35':
-                SetModel(user_id, 'gpt-3.5-turbo')
-                telegram_bot.answer_callback_query(call_id, f"Chat model for the bot was set to gpt-3.5-turbo")
-            elif data == 'settings_model_gpt4':
-                SetModel(user_id, 'gpt-4')
-                telegram_bot.answer_callback_query(call_id, f"Chat model for the bot was set to gpt-4")
-                
-            telegram_bot.edit_message_text(f"Which chat model do you want to choose for the bot?",
-                                           chat_id, message_id, reply_markup=GenKBModelSettings())
-            
-        else:
-            telegram_bot.edit_message_text(f"Which settings do you want to change for the bot?",
-                                           chat_id, message_id, reply_markup=GenKBSettings())
-
-    elif data.startswith('manage'):
-        if GetCategory(user_id) != 'owner':
-            telegram_bot.answer_callback_query(call_id, "Sorry, you are not allowed to use this command. Please contact the bot owner for more information.", show_alert=True)
-            return
+    if route is None:
+        telegram_bot.answer_callback_query(call.id, "Something went wrong inside the bot. Try to repeat the command later or contact the bot owner for more information.", show_alert=True)
+        return
+
+    handler, roles, args = route
+    AnnotateTrace(callback=handler.__name__)
+
+    if roles is not None and GetCategory(call.from_user.id, user) not in roles:
+        telegram_bot.answer_callback_query(call.id, "Sorry, you are not allowed to use this command. Please contact the bot owner for more information.", show_alert=True)
+        return
 
-        if data == 'manage_admins':
-            telegram_bot.edit_message_text("Managing admins of the Bot:",
-                                           chat_id, message_id, reply_markup=GenKBAdmins())
-        elif data == 'manage_users':
-            telegram_bot.edit_message_text("Managing users of the Bot:",
-                                           chat_id, message_id, reply_markup=GenKBUsers())
-        elif data == 'manage_banned':
-            telegram_bot.edit_message_text("Managing banned users of the Bot:",
-                                           chat_id, message_id, reply_markup=GenKBBannedUsers())
-        
-        elif data.startswith('manage_admin_'):
-            user_id = int(data.split('_')[-1])
-            telegram_bot.edit_message_text(f"What do you want to do for the admin @{GetName(user_id)}?",
-                                           chat_id, message_id, reply_markup=GenKBAdmin(user_id))
-        elif data.startswith('manage_user_'):
-            user_id = int(data.split('_')[-1])
-            telegram_bot.edit_message_text(f"What do you want to do for the user @{GetName(user_id)}?",
-                                           chat_id, message_id, reply_markup=GenKBUser(user_id))
-        elif data.startswith('manage_banned_'):
-            user_id = int(data.split('_')[-1])
-            telegram_bot.edit_message_text(f"What do you want to do with the banned user @{GetName(user_id)}?",
-                                           chat_id, message_id, reply_markup=GenKBBanned(user_id))
-        
-        elif data.startswith('manage_role_'):
-            user_id = int(data.split('_')[-1])
-
-            if data.startswith('manage_role_admin_'):
-                SetCategory(user_id, 'admin')
-                telegram_bot.answer_callback_query(call_id, f"User @{GetName(user_id)} is now an Admin of the Bot", show_alert=True)
-            elif data.startswith('manage_role_user_'):
-                SetCategory(user_id, 'user')
-                telegram_bot.answer_callback_query(call_id, f"User @{GetName(user_id)} is now a User of the Bot", show_alert=True)
-            elif data.startswith('manage_role_banned_'):
-                SetCategory(user_id, 'banned')
-                telegram_bot.answer_callback_query(call_id, f"User @{GetName(user_id)} is now a Banned User of the Bot", show_alert=True)
-            
-            telegram_bot.edit_message_text("Let's manage the users of the Bot:",
-                                           chat_id, message_id, reply_markup=GenKBUserCategoties())
-
-        elif data.startswith('manage_language_'):
-            user_id = int(data.split('_')[-1])
-            
-            if data.startswith('manage_language_en_'):
-                SetLanguage(user_id, 'en')
-                telegram_bot.answer_callback_query(call_id, f"Bot language for the user @{GetName(user_id)} was set to English")
-            elif data.startswith('manage_language_ru_'):
-                SetLanguage(user_id, 'ru')
-                telegram_bot.answer_callback_query(call_id, f"Bot language for the user @{GetName(user_id)} was set to Russian")
-            
-            telegram_bot.edit_message_text(f"Which language do you want to choose for the user @{GetName(user_id)}?\n" +
-                                           f"(Current language: {GetLanguage(user_id)})",
-                                           chat_id, message_id, reply_markup=GenKBLanguage(user_id))
-        
-        elif data.startswith('manage_model_'):
-            user_id = int(data.split('_')[-1])
-
-            if data.startswith('manage_model_gpt35_'):
-                SetModel(user_id, 'gpt-3.5-turbo')
-                telegram_bot.answer_callback_query(call_id, f"Bot model for the user @{GetName(user_id)} was set to gpt-3.5-turbo")
-            elif data.startswith('manage_model_gpt4_'):
-                SetModel(user_id, 'gpt-4')
-                telegram_bot.answer_callback_query(call_id, f"Bot model for the user @{GetName(user_id)} was set to gpt-4")
-            
-            telegram_bot.edit_message_text(f"Which model do you want to choose for the user @{GetName(user_id)}?\n" +
-                                           f"(Current model: {GetModel(user_id)})",
-                                           chat_id, message_id, reply_markup=GenKBModel(user_id))
-
-        elif data.startswith('manage_budget_'):
-            user_id = int(data.split('_')[-1])
-            
-            if data.startswith('manage_budget_increase_'):
-                SetBudget(user_id, Decimal(GetBudget(user_id)) + Decimal(0.1))
-                telegram_bot.answer_callback_query(call_id, f"Bot budget for the user @{GetName(user_id)} was increased by 0.1$ and is now {GetBudget(user_id)}$")
-            elif data.startswith('manage_budget_decrease_'):
-                if GetBudget(user_id) > Decimal(0.1):
-                    SetBudget(user_id, Decimal(GetBudget(user_id)) - Decimal(0.1))
-                    telegram_bot.answer_callback_query(call_id, f"Bot budget for the user @{GetName(user_id)} was decreased by 0.1$ and is now {GetBudget(user_id)}$")
-                else:
-                    SetBudget(user_id, Decimal(0))
-                    telegram_bot.answer_callback_query(call_id, f"Bot budget for the user @{GetName(user_id)} was set to 0$")
-                    
-            telegram_bot.edit_message_text(f"What do you want to do with the budget of the user @{GetName(user_id)}?\n" +
-                                           f"(Current budget: {GetBudget(user_id)})",
-                                           chat_id, message_id, reply_markup=GenKBBudget(user_id))
-        
-        elif data.startswith('manage_delete_'):
-            user_id = int(data.split('_')[-1])
-            
-            if data.startswith('manage_delete_admin_'):
-                telegram_bot.edit_message_text(f"Do you want to delete the user @{GetName(user_id)} (is now an Admin) from the database of the Bot?",
-                                               chat_id, message_id, reply_markup=GenKBDeleteAdmin(user_id))
-            elif data.startswith('manage_delete_user_'):
-                telegram_bot.edit_message_text(f"Do you want to delete the user @{GetName(user_id)} (is now a User) from the database of the Bot?",
-                                               chat_id, message_id, reply_markup=GenKBDeleteUser(user_id))
-            else:
-                telegram_bot.edit_message_text(f"Do you want to delete the user @{GetName(user_id)} (is now a Banned User) from the database of the Bot?",
-                                               chat_id, message_id, reply_markup=GenKBDeleteBanned(user_id))
-            
-        elif data.startswith('manage_remove_'):
-            user_id = int(data.split('_')[-1])
-            
-            DeleteUserInfo(user_id)
-            telegram_bot.answer_callback_query(call_id, f"User @{GetName(user_id)} was totally deleted from the database of the Bot", show_alert=True)
-            
-            if data.startswith('manage_remove_admin_'):
-                telegram_bot.edit_message_text("Managing admins of the Bot:",
-                                               chat_id, message_id, reply_markup=GenKBAdmins())
-            elif data.startswith('manage_remove_user_'):
-                telegram_bot.edit_message_text("Managing users of the Bot:",
-                                               chat_id, message_id, reply_markup=GenKBUsers())
-            else:
-                telegram_bot.edit_message_text("Managing banned users of the Bot:",
-                                               chat_id, message_id, reply_markup=GenKBBannedUsers())
-
-        else:
-            telegram_bot.edit_message_text("Let's manage the users of the Bot:",
-                                           chat_id, message_id, reply_markup=GenKBUserCategoties())
+    handler(telegram_bot, call, user, *args)
+
+# Set the bot's language for the user
+@callback_router.route('language')
+def LanguageCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, language: str):
+    if language in CALLBACK_LANGUAGES:
+        SetLanguage(call.from_user.id, language, user)
+        telegram_bot.answer_callback_query(call.id, f"Bot language was set to {CALLBACK_LANGUAGES[language]}")
+
+    telegram_bot.edit_message_text(f"Which language do you want to choose for the bot?",
+                                   call.message.chat.id, call.message.message_id, reply_markup=GenKBLanguageGeneral())
+
+# Show the bot's settings
+@callback_router.route('settings')
+def SettingsCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict):
+    telegram_bot.edit_message_text(f"Which settings do you want to change for the bot?",
+                                   call.message.chat.id, call.message.message_id, reply_markup=GenKBSettings())
+
+# Show the bot's language settings
+@callback_router.route('settings_language')
+def SettingsLanguageCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict):
+    telegram_bot.edit_message_text(f"Which language do you want to choose for the bot?",
+                                   call.message.chat.id, call.message.message_id, reply_markup=GenKBLanguageSettings())
+
+# Set the bot's language from the settings
+@callback_router.route('settings_language_set')
+def SettingsLanguageSetCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, language: str):
+    if language in CALLBACK_LANGUAGES:
+        SetLanguage(call.from_user.id, language, user)
+        telegram_bot.answer_callback_query(call.id, f"Bot language was set to {CALLBACK_LANGUAGES[language]}")
+
+    SettingsLanguageCallback(telegram_bot, call, user)
+
+# Show the bot's chat model settings
+@callback_router.route('settings_model')
+def SettingsModelCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict):
+    telegram_bot.edit_message_text(f"Which chat model do you want to choose for the bot?",
+                                   call.message.chat.id, call.message.message_id, reply_markup=GenKBModelSettings())
+
+# Set the bot's chat model from the settings
+@callback_router.route('settings_model_set')
+def SettingsModelSetCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, model: str):
+    if model in CALLBACK_MODELS:
+        SetModel(call.from_user.id, CALLBACK_MODELS[model], user)
+        telegram_bot.answer_callback_query(call.id, f"Chat model for the bot was set to {CALLBACK_MODELS[model]}")
+
+    SettingsModelCallback(telegram_bot, call, user)
+
+# Show the categories of the users of the bot
+@callback_router.route('manage')
+def ManageCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict):
+    telegram_bot.edit_message_text("Let's manage the users of the Bot:",
+                                   call.message.chat.id, call.message.message_id, reply_markup=GenKBUserCategoties())
+
+# Show the first page of the users of the category
+@callback_router.route('manage_role')
+def ManageRoleCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, role: str):
+    if role not in MANAGE_TITLES:
+        ManageCallback(telegram_bot, call, user)
+        return
+
+    telegram_bot.edit_message_text(MANAGE_TITLES[role],
+                                   call.message.chat.id, call.message.message_id, reply_markup=GenKBUsersPage(role))
+
+# Show the previous or the next page of the users of the category
+@callback_router.route('manage_page')
+def ManagePageCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, role: str, direction: str, start_id: int):
+    if role not in MANAGE_TITLES:
+        ManageCallback(telegram_bot, call, user)
+        return
 
+    telegram_bot.edit_message_text(MANAGE_TITLES[role],
+                                   call.message.chat.id, call.message.message_id, reply_markup=GenKBUsersPage(role, start_id, direction == 'next'))
+
+# Show the actions for the user of the category
+@callback_router.route('manage_user')
+def ManageUserCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, role: str, user_id: int):
+    target = GetUserContext(user_id)
+
+    match role:
+        case 'admin':
+            telegram_bot.edit_message_text(f"What do you want to do for the admin @{GetName(user_id, target)}?",
+                                           call.message.chat.id, call.message.message_id, reply_markup=GenKBAdmin(user_id))
+        case 'user':
+            telegram_bot.edit_message_text(f"What do you want to do for the user @{GetName(user_id, target)}?",
+                                           call.message.chat.id, call.message.message_id, reply_markup=GenKBUser(user_id))
+        case _:
+            telegram_bot.edit_message_text(f"What do you want to do with the banned user @{GetName(user_id, target)}?",
+                                           call.message.chat.id, call.message.message_id, reply_markup=GenKBBanned(user_id))
+
+# Change the category of the user
+@callback_router.route('manage_set_role')
+def ManageSetRoleCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, role: str, user_id: int):
+    target = GetUserContext(user_id)
+    titles = {
+        'admin': "an Admin",
+        'user': "a User",
+        'banned': "a Banned User",
+    }
+
+    if role in titles:
+        SetCategory(user_id, role, target)
+        telegram_bot.answer_callback_query(call.id, f"User @{GetName(user_id, target)} is now {titles[role]} of the Bot", show_alert=True)
+
+    ManageCallback(telegram_bot, call, user)
+
+# Show the languages for the user
+@callback_router.route('manage_language')
+def ManageLanguageCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, user_id: int, target: dict | None = None):
+    target = target or GetUserContext(user_id)
+
+    telegram_bot.edit_message_text(f"Which language do you want to choose for the user @{GetName(user_id, target)}?\n" +
+                                   f"(Current language: {GetLanguage(user_id, target)})",
+                                   call.message.chat.id, call.message.message_id, reply_markup=GenKBLanguage(user_id))
+
+# Set the language for the user
+@callback_router.route('manage_language_set')
+def ManageLanguageSetCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, language: str, user_id: int):
+    target = GetUserContext(user_id)
+
+    if language in CALLBACK_LANGUAGES:
+        SetLanguage(user_id, language, target)
+        telegram_bot.answer_callback_query(call.id, f"Bot language for the user @{GetName(user_id, target)} was set to {CALLBACK_LANGUAGES[language]}")
+
+    ManageLanguageCallback(telegram_bot, call, user, user_id, target)
+
+# Show the chat models for the user
+@callback_router.route('manage_model')
+def ManageModelCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, user_id: int, target: dict | None = None):
+    target = target or GetUserContext(user_id)
+
+    telegram_bot.edit_message_text(f"Which model do you want to choose for the user @{GetName(user_id, target)}?\n" +
+                                   f"(Current model: {GetModel(user_id, target)})",
+                                   call.message.chat.id, call.message.message_id, reply_markup=GenKBModel(user_id))
+
+# Set the chat model for the user
+@callback_router.route('manage_model_set')
+def ManageModelSetCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, model: str, user_id: int):
+    target = GetUserContext(user_id)
+
+    if model in CALLBACK_MODELS:
+        SetModel(user_id, CALLBACK_MODELS[model], target)
+        telegram_bot.answer_callback_query(call.id, f"Bot model for the user @{GetName(user_id, target)} was set to {CALLBACK_MODELS[model]}")
+
+    ManageModelCallback(telegram_bot, call, user, user_id, target)
+
+# Show the remaining budget of the user
+@callback_router.route('manage_budget')
+def ManageBudgetCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, user_id: int, target: dict | None = None):
+    target = target or GetUserContext(user_id)
+
+    telegram_bot.edit_message_text(f"What do you want to do with the budget of the user @{GetName(user_id, target)}?\n" +
+                                   f"(Current budget: {GetBudget(user_id, target)})",
+                                   call.message.chat.id, call.message.message_id, reply_markup=GenKBBudget(user_id))
+
+# Increase or decrease the remaining budget of the user
+@callback_router.route('manage_budget_change')
+def ManageBudgetChangeCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, direction: str, user_id: int):
+    target = GetUserContext(user_id)
+
+    if direction == 'increase':
+        budget = IncreaseBudget(user_id, Decimal('0.1'), target)
+    elif direction == 'decrease':
+        budget = DecreaseBudget(user_id, Decimal('0.1'), target)
+    else:
+        return ManageBudgetCallback(telegram_bot, call, user, user_id, target)
+
+    # Nothing is written if the user is missing or the write has failed
+    if budget is None:
+        telegram_bot.answer_callback_query(call.id, f"Bot budget for the user @{GetName(user_id, target)} was not changed. Try again later.", show_alert=True)
+    elif direction == 'decrease' and budget == 0:
+        telegram_bot.answer_callback_query(call.id, f"Bot budget for the user @{GetName(user_id, target)} was set to 0$")
     else:
-        telegram_bot.answer_callback_query(call_id, "Something went wrong inside the bot. Try to repeat the command later or contact the bot owner for more information.", show_alert=True)
\ No newline at end of file
+        telegram_bot.answer_callback_query(call.id, f"Bot budget for the user @{GetName(user_id, target)} was {direction}d by 0.1$ and is now {budget}$")
+
+    ManageBudgetCallback(telegram_bot, call, user, user_id, target)
+
+# Ask for the confirmation of deleting the user
+@callback_router.route('manage_delete')
+def ManageDeleteCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, role: str, user_id: int):
+    target = GetUserContext(user_id)
+
+    match role:
+        case 'admin':
+            telegram_bot.edit_message_text(f"Do you want to delete the user @{GetName(user_id, target)} (is now an Admin) from the database of the Bot?",
+                                           call.message.chat.id, call.message.message_id, reply_markup=GenKBDeleteAdmin(user_id))
+        case 'user':
+            telegram_bot.edit_message_text(f"Do you want to delete the user @{GetName(user_id, target)} (is now a User) from the database of the Bot?",
+                                           call.message.chat.id, call.message.message_id, reply_markup=GenKBDeleteUser(user_id))
+        case _:
+            telegram_bot.edit_message_text(f"Do you want to delete the user @{GetName(user_id, target)} (is now a Banned User) from the database of the Bot?",
+                                           call.message.chat.id, call.message.message_id, reply_markup=GenKBDeleteBanned(user_id))
+
+# Delete the user from the database
+@callback_router.route('manage_remove')
+def ManageRemoveCallback(telegram_bot: TeleBot, call: CallbackQuery, user: dict, role: str, user_id: int):
+    target = GetUserContext(user_id)
+
+    DeleteUserInfo(user_id)
+    telegram_bot.answer_callback_query(call.id, f"User @{GetName(user_id, target)} was totally deleted from the database of the Bot", show_alert=True)
+
+    ManageRoleCallback(telegram_bot, call, user, role if role in MANAGE_TITLES else 'banned')
@@ -1,9 +1,13 @@
 # Import necessary modules, classes and functions
 import os
 import json
+from threading import local
+from telebot import TeleBot
 from telebot.types import Update, Message, CallbackQuery
 import bot
-from utils.telegram import UpdateBotCommands
+from utils.telegram import UpdateBotCommands, GetUserContext, PrefetchUserInfo, WebhookReply, ClaimUpdate, ReleaseUpdate
+from utils.tracing import StartTrace, AnnotateTrace, TracedHandler
+from utils.workqueue import IsWorkQueueEnabled, GetWorkQueue
 from bot import InitServiceVars, InitBot
 
 # Read environment variables
@@ -11,6 +15,8 @@ env_vars = {
     'ACCESS_KEY_ID': os.environ.get('ACCESS_KEY_ID'),
     'SECRET_ACCESS_KEY': os.environ.get('SECRET_ACCESS_KEY'),
     'DOCAPI_ENDPOINT': os.environ.get('DOCAPI_ENDPOINT'),
+    'STORAGE_BACKEND': os.environ.get('STORAGE_BACKEND'),
+    'SQLITE_PATH': os.environ.get('SQLITE_PATH'),
     'TELEGRAM_BOT_TOKEN': os.environ.get('TELEGRAM_BOT_TOKEN'),
     'OWNER_TELEGRAM_ID': os.environ.get('OWNER_TELEGRAM_ID'),
     'OWNER_TELEGRAM_NAME': os.environ.get('OWNER_TELEGRAM_NAME'),
@@ -18,8 +24,42 @@ env_vars = {
     'WOLFRAM_APP_ID': os.environ.get('WOLFRAM_APP_ID'),
     'DUCKDUCKGO_SAFESEARCH': os.environ.get('DUCKDUCKGO_SAFESEARCH'),
     'WORLDTIME_DEFAULT_TIMEZONE': os.environ.get('WORLDTIME_DEFAULT_TIMEZONE'),
+    'PLUGINS': os.environ.get('PLUGINS'),
+    'PLUGIN_MAX_WORKERS': os.environ.get('PLUGIN_MAX_WORKERS'),
+    'PLUGIN_MAX_ROUNDS': os.environ.get('PLUGIN_MAX_ROUNDS'),
+    'PLUGIN_CACHE_SIZE': os.environ.get('PLUGIN_CACHE_SIZE'),
+    'PLUGIN_CACHE_PERSISTENT': os.environ.get('PLUGIN_CACHE_PERSISTENT'),
+    'USER_CACHE_SIZE': os.environ.get('USER_CACHE_SIZE'),
+    'USER_CACHE_TTL': os.environ.get('USER_CACHE_TTL'),
+    'USER_CACHE_STRICT': os.environ.get('USER_CACHE_STRICT'),
+    'WEBHOOK_REPLY': os.environ.get('WEBHOOK_REPLY'),
+    'OPENAI_MAX_TOKENS': os.environ.get('OPENAI_MAX_TOKENS'),
+    'STREAM_EDIT_INTERVAL': os.environ.get('STREAM_EDIT_INTERVAL'),
+    'STREAM_MIN_DELTA': os.environ.get('STREAM_MIN_DELTA'),
+    'HISTORY_TTL': os.environ.get('HISTORY_TTL'),
+    'HISTORY_SUMMARY_THRESHOLD': os.environ.get('HISTORY_SUMMARY_THRESHOLD'),
+    'RESPONSE_CACHE': os.environ.get('RESPONSE_CACHE'),
+    'RESPONSE_CACHE_SIZE': os.environ.get('RESPONSE_CACHE_SIZE'),
+    'RESPONSE_CACHE_TTL': os.environ.get('RESPONSE_CACHE_TTL'),
+    'RESPONSE_CACHE_PERSISTENT': os.environ.get('RESPONSE_CACHE_PERSISTENT'),
+    'RESPONSE_CACHE_HISTORY': os.environ.get('RESPONSE_CACHE_HISTORY'),
+    'RESPONSE_CACHE_PROMPT_LIMIT': os.environ.get('RESPONSE_CACHE_PROMPT_LIMIT'),
+    'TRACING_SAMPLE_RATE': os.environ.get('TRACING_SAMPLE_RATE'),
+    'TRACING_SLOW_THRESHOLD': os.environ.get('TRACING_SLOW_THRESHOLD'),
+    'METRICS': os.environ.get('METRICS'),
+    'UPDATE_DEDUP': os.environ.get('UPDATE_DEDUP'),
+    'UPDATE_DEDUP_TTL': os.environ.get('UPDATE_DEDUP_TTL'),
+    'UPDATE_DEDUP_CACHE_SIZE': os.environ.get('UPDATE_DEDUP_CACHE_SIZE'),
+    'WORK_QUEUE': os.environ.get('WORK_QUEUE'),
+    'WORK_QUEUE_URL': os.environ.get('WORK_QUEUE_URL'),
+    'WORK_QUEUE_PATH': os.environ.get('WORK_QUEUE_PATH'),
+    'WORK_QUEUE_VISIBILITY_TIMEOUT': os.environ.get('WORK_QUEUE_VISIBILITY_TIMEOUT'),
+    'WORK_QUEUE_MAX_ATTEMPTS': os.environ.get('WORK_QUEUE_MAX_ATTEMPTS'),
 }
 
+# Return the last reply of the handlers in the webhook response (opt-in)
+WEBHOOK_REPLY = (env_vars['WEBHOOK_REPLY'] or '').lower() in ('1', 'true', 'yes')
+
 # Initialize environment variables
 InitServiceVars(env_vars)
 
@@ -27,75 +67,229 @@ InitServiceVars(env_vars)
 telegram_bot = InitBot(env_vars)
 
 
-# Handle incoming updates from Telegram
+# Define the context of the update being handled
+update_context = local()
+
+
+# Handle incoming updates from Telegram (a single update, a list of updates or a message queue trigger batch)
 def handler(event, _):
-    request_body = json.loads(event['body'])
-    update = Update.de_json(request_body)
-    telegram_bot.process_new_updates([update])
+    # In the split mode the webhook is acknowledged at once, and the updates are handled by the worker (worker.py or the queue trigger)
+    if IsWorkQueueEnabled() and 'messages' not in event:
+        EnqueueUpdates(ParseUpdateBodies(event))
+
+        return {
+            'statusCode': 200
+        }
+
+    updates = ParseUpdates(event)
+
+    if WEBHOOK_REPLY and len(updates) == 1 and 'messages' not in event:
+        return HandleWithWebhookReply(updates[0])
+
+    # The users of the whole batch are read at once, and the updates of every chat keep their order
+    PrefetchUserInfo([user_id for user_id in map(GetUpdateUserId, updates) if user_id is not None])
+
+    for update in sorted(updates, key=lambda update: update.update_id):
+        ProcessUpdate(update)
 
     return {
         'statusCode': 200
     }
 
+# Handle the update and return the last reply of the handlers in the webhook response
+def HandleWithWebhookReply(update: Update):
+    # The retried delivery is acknowledged without a reply, the first one has already got it
+    if not ClaimUpdate(update.update_id):
+        return {
+            'statusCode': 200
+        }
+
+    update_context.bot = WebhookReply(telegram_bot)
+
+    try:
+        with StartTrace('update', update_id=update.update_id, update_type=GetUpdateType(update)):
+            telegram_bot.process_new_updates([update])
+            reply = update_context.bot.response()
+            AnnotateTrace(webhook_reply=reply['method'] if reply else None)
+    except Exception:
+        ReleaseUpdate(update.update_id)
+        raise
+    finally:
+        update_context.bot = telegram_bot
+
+    if reply is None:
+        return {
+            'statusCode': 200
+        }
+
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json'
+        },
+        'body': json.dumps(reply)
+    }
+
+# Handle the update with the handlers once (one trace is started for every update if the tracing is enabled)
+def ProcessUpdate(update: Update):
+    # The update_id is claimed before the handlers run, so the retried delivery is acknowledged without a second reply or charge
+    if not ClaimUpdate(update.update_id):
+        return
+
+    try:
+        with StartTrace('update', update_id=update.update_id, update_type=GetUpdateType(update)):
+            telegram_bot.process_new_updates([update])
+    except Exception:
+        ReleaseUpdate(update.update_id)
+        raise
+
+# Put the updates to the work queue (the updates of one chat are in one group, so the worker handles them in their order)
+def EnqueueUpdates(bodies: list[dict]):
+    messages = []
+
+    for body in bodies:
+        # The update is parsed before it is acknowledged, so the malformed one is rejected at once
+        update = Update.de_json(body)
+        chat_id = GetUpdateChatId(update)
+
+        messages.append({
+            'group': str(chat_id if chat_id is not None else update.update_id),
+            'dedup': str(update.update_id),
+            'body': json.dumps(body, ensure_ascii=False)
+        })
+
+    if messages:
+        GetWorkQueue().send(messages)
+
+# Get the updates from the event of the function
+def ParseUpdates(event: dict) -> list[Update]:
+    return [Update.de_json(body) for body in ParseUpdateBodies(event)]
+
+# Get the updates from the event of the function as they were sent by Telegram
+def ParseUpdateBodies(event: dict) -> list[dict]:
+    if 'messages' in event:
+        bodies = [message['details']['message']['body'] for message in event['messages']]
+    else:
+        bodies = [event['body']]
+
+    updates = []
+
+    for body in bodies:
+        request_body = json.loads(body)
+        updates += request_body if isinstance(request_body, list) else [request_body]
+
+    return updates
+
+# Get the type of the update
+def GetUpdateType(update: Update) -> str:
+    if update.message:
+        return 'message'
+    if update.callback_query:
+        return 'callback_query'
+
+    return 'other'
+
+# Get the id of the user who sent the update
+def GetUpdateUserId(update: Update) -> int | None:
+    if update.message:
+        return update.message.from_user.id
+    if update.callback_query:
+        return update.callback_query.from_user.id
+
+    return None
+
+# Get the id of the chat where the update came from (the updates of one chat are handled in order)
+def GetUpdateChatId(update: Update) -> int | None:
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query and update.callback_query.message:
+        return update.callback_query.message.chat.id
+
+    return None
+
+# Get the bot for the handlers of the current update
+def GetUpdateBot() -> TeleBot:
+    return getattr(update_context, 'bot', telegram_bot)
+
 
 # Introduce the bot to the user
 @telegram_bot.message_handler(commands=["start"])
+@TracedHandler
 def start(message: Message):
-    UpdateBotCommands(telegram_bot, message.chat.id, message.from_user.id)
-    bot.Start(telegram_bot, message)
+    user = GetUserContext(message.from_user.id, authorization=True)
+    UpdateBotCommands(GetUpdateBot(), message.chat.id, user)
+    bot.Start(GetUpdateBot(), message, user)
 
 # Get the bot's help message
 @telegram_bot.message_handler(commands=["help"])
+@TracedHandler
 def help(message: Message):
-    UpdateBotCommands(telegram_bot, message.chat.id, message.from_user.id)
-    bot.Help(telegram_bot, message)
+    user = GetUserContext(message.from_user.id, authorization=True)
+    UpdateBotCommands(GetUpdateBot(), message.chat.id, user)
+    bot.Help(GetUpdateBot(), message, user)
 
 # Change the bot's language for the user
 @telegram_bot.message_handler(commands=["language"])
+@TracedHandler
 def language(message: Message):
-    UpdateBotCommands(telegram_bot, message.chat.id, message.from_user.id)
-    bot.Language(telegram_bot, message)
+    user = GetUserContext(message.from_user.id, authorization=True)
+    UpdateBotCommands(GetUpdateBot(), message.chat.id, user)
+    bot.Language(GetUpdateBot(), message, user)
 
 # Get the bot's budget for the user
 @telegram_bot.message_handler(commands=["budget"])
+@TracedHandler
 def stats(message: Message):
-    UpdateBotCommands(telegram_bot, message.chat.id, message.from_user.id)
-    bot.Budget(telegram_bot, message)
+    user = GetUserContext(message.from_user.id, authorization=True)
+    UpdateBotCommands(GetUpdateBot(), message.chat.id, user)
+    bot.Budget(GetUpdateBot(), message, user)
 
 # Reset the conversation history
 @telegram_bot.message_handler(commands=["reset"])
+@TracedHandler
 def reset(message: Message):
-    UpdateBotCommands(telegram_bot, message.chat.id, message.from_user.id)
-    bot.Reset(telegram_bot, message)
+    user = GetUserContext(message.from_user.id, authorization=True)
+    UpdateBotCommands(GetUpdateBot(), message.chat.id, user)
+    bot.Reset(GetUpdateBot(), message, user)
 
 # Summarize the conversation history
 @telegram_bot.message_handler(commands=["summarize"])
+@TracedHandler
 def summarize(message: Message):
-    UpdateBotCommands(telegram_bot, message.chat.id, message.from_user.id)
-    bot.Summarize(telegram_bot, message)
+    user = GetUserContext(message.from_user.id, authorization=True)
+    UpdateBotCommands(GetUpdateBot(), message.chat.id, user)
+    bot.Summarize(GetUpdateBot(), message, user)
 
 # Get the bot's settings
 @telegram_bot.message_handler(commands=["settings"])
+@TracedHandler
 def settings(message: Message):
-    UpdateBotCommands(telegram_bot, message.chat.id, message.from_user.id)
-    bot.Settings(telegram_bot, message)
+    user = GetUserContext(message.from_user.id, authorization=True)
+    UpdateBotCommands(GetUpdateBot(), message.chat.id, user)
+    bot.Settings(GetUpdateBot(), message, user)
 
 # Manage users and admins of the bot
 @telegram_bot.message_handler(commands=["users"])
+@TracedHandler
 def users(message: Message):
-    UpdateBotCommands(telegram_bot, message.chat.id, message.from_user.id)
-    bot.Users(telegram_bot, message)
+    user = GetUserContext(message.from_user.id, authorization=True)
+    UpdateBotCommands(GetUpdateBot(), message.chat.id, user)
+    bot.Users(GetUpdateBot(), message, user)
 
 
 # Handle all other messages
 @telegram_bot.message_handler(func=lambda message: True, content_types=['animation', 'audio', 'contact', 'dice', 'document', 'location', 'photo', 'poll', 'sticker', 'text', 'venue', 'video', 'video_note', 'voice'])
+@TracedHandler
 def handle_message(message: Message):
-    UpdateBotCommands(telegram_bot, message.chat.id, message.from_user.id)
-    bot.HandleMessage(telegram_bot, message)
+    user = GetUserContext(message.from_user.id, authorization=True)
+    UpdateBotCommands(GetUpdateBot(), message.chat.id, user)
+    bot.HandleMessage(GetUpdateBot(), message, user)
 
 
 # Handle the callback query
 @telegram_bot.callback_query_handler(func=lambda call: True)
+@TracedHandler
 def callback_query(call: CallbackQuery):
-    UpdateBotCommands(telegram_bot, call.message.chat.id, call.from_user.id)
-    bot.HandleCallbackQuery(telegram_bot, call)
\ No newline at end of file
+    user = GetUserContext(call.from_user.id, authorization=True)
+    UpdateBotCommands(GetUpdateBot(), call.message.chat.id, user)
+    bot.HandleCallbackQuery(GetUpdateBot(), call, user)
\ No newline at end of file
@@ -0,0 +1,18 @@
+# Import necessary modules, classes and functions
+import os
+from utils.yandexcloud import InitEnvVars, migrate_role_index, migrate_history_table, migrate_cache_table
+
+# Read environment variables
+env_vars = {
+    'ACCESS_KEY_ID': os.environ.get('ACCESS_KEY_ID'),
+    'SECRET_ACCESS_KEY': os.environ.get('SECRET_ACCESS_KEY'),
+    'DOCAPI_ENDPOINT': os.environ.get('DOCAPI_ENDPOINT'),
+}
+
+# Run the one-off migrations of the database
+if __name__ == '__main__':
+    InitEnvVars(env_vars)
+
+    print(f"Role index is ready, {migrate_role_index()} users were migrated")
+    print(f"History table is ready{' (created)' if migrate_history_table() else ''}, its turns expire by expire_at")
+    print(f"Cache table is ready{' (created)' if migrate_cache_table() else ''}, its values expire by expire_at")
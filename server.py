@@ -0,0 +1,285 @@
+# Import necessary modules, classes and functions
+import os
+import signal
+import asyncio
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from aiohttp import web, ClientSession, ClientTimeout, ClientError
+from telebot.types import Update
+from main import env_vars, telegram_bot, GetUpdateUserId, GetUpdateChatId, ProcessUpdate
+from utils.telegram import PrefetchUserInfo
+from utils.tracing import ReportMetric, ReportError
+
+# Read environment variables of the long-running server
+server_vars = {
+    'SERVER_MODE': os.environ.get('SERVER_MODE'),
+    'SERVER_HOST': os.environ.get('SERVER_HOST'),
+    'SERVER_PORT': os.environ.get('SERVER_PORT'),
+    'SERVER_WEBHOOK_PATH': os.environ.get('SERVER_WEBHOOK_PATH'),
+    'SERVER_WEBHOOK_URL': os.environ.get('SERVER_WEBHOOK_URL'),
+    'SERVER_WEBHOOK_SECRET': os.environ.get('SERVER_WEBHOOK_SECRET'),
+    'SERVER_CONCURRENCY': os.environ.get('SERVER_CONCURRENCY'),
+    'SERVER_WORKERS': os.environ.get('SERVER_WORKERS'),
+    'SERVER_METRICS_INTERVAL': os.environ.get('SERVER_METRICS_INTERVAL'),
+}
+
+# Define the settings of the server (long polling by default, the webhook server if it is chosen)
+SERVER_MODE = server_vars['SERVER_MODE'] or 'polling'
+SERVER_HOST = server_vars['SERVER_HOST'] or '0.0.0.0'
+SERVER_PORT = int(server_vars['SERVER_PORT'] or 8080)
+SERVER_WEBHOOK_PATH = server_vars['SERVER_WEBHOOK_PATH'] or '/webhook'
+SERVER_WEBHOOK_URL = server_vars['SERVER_WEBHOOK_URL']
+SERVER_WEBHOOK_SECRET = server_vars['SERVER_WEBHOOK_SECRET']
+SERVER_CONCURRENCY = int(server_vars['SERVER_CONCURRENCY'] or 256)
+SERVER_WORKERS = int(server_vars['SERVER_WORKERS'] or 0)
+SERVER_METRICS_INTERVAL = float(server_vars['SERVER_METRICS_INTERVAL'] or 10.0)
+
+# Define the time (in seconds) for which one long polling request waits for the updates
+POLLING_TIMEOUT = 30
+
+# Define the URL of the Bot API method getting the updates
+GET_UPDATES_URL = "https://api.telegram.org/bot{token}/getUpdates"
+
+
+# The dispatcher of the updates: the chats are handled concurrently, and the updates of one chat in their order
+class UpdateDispatcher():
+    def __init__(self, concurrency: int, handle: Callable[[Update], None] | None = None):
+        self.handle = handle or HandleUpdate
+
+        # The handlers of bot.py are synchronous, so they run on the threads, and the global limit is shared by all chats
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='update')
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.chats = {}
+        self.tasks = set()
+
+    # Put the update to the queue of its chat (the chat's queue is drained by a single task)
+    def dispatch(self, update: Update):
+        chat_id = GetUpdateChatId(update)
+        key = chat_id if chat_id is not None else ('update', update.update_id)
+
+        if key in self.chats:
+            self.chats[key].append(update)
+            return
+
+        self.chats[key] = deque([update])
+
+        task = asyncio.get_running_loop().create_task(self.drain(key))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    # Handle the updates of the chat one by one until its queue is empty
+    async def drain(self, key):
+        pending = self.chats[key]
+
+        try:
+            while pending:
+                async with self.semaphore:
+                    await asyncio.get_running_loop().run_in_executor(self.executor, self.handle, pending[0])
+
+                pending.popleft()
+        finally:
+            del self.chats[key]
+
+    # Wait until all received updates are handled
+    async def join(self):
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        self.executor.shutdown()
+
+# The dispatcher sharding the updates by their chats across the worker processes (every worker handles its chats in order)
+class ShardedDispatcher():
+    def __init__(self, workers: int, concurrency: int):
+        # The workers are started fresh, so each of them initializes its own bot, database resources and clients
+        context = multiprocessing.get_context('spawn')
+
+        self.queues = [context.Queue() for _ in range(workers)]
+        self.handled = [context.Value('q', 0) for _ in range(workers)]
+        self.sent = [0] * workers
+        self.processes = [
+            context.Process(target=RunWorker, args=(queue, handled, concurrency), name=f'worker-{number}')
+            for number, (queue, handled) in enumerate(zip(self.queues, self.handled))
+        ]
+
+        for process in self.processes:
+            process.start()
+
+    # Send the update to the worker of its chat
+    def dispatch(self, update: Update):
+        chat_id = GetUpdateChatId(update)
+        worker = (chat_id if chat_id is not None else update.update_id) % len(self.queues)
+
+        self.sent[worker] += 1
+        self.queues[worker].put(update)
+
+    # Get the numbers of the updates sent to every worker but not handled yet
+    def depths(self) -> list[int]:
+        return [sent - handled.value for sent, handled in zip(self.sent, self.handled)]
+
+    # Report the queue depths of the workers periodically
+    async def report(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+
+            for number, depth in enumerate(self.depths()):
+                ReportMetric('worker_queue_depth', worker=number, depth=depth)
+
+    # Stop the workers after they handle all sent updates
+    async def join(self):
+        for queue in self.queues:
+            queue.put(None)
+
+        await asyncio.get_running_loop().run_in_executor(None, lambda: [process.join() for process in self.processes])
+
+# Run the worker handling the updates from its queue until it gets the signal to stop (None)
+def RunWorker(queue, handled, concurrency: int):
+    # The dispatcher stops the workers itself after the received updates are sent, so the signals of the whole group are ignored
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    asyncio.run(ServeWorker(queue, handled, concurrency))
+
+# Handle the updates from the worker's queue (the chats of the worker are handled concurrently, like in the single process)
+async def ServeWorker(queue, handled, concurrency: int):
+    loop = asyncio.get_running_loop()
+
+    def handle(update: Update):
+        HandleUpdate(update)
+
+        with handled.get_lock():
+            handled.value += 1
+
+    dispatcher = UpdateDispatcher(concurrency, handle)
+
+    while (update := await loop.run_in_executor(None, queue.get)) is not None:
+        dispatcher.dispatch(update)
+
+    await dispatcher.join()
+
+# Handle the update with the handlers of bot.py (the failed update does not stop the others)
+def HandleUpdate(update: Update):
+    try:
+        ProcessUpdate(update)
+    except Exception as error:
+        ReportError('update', error, update_id=update.update_id)
+
+# Read the users of the updates at once before handling them
+async def PrefetchUpdateUsers(updates: list[Update]):
+    user_ids = [user_id for user_id in map(GetUpdateUserId, updates) if user_id is not None]
+
+    if user_ids:
+        await asyncio.get_running_loop().run_in_executor(None, PrefetchUserInfo, user_ids)
+
+# Receive the updates with long polling until the server is stopped
+async def PollUpdates(dispatcher: UpdateDispatcher | ShardedDispatcher, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    url = GET_UPDATES_URL.format(token=env_vars['TELEGRAM_BOT_TOKEN'])
+    offset = None
+
+    # The updates cannot be polled while the webhook is set
+    await loop.run_in_executor(None, telegram_bot.delete_webhook)
+
+    async with ClientSession(timeout=ClientTimeout(total=POLLING_TIMEOUT + 10)) as session:
+        while not stop.is_set():
+            request = asyncio.ensure_future(session.post(url, json={'offset': offset, 'timeout': POLLING_TIMEOUT}))
+            stopping = asyncio.ensure_future(stop.wait())
+
+            await asyncio.wait([request, stopping], return_when=asyncio.FIRST_COMPLETED)
+            stopping.cancel()
+
+            if not request.done():
+                request.cancel()
+                break
+
+            try:
+                async with request.result() as response:
+                    result = await response.json()
+            except (ClientError, asyncio.TimeoutError, ValueError):
+                await asyncio.sleep(1)
+                continue
+
+            if not result.get('ok'):
+                await asyncio.sleep(1)
+                continue
+
+            updates = [Update.de_json(update) for update in result['result']]
+
+            if not updates:
+                continue
+
+            offset = updates[-1].update_id + 1
+
+            # The workers have their own caches, so the users are prefetched only for the handling in this process
+            if isinstance(dispatcher, UpdateDispatcher):
+                await PrefetchUpdateUsers(updates)
+
+            for update in updates:
+                dispatcher.dispatch(update)
+
+        # The received updates are confirmed, so they are not delivered again after the restart
+        if offset is not None:
+            try:
+                async with session.post(url, json={'offset': offset, 'timeout': 0}) as response:
+                    await response.read()
+            except (ClientError, asyncio.TimeoutError):
+                pass
+
+# Create the web application receiving the updates with the webhook
+def CreateWebhookApp(dispatcher: UpdateDispatcher | ShardedDispatcher) -> web.Application:
+    async def webhook(request: web.Request) -> web.Response:
+        if SERVER_WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != SERVER_WEBHOOK_SECRET:
+            return web.Response(status=403)
+
+        body = await request.json()
+        updates = [Update.de_json(update) for update in (body if isinstance(body, list) else [body])]
+
+        # Telegram gets the response at once, and the updates are handled in the background
+        for update in updates:
+            dispatcher.dispatch(update)
+
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(SERVER_WEBHOOK_PATH, webhook)
+
+    return app
+
+# Run the server until it gets the signal to stop (the received updates are handled before the exit)
+async def Serve():
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+
+    # With several workers the concurrency limit applies to every one of them
+    if SERVER_WORKERS > 0:
+        dispatcher = ShardedDispatcher(SERVER_WORKERS, SERVER_CONCURRENCY)
+        reporter = loop.create_task(dispatcher.report(SERVER_METRICS_INTERVAL))
+    else:
+        dispatcher = UpdateDispatcher(SERVER_CONCURRENCY)
+        reporter = None
+
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+
+    if SERVER_MODE == 'webhook':
+        runner = web.AppRunner(CreateWebhookApp(dispatcher))
+        await runner.setup()
+        await web.TCPSite(runner, SERVER_HOST, SERVER_PORT).start()
+
+        if SERVER_WEBHOOK_URL:
+            await loop.run_in_executor(None, lambda: telegram_bot.set_webhook(SERVER_WEBHOOK_URL, secret_token=SERVER_WEBHOOK_SECRET))
+
+        await stop.wait()
+        await runner.cleanup()
+    else:
+        await PollUpdates(dispatcher, stop)
+
+    await dispatcher.join()
+
+    if reporter is not None:
+        reporter.cancel()
+
+
+if __name__ == '__main__':
+    asyncio.run(Serve())
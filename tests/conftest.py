@@ -0,0 +1,19 @@
+# Import necessary modules, classes and functions
+import os
+import sys
+from threading import local
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils.storage as storage
+import utils.sqlite as sqlite
+
+# Use the embedded SQLite backend with a fresh database (the connections of the previous test are not reused)
+@pytest.fixture
+def sqlite_storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlite, 'sqlite_local', local())
+    monkeypatch.setattr(sqlite, 'SQLITE_PATH', str(tmp_path / 'bot.sqlite3'))
+    monkeypatch.setattr(storage, 'backend', sqlite)
+
+    return storage
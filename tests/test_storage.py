@@ -0,0 +1,62 @@
+# Import necessary modules, classes and functions
+from decimal import Decimal
+import utils.telegram as telegram
+from utils.telegram import DEFAULT_USER_INFO
+
+# Create the user with the specified budget
+def NewUser(storage, id: int, budget: Decimal) -> Decimal:
+    storage.query_upsert(Decimal(id), DEFAULT_USER_INFO, role='user', budget=budget)
+
+    return Decimal(id)
+
+# Get the budget of the user stored in the database
+def GetStoredBudget(storage, id: Decimal) -> Decimal:
+    return storage.query_find(id)['Item']['info']['budget']
+
+
+def test_reserve_and_commit_return_the_unspent_part(sqlite_storage):
+    id = NewUser(sqlite_storage, 1, Decimal('1.0'))
+
+    assert sqlite_storage.query_reserve_budget(id, Decimal('0.4'))['Attributes']['info']['budget'] == Decimal('0.6')
+    assert sqlite_storage.query_commit_budget(id, Decimal('0.4'), Decimal('0.1'))['Attributes']['info']['budget'] == Decimal('0.9')
+    assert GetStoredBudget(sqlite_storage, id) == Decimal('0.9')
+
+def test_commit_never_charges_more_than_reserved(sqlite_storage):
+    id = NewUser(sqlite_storage, 1, Decimal('1.0'))
+
+    sqlite_storage.query_reserve_budget(id, Decimal('0.4'))
+    sqlite_storage.query_commit_budget(id, Decimal('0.4'), Decimal('5'))
+
+    assert GetStoredBudget(sqlite_storage, id) == Decimal('0.6')
+
+def test_reservation_above_the_budget_is_refused(sqlite_storage):
+    id = NewUser(sqlite_storage, 1, Decimal('0.3'))
+
+    assert sqlite_storage.query_reserve_budget(id, Decimal('0.5')) is None
+    assert GetStoredBudget(sqlite_storage, id) == Decimal('0.3')
+
+def test_clear_sets_the_budget_below_the_limit_to_zero(sqlite_storage):
+    id = NewUser(sqlite_storage, 1, Decimal('0.3'))
+
+    assert sqlite_storage.query_clear_budget(id, Decimal('0.3')) is None
+    assert sqlite_storage.query_clear_budget(id, Decimal('0.5'))['Attributes']['info']['budget'] == Decimal(0)
+    assert GetStoredBudget(sqlite_storage, id) == Decimal(0)
+
+def test_budget_of_the_missing_user_is_not_changed(sqlite_storage):
+    id = Decimal(404)
+
+    assert sqlite_storage.query_reserve_budget(id, Decimal('0.1')) is None
+    assert sqlite_storage.query_commit_budget(id, Decimal('0.1'), Decimal(0)) is None
+    assert sqlite_storage.query_clear_budget(id, Decimal('0.1')) is None
+    assert sqlite_storage.query_find(id).get('Item') is None
+
+def test_decrease_treats_the_missing_budget_as_zero(sqlite_storage, monkeypatch):
+    monkeypatch.setattr(telegram, 'user_cache', telegram.LRUCache(16, 0))
+    id = NewUser(sqlite_storage, 1, Decimal('0.3'))
+
+    from utils.sqlite import _get_connection
+    _get_connection().execute("update users set budget = null where id = ?", (int(id),))
+
+    assert telegram.DecreaseBudget(int(id), Decimal('0.1')) == Decimal(0)
+    assert telegram.IncreaseBudget(int(id), Decimal('0.2')) == Decimal('0.2')
+    assert telegram.DecreaseBudget(404, Decimal('0.1')) is None
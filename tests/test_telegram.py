@@ -0,0 +1,77 @@
+# Import necessary modules, classes and functions
+from types import SimpleNamespace
+import utils.telegram as telegram
+from utils.telegram import MESSAGE_LENGTH_LIMIT, SplitMessageText, SendMessage, StreamMessage
+
+# The bot recording the sent and edited texts (Telegram rejects the empty ones, and so does the fake)
+class FakeBot():
+    def __init__(self):
+        self.messages = {}
+
+    def send_message(self, chat_id, text, reply_to_message_id=None):
+        assert text.strip(), "Telegram rejects the empty message text"
+
+        message_id = len(self.messages) + 1
+        self.messages[message_id] = text
+
+        return SimpleNamespace(message_id=message_id)
+
+    def edit_message_text(self, text, chat_id, message_id):
+        assert text.strip(), "Telegram rejects the empty message text"
+        assert text.rstrip() != self.messages[message_id].rstrip(), "Telegram rejects the edit which does not change the text"
+
+        self.messages[message_id] = text
+
+# Create the message the bot replies to
+def NewMessage() -> SimpleNamespace:
+    return SimpleNamespace(chat=SimpleNamespace(id=1), message_id=1)
+
+# Define the text just over one message which ends with the newlines
+LONG_TEXT = "word " * (MESSAGE_LENGTH_LIMIT // 5) + "end\n\n\n"
+
+
+def test_split_strips_the_whitespace_around_the_split():
+    head, rest = SplitMessageText("a" * (MESSAGE_LENGTH_LIMIT - 2) + " \n\n\n")
+
+    assert head == "a" * (MESSAGE_LENGTH_LIMIT - 2)
+    assert rest == ""
+
+def test_send_skips_the_whitespace_left_after_the_split():
+    bot = FakeBot()
+
+    assert len(LONG_TEXT) > MESSAGE_LENGTH_LIMIT
+    assert SendMessage(bot, NewMessage(), LONG_TEXT) == LONG_TEXT
+    assert [len(text) <= MESSAGE_LENGTH_LIMIT for text in bot.messages.values()] == [True, True]
+    assert " ".join(bot.messages.values()).split() == LONG_TEXT.split()
+
+def test_stream_skips_the_whitespace_left_after_the_split():
+    bot = FakeBot()
+    parts = [LONG_TEXT[start:start + 100] for start in range(0, len(LONG_TEXT), 100)]
+
+    assert StreamMessage(bot, NewMessage(), parts) == LONG_TEXT
+    assert all(len(text) <= MESSAGE_LENGTH_LIMIT for text in bot.messages.values())
+    assert " ".join(bot.messages.values()).split() == LONG_TEXT.split()
+
+def test_stream_does_not_send_the_empty_continuation():
+    bot = FakeBot()
+    text = "a" * (MESSAGE_LENGTH_LIMIT - 1) + "\n\n\n\n"
+
+    assert StreamMessage(bot, NewMessage(), [text]) == text
+    assert list(bot.messages.values()) == ["a" * (MESSAGE_LENGTH_LIMIT - 1)]
+
+def test_stream_sends_every_head_of_the_part_longer_than_two_messages():
+    bot = FakeBot()
+    text = "x " * 5000
+
+    assert StreamMessage(bot, NewMessage(), [text]) == text
+    assert len(bot.messages) == 3
+    assert all(len(message) <= MESSAGE_LENGTH_LIMIT for message in bot.messages.values())
+    assert " ".join(bot.messages.values()).split() == text.split()
+
+def test_stream_does_not_edit_the_head_shown_with_the_trailing_whitespace(monkeypatch):
+    monkeypatch.setattr(telegram, 'STREAM_EDIT_INTERVAL', 0)
+    bot = FakeBot()
+    parts = ["a" * 4000 + "\n", "b" * 200]
+
+    assert StreamMessage(bot, NewMessage(), parts) == "".join(parts)
+    assert [message.rstrip() for message in bot.messages.values()] == ["a" * 4000, "b" * 200]
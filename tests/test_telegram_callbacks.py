@@ -0,0 +1,53 @@
+# Import necessary modules, classes and functions
+import pytest
+from utils.telegram_callbacks import (CALLBACK_ACTIONS, CALLBACK_DATA_LIMIT, CALLBACK_OUTDATED, CALLBACK_VERSION,
+                                      CallbackRouter, EncodeCallback, DecodeCallback)
+
+
+@pytest.mark.parametrize('action, args', [
+    ('manage', ()),
+    ('language', ('ru',)),
+    ('manage_page', ('admin', 'next', 1234567890)),
+    ('manage_budget_change', ('decrease', -1001234567890)),
+])
+def test_encoded_callback_is_decoded_back(action, args):
+    data = EncodeCallback(action, *args)
+
+    assert len(data.encode()) <= CALLBACK_DATA_LIMIT
+    assert DecodeCallback(data) == (action, args)
+
+def test_every_action_fits_into_the_limit_with_the_largest_ids():
+    for action, (_, _, types) in CALLBACK_ACTIONS.items():
+        args = [2 ** 63 - 1 if arg_type is int else 'banned' for arg_type in types]
+
+        assert len(EncodeCallback(action, *args).encode()) <= CALLBACK_DATA_LIMIT
+
+def test_callback_longer_than_the_limit_is_not_encoded():
+    with pytest.raises(ValueError):
+        EncodeCallback('language', 'x' * CALLBACK_DATA_LIMIT)
+
+def test_callback_of_another_version_is_outdated():
+    data = EncodeCallback('manage_user', 'user', 42)
+    outdated = chr(ord(CALLBACK_VERSION) + 1) + data[len(CALLBACK_VERSION):]
+
+    assert DecodeCallback(outdated) is CALLBACK_OUTDATED
+    assert DecodeCallback('manage_admin_42') is CALLBACK_OUTDATED
+
+def test_malformed_callback_is_not_decoded():
+    assert DecodeCallback('') is None
+    assert DecodeCallback(CALLBACK_VERSION + 'unknown') is None
+    assert DecodeCallback(EncodeCallback('manage_user', 'user', 42) + '.extra') is None
+    assert DecodeCallback(CALLBACK_VERSION + CALLBACK_ACTIONS['manage_budget'][0] + '.!') is None
+
+def test_router_reports_the_outdated_callback_apart_from_the_unknown_one():
+    router = CallbackRouter()
+
+    @router.route('manage_user')
+    def handler(*args):
+        pass
+
+    data = EncodeCallback('manage_user', 'user', 42)
+
+    assert router.resolve(data) == (handler, CALLBACK_ACTIONS['manage_user'][1], ('user', 42))
+    assert router.resolve('0' + data[len(CALLBACK_VERSION):]) is CALLBACK_OUTDATED
+    assert router.resolve(EncodeCallback('manage')) is None
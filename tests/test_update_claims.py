@@ -0,0 +1,58 @@
+# Import necessary modules, classes and functions
+import sqlite3
+import pytest
+import utils.sqlite as sqlite
+import utils.telegram as telegram
+from utils.telegram import ClaimUpdate, ReleaseUpdate
+from utils.tracing import SetRecordExporter
+
+# Claim the updates in the fresh database with the fresh warm-container set, and collect the exported records
+@pytest.fixture
+def records(sqlite_storage, monkeypatch):
+    monkeypatch.setattr(telegram, 'UPDATE_DEDUP', True)
+    monkeypatch.setattr(telegram, 'claimed_updates', telegram.LRUCache(16, telegram.UPDATE_DEDUP_TTL))
+
+    exported = []
+    SetRecordExporter(exported.append)
+    yield exported
+    SetRecordExporter(None)
+
+
+def test_update_is_claimed_once(records):
+    assert ClaimUpdate(1) is True
+    assert ClaimUpdate(1) is False
+    assert ClaimUpdate(2) is True
+
+    assert [(record['name'], record['source']) for record in records] == [('duplicate_update', 'memory')]
+
+def test_update_claimed_by_another_container_is_a_duplicate(records):
+    assert ClaimUpdate(1) is True
+
+    telegram.claimed_updates.clear()
+
+    assert ClaimUpdate(1) is False
+    assert records[-1]['source'] == 'database'
+
+def test_released_update_is_claimed_again(records):
+    assert ClaimUpdate(1) is True
+
+    ReleaseUpdate(1)
+
+    assert ClaimUpdate(1) is True
+    assert ClaimUpdate(1) is False
+
+def test_update_is_handled_when_the_claim_fails(records, monkeypatch):
+    def query_claim_cache(id, value, expire_at):
+        raise sqlite3.OperationalError("no such table: cache")
+
+    monkeypatch.setattr(sqlite, 'query_claim_cache', query_claim_cache)
+
+    assert ClaimUpdate(1) is True
+    assert ClaimUpdate(1) is True
+    assert [record['name'] for record in records] == ['update_claim', 'update_claim']
+
+def test_updates_are_not_claimed_without_deduplication(records, monkeypatch):
+    monkeypatch.setattr(telegram, 'UPDATE_DEDUP', False)
+
+    assert ClaimUpdate(1) is True
+    assert ClaimUpdate(1) is True
@@ -0,0 +1,76 @@
+# Import necessary modules, classes and functions
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+# The bounded in-process cache with least-recently-used eviction and time-to-live expiration
+class LRUCache():
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    # Get the value stored for the key (None if it is missing or expired)
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key, None)
+
+            if item is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = item
+
+            if expires_at <= monotonic():
+                del self._items[key]
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    # Check whether the unexpired value is stored for the key (the statistics are not changed)
+    def contains(self, key) -> bool:
+        with self._lock:
+            item = self._items.get(key, None)
+
+            return item is not None and item[1] > monotonic()
+
+    # Store the value for the key (for the cache's time-to-live, unless the other one is specified)
+    def set(self, key, value, ttl: float | None = None):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._items[key] = (value, monotonic() + (self.ttl if ttl is None else ttl))
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    # Remove the value stored for the key
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    # Remove all values from the cache
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    # Get the statistics of the cache usage
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+
+            return {
+                'size': len(self._items),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+            }
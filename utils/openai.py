@@ -1,16 +1,202 @@
-# Import necessary modules, classes and functions
-import openai
+# Import necessary modules, classes and functions (openai is imported on the first request to speed up cold starts)
+from decimal import Decimal
+from time import perf_counter
+from typing import TYPE_CHECKING, Iterator
+from utils.tracing import StartSpan, GetPayloadSize
+
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 # Define environment variables
 OPENAI_API_KEY: str | None = None
+OPENAI_MAX_TOKENS: int = 1024
 
 # Initialize environment variables
 def InitEnvVars(vars: dict):
-    global OPENAI_API_KEY
-    
+    global OPENAI_API_KEY, OPENAI_MAX_TOKENS
+
     OPENAI_API_KEY = vars.get('OPENAI_API_KEY')
+    OPENAI_MAX_TOKENS = int(vars.get('OPENAI_MAX_TOKENS') or OPENAI_MAX_TOKENS)
+
+# Define the prices of the chat models (in dollars for 1000 prompt and completion tokens)
+MODEL_PRICES = {
+    'gpt-3.5-turbo': (Decimal('0.0015'), Decimal('0.002')),
+    'gpt-4': (Decimal('0.03'), Decimal('0.06')),
+}
+
+# Define the context sizes of the chat models (in tokens)
+MODEL_CONTEXT_SIZES = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-4': 8192,
+}
+
+# Define the part of the context of the chat models which is left unused (the counted tokens are only the estimate without tiktoken)
+MODEL_CONTEXT_MARGIN = 0.1
+
+# Define the encoding of the tokens (tiktoken is optional, so it is loaded on the first count, and False if it is not available)
+token_encoding = None
+
+# Count the tokens of the text (the upper estimate, which is used until the exact usage is known)
+def CountTokens(text: str) -> int:
+    encoding = GetTokenEncoding()
+
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=())) + 4
+
+    # A token is about one character of the Cyrillic and CJK texts and about four of the English ones, so the UTF-8 bytes are counted
+    return len(text.encode()) // 3 + 4
+
+# Get the encoding of the tokens of the chat models (None if tiktoken is not installed or its encoding cannot be loaded)
+def GetTokenEncoding():
+    global token_encoding
+
+    if token_encoding is None:
+        try:
+            import tiktoken
+
+            token_encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            token_encoding = False
+
+    return token_encoding or None
+
+# Count the tokens of the message (with the arguments of the plugins' calls requested by the chat model)
+def CountMessageTokens(message: dict) -> int:
+    return CountTokens(message['content'] or '') + sum(CountTokens(tool_call['function']['arguments']) for tool_call in message.get('tool_calls', []))
+
+# Get the cost of the request to the chat model
+def GetCost(model: str, prompt_tokens: int, completion_tokens: int) -> Decimal:
+    prompt_price, completion_price = MODEL_PRICES[model]
+
+    return (prompt_price * prompt_tokens + completion_price * completion_tokens) / 1000
+
+# Get the maximum cost of the request to the chat model (it is reserved from the user's budget before the request)
+def EstimateCost(model: str, messages: list[dict]) -> Decimal:
+    return GetCost(model, sum(CountMessageTokens(message) for message in messages), OPENAI_MAX_TOKENS)
+
+# Define the chat model summarizing the conversations' history
+SUMMARY_MODEL = 'gpt-3.5-turbo'
+
+# Define the instruction for summarizing the conversation
+SUMMARY_PROMPT = "Summarize the conversation below briefly. Keep the facts, names, numbers and decisions needed to continue it, and write the summary in the language of the conversation."
+
+# Get the messages asking the chat model to summarize the conversation's messages
+def GetSummaryMessages(messages: list[dict]) -> list[dict]:
+    conversation = "\n\n".join(f"{message['role']}: {message['content']}" for message in messages)
+
+    return [
+        {'role': 'system', 'content': SUMMARY_PROMPT},
+        {'role': 'user', 'content': conversation}
+    ]
+
+# Get the number of tokens left for the conversation's history in the context of the chat model
+def GetHistoryTokenLimit(model: str, messages: list[dict]) -> int:
+    context_size = int(MODEL_CONTEXT_SIZES[model] * (1 - MODEL_CONTEXT_MARGIN))
+
+    return context_size - OPENAI_MAX_TOKENS - sum(CountMessageTokens(message) for message in messages)
+
+# Get the message of the chat model requesting the plugins' calls (it precedes their results in the conversation)
+def GetToolCallsMessage(tool_calls: list[dict]) -> dict:
+    return {
+        'role': 'assistant',
+        'content': '',
+        'tool_calls': [{
+            'id': tool_call['id'],
+            'type': 'function',
+            'function': {
+                'name': tool_call['name'],
+                'arguments': tool_call['arguments']
+            }
+        } for tool_call in tool_calls]
+    }
 
 # The main class for interacting with OpenAI API
 class OpenAIHelper():
     def __init__(self):
-        self.openai = OPENAI_API_KEY
\ No newline at end of file
+        self.openai = OPENAI_API_KEY
+        self.client = None
+
+    # Get the client of OpenAI API
+    def get_client(self) -> 'OpenAI':
+        if self.client is not None:
+            return self.client
+
+        from openai import OpenAI
+
+        self.client = OpenAI(api_key=self.openai)
+
+        return self.client
+
+    # Get the whole response of the chat model and the usage of the tokens
+    def get_chat_response(self, model: str, messages: list[dict]) -> tuple[str, dict]:
+        with StartSpan('openai.chat', model=model) as span:
+            response = self.get_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=OPENAI_MAX_TOKENS
+            )
+
+            content = response.choices[0].message.content or ''
+            usage = {
+                'prompt_tokens': response.usage.prompt_tokens,
+                'completion_tokens': response.usage.completion_tokens
+            }
+
+            if span:
+                span.set(request_bytes=GetPayloadSize(messages), response_bytes=len(content), **usage)
+
+        return content, usage
+
+    # Get the streamed response of the chat model (the text is yielded in parts, and the usage comes with the last part)
+    # The plugins' calls requested by the chat model are collected to the specified list
+    def get_chat_response_stream(self, model: str, messages: list[dict], tools: list[dict] | None = None, tool_calls: list[dict] | None = None) -> Iterator[tuple[str, dict | None]]:
+        # The span lasts until the stream ends (the time to the first part is the latency seen by the user)
+        with StartSpan('openai.chat_stream', detached=True, model=model, tools=len(tools or [])) as span:
+            started = perf_counter()
+            received = 0
+
+            if span:
+                span.set(request_bytes=GetPayloadSize(messages))
+
+            stream = self.get_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=OPENAI_MAX_TOKENS,
+                stream=True,
+                stream_options={'include_usage': True},
+                **({'tools': tools} if tools else {})
+            )
+
+            for chunk in stream:
+                delta = chunk.choices[0].delta if chunk.choices else None
+                content = (delta.content or '') if delta else ''
+
+                # The calls come in fragments, which are joined by the calls' indexes
+                for call in (delta.tool_calls or []) if delta and tool_calls is not None else []:
+                    while len(tool_calls) <= call.index:
+                        tool_calls.append({'id': '', 'name': '', 'arguments': ''})
+
+                    tool_calls[call.index]['id'] = call.id or tool_calls[call.index]['id']
+
+                    if call.function:
+                        tool_calls[call.index]['name'] += call.function.name or ''
+                        tool_calls[call.index]['arguments'] += call.function.arguments or ''
+
+                usage = {
+                    'prompt_tokens': chunk.usage.prompt_tokens,
+                    'completion_tokens': chunk.usage.completion_tokens
+                } if chunk.usage else None
+
+                if span and content and not received:
+                    span.set(first_part_ms=round((perf_counter() - started) * 1000, 3))
+
+                received += len(content)
+
+                if span and usage:
+                    span.set(**usage)
+
+                if content or usage:
+                    yield content, usage
+
+            if span:
+                span.set(response_bytes=received, tool_calls=len(tool_calls or []))
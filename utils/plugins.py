@@ -1,21 +1,345 @@
-# Import necessary modules, classes and functions
-import wolframalpha
-import duckduckgo_search
+# Import necessary modules, classes and functions (the plugins' libraries are imported on the first call to speed up cold starts)
+import json
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextvars import copy_context
+from datetime import datetime
+from hashlib import sha1
+from inspect import signature
+from threading import Lock
+from time import monotonic, time
+from utils.cache import LRUCache
+from utils.storage import query_get_cache, query_put_cache, TryQuery
+from utils.tracing import Traced, StartSpan, GetPayloadSize, ReportMetric
 
 # Define environment variables
 WOLFRAM_APP_ID: str | None = None
 DUCKDUCKGO_SAFESEARCH: str | None = None
 WORLDTIME_DEFAULT_TIMEZONE: str | None = None
+PLUGINS: list[str] = []
+PLUGIN_MAX_WORKERS: int = 4
+PLUGIN_MAX_ROUNDS: int = 3
+PLUGIN_CACHE_SIZE: int = 512
+PLUGIN_CACHE_PERSISTENT: bool = False
 
 # Initialize environment variables
 def InitEnvVars(vars: dict):
     global WOLFRAM_APP_ID, DUCKDUCKGO_SAFESEARCH, WORLDTIME_DEFAULT_TIMEZONE
-    
+    global PLUGINS, PLUGIN_MAX_WORKERS, PLUGIN_MAX_ROUNDS, PLUGIN_CACHE_SIZE, PLUGIN_CACHE_PERSISTENT
+
     WOLFRAM_APP_ID = vars.get('WOLFRAM_APP_ID')
     DUCKDUCKGO_SAFESEARCH = vars.get('DUCKDUCKGO_SAFESEARCH')
     WORLDTIME_DEFAULT_TIMEZONE = vars.get('WORLDTIME_DEFAULT_TIMEZONE')
+    PLUGINS = [name.strip() for name in (vars.get('PLUGINS') or '').split(',') if name.strip()]
+    PLUGIN_MAX_WORKERS = int(vars.get('PLUGIN_MAX_WORKERS') or PLUGIN_MAX_WORKERS)
+    PLUGIN_MAX_ROUNDS = int(vars.get('PLUGIN_MAX_ROUNDS') or PLUGIN_MAX_ROUNDS)
+    PLUGIN_CACHE_SIZE = int(vars.get('PLUGIN_CACHE_SIZE') or PLUGIN_CACHE_SIZE)
+    PLUGIN_CACHE_PERSISTENT = (vars.get('PLUGIN_CACHE_PERSISTENT') or '').lower() in ('1', 'true', 'yes')
+
+# Define the maximum length of the plugin's result passed to the chat model
+PLUGIN_RESULT_LIMIT = 4000
+
+# Define the minimum time-to-live (in seconds) of the plugin's results worth storing in the database
+PLUGIN_CACHE_PERSISTENT_MIN_TTL = 60
+
+# Define the minimum time (in seconds) between the reports of the plugins' results cache statistics
+PLUGIN_CACHE_REPORT_INTERVAL = 60.0
+
+# The base class of the plugins (the functions which the chat model can call, and the plugin without execute cannot be created)
+class Plugin(ABC):
+    name = ''
+    description = ''
+    parameters = {'type': 'object', 'properties': {}}
+
+    # The time (in seconds) after which the call is abandoned and the error is returned to the chat model
+    timeout = 10.0
+
+    # The time (in seconds) for which the result is cached (None if the results must not be cached)
+    cache_ttl = None
+
+    # The backend can be replaced with the local stand-in taking the same arguments (for tests and benchmarks)
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    # Get the description of the plugin for the chat model
+    def get_tool(self) -> dict:
+        return {
+            'type': 'function',
+            'function': {
+                'name': self.name,
+                'description': self.description,
+                'parameters': self.parameters
+            }
+        }
+
+    # Call the plugin with the arguments chosen by the chat model
+    @abstractmethod
+    def execute(self, **arguments) -> dict: ...
+
+    # Check the arguments chosen by the chat model against the parameters and the function of the plugin (the error or None)
+    def check_arguments(self, arguments: dict) -> str | None:
+        missing = [name for name in self.parameters.get('required', []) if name not in arguments]
+        unknown = [name for name in arguments if name not in self.parameters.get('properties', {})]
+
+        if missing:
+            return f"Missing required arguments: {', '.join(missing)}"
+        if unknown:
+            return f"Unknown arguments: {', '.join(unknown)}"
+
+        try:
+            signature(self.backend or self.execute).bind(**arguments)
+        except TypeError as error:
+            return str(error)
+
+        return None
+
+# The plugin answering factual and computational questions with Wolfram Alpha
+class WolframAlphaPlugin(Plugin):
+    name = 'wolfram'
+    description = "Answer questions about math, science, geography, finance and other facts with Wolfram Alpha"
+    parameters = {
+        'type': 'object',
+        'properties': {
+            'query': {'type': 'string', 'description': "The question in English, e.g. 'distance from Moscow to Paris'"}
+        },
+        'required': ['query']
+    }
+    timeout = 20.0
+    cache_ttl = 6 * 60 * 60
+
+    def execute(self, query: str) -> dict:
+        import wolframalpha
+
+        # The library's own timeout stops the request, so the worker thread is not kept after the call is abandoned
+        response = wolframalpha.Client(WOLFRAM_APP_ID, timeout=self.timeout).query(query)
+
+        try:
+            return {'result': next(response.results).text}
+        except StopIteration:
+            pass
+
+        pods = [{'title': pod.title, 'text': subpod.plaintext} for pod in response.pods for subpod in pod.subpods if subpod.plaintext]
+
+        return {'pods': pods[:5]} if pods else {'result': None}
+
+# The plugin searching the web with DuckDuckGo
+class DuckDuckGoPlugin(Plugin):
+    name = 'ddg_web_search'
+    description = "Search the web for the recent or specific information with DuckDuckGo"
+    parameters = {
+        'type': 'object',
+        'properties': {
+            'query': {'type': 'string', 'description': "The search query"},
+            'region': {'type': 'string', 'description': "The region of the search, e.g. 'us-en' or 'ru-ru' ('wt-wt' for no region)"}
+        },
+        'required': ['query']
+    }
+    timeout = 10.0
+    cache_ttl = 30 * 60
+
+    def execute(self, query: str, region: str = 'wt-wt') -> dict:
+        from duckduckgo_search import DDGS
+
+        results = DDGS(timeout=int(self.timeout)).text(query, region=region, safesearch=DUCKDUCKGO_SAFESEARCH or 'moderate', max_results=5)
+
+        return {'results': [{'title': result['title'], 'url': result['href'], 'snippet': result['body']} for result in results]}
+
+# The plugin telling the current time in the specified time zone
+class WorldTimePlugin(Plugin):
+    name = 'worldtime'
+    description = "Get the current date and time in the specified time zone"
+    parameters = {
+        'type': 'object',
+        'properties': {
+            'timezone': {'type': 'string', 'description': "The IANA time zone, e.g. 'Europe/Moscow' (the default one if omitted)"}
+        }
+    }
+    timeout = 2.0
+    cache_ttl = 5
+
+    def execute(self, timezone: str | None = None) -> dict:
+        from zoneinfo import ZoneInfo
+
+        timezone = timezone or WORLDTIME_DEFAULT_TIMEZONE or 'UTC'
+        now = datetime.now(ZoneInfo(timezone))
+
+        return {'timezone': timezone, 'datetime': now.isoformat(timespec='seconds'), 'weekday': now.strftime('%A')}
+
+# Define the plugins which can be enabled by their names
+PLUGIN_CLASSES = {plugin.name: plugin for plugin in (WolframAlphaPlugin, DuckDuckGoPlugin, WorldTimePlugin)}
+
+# Define the pool of the threads calling the plugins (it is shared by all updates and created on the first call)
+plugin_executor: ThreadPoolExecutor | None = None
+plugin_executor_lock = Lock()
+
+# Get the pool of the threads calling the plugins
+def GetPluginExecutor() -> ThreadPoolExecutor:
+    global plugin_executor
+
+    with plugin_executor_lock:
+        if plugin_executor is None:
+            plugin_executor = ThreadPoolExecutor(max_workers=PLUGIN_MAX_WORKERS, thread_name_prefix='plugin')
+
+    return plugin_executor
 
 # The main class for managing plugins
 class PluginManager():
-    def __init__(self):
-        self.plugins = []
\ No newline at end of file
+    def __init__(self, plugins: list[Plugin] | None = None):
+        if plugins is None:
+            plugins = [PLUGIN_CLASSES[name]() for name in PLUGINS if name in PLUGIN_CLASSES]
+
+        self.plugins = plugins
+        self.max_rounds = PLUGIN_MAX_ROUNDS
+        self.cache = LRUCache(PLUGIN_CACHE_SIZE, 0)
+        self.persistent = PLUGIN_CACHE_PERSISTENT
+        self.persistent_hits = 0
+        self.reported = float('-inf')
+        self.lock = Lock()
+
+    # Get the plugin by its name
+    def get_plugin(self, name: str) -> Plugin | None:
+        return next((plugin for plugin in self.plugins if plugin.name == name), None)
+
+    # Get the descriptions of the enabled plugins for the chat model (None if there are no plugins)
+    def get_tools(self) -> list[dict] | None:
+        return [plugin.get_tool() for plugin in self.plugins] or None
+
+    # Call the plugins requested by the chat model in one turn concurrently (the results are returned in the order of the calls)
+    @Traced('plugins.call_tools')
+    def call_tools(self, tool_calls: list[dict]) -> list[dict]:
+        started = monotonic()
+        calls = []
+
+        for tool_call in tool_calls:
+            plugin = self.get_plugin(tool_call['name'])
+
+            try:
+                arguments = json.loads(tool_call['arguments'] or '{}')
+            except ValueError as error:
+                calls.append((plugin, None, PluginError('invalid_arguments', str(error))))
+                continue
+
+            if not isinstance(arguments, dict):
+                calls.append((plugin, None, PluginError('invalid_arguments', "The arguments must be a JSON object")))
+                continue
+
+            if plugin is None:
+                calls.append((plugin, None, PluginError('unknown_plugin', f"There is no plugin '{tool_call['name']}'")))
+                continue
+
+            # The arguments are checked before the call, so the errors raised by the plugin itself are never blamed on them
+            if (error := plugin.check_arguments(arguments)) is not None:
+                calls.append((plugin, None, PluginError('invalid_arguments', error)))
+                continue
+
+            # The results cached in the warm container are returned without waiting for the pool
+            key = GetPluginCacheKey(plugin.name, arguments) if plugin.cache_ttl else None
+            result = self.cache.get(key) if key else None
+
+            if result is not None:
+                calls.append((plugin, None, result))
+                continue
+
+            # The call runs in the context of the update, so its span is a part of the update's trace
+            calls.append((plugin, GetPluginExecutor().submit(copy_context().run, self.call_plugin, plugin, arguments, key), None))
+
+        messages = []
+
+        for tool_call, (plugin, future, result) in zip(tool_calls, calls):
+            if future is not None:
+                result = self.get_result(plugin, future, started)
+
+            messages.append({
+                'role': 'tool',
+                'tool_call_id': tool_call['id'],
+                'content': json.dumps(result, ensure_ascii=False, default=str)[:PLUGIN_RESULT_LIMIT]
+            })
+
+        self.report_cache_stats()
+
+        return messages
+
+    # Call the plugin (the result is looked up in the database and cached if it is allowed)
+    def call_plugin(self, plugin: Plugin, arguments: dict, key: str | None) -> dict:
+        with StartSpan(f"plugin.{plugin.name}") as span:
+            if span:
+                span.set(request_bytes=GetPayloadSize(arguments))
+
+            persistent = key is not None and self.persistent and plugin.cache_ttl >= PLUGIN_CACHE_PERSISTENT_MIN_TTL
+
+            if persistent:
+                item = TryQuery('plugin_cache_get', query_get_cache, f"plugin:{key}", plugin=plugin.name)
+
+                if item is not None:
+                    result = json.loads(item['value'])
+                    self.cache.set(key, result, min(plugin.cache_ttl, int(item['expire_at']) - time()))
+
+                    with self.lock:
+                        self.persistent_hits += 1
+
+                    span.set(cache='persistent', result_bytes=len(item['value']))
+                    return result
+
+            result = (plugin.backend or plugin.execute)(**arguments)
+
+            if span:
+                span.set(result_bytes=GetPayloadSize(result))
+
+            # The call abandoned after its timeout still caches the result for the next requests
+            if key is not None:
+                self.cache.set(key, result, plugin.cache_ttl)
+
+                if persistent:
+                    TryQuery('plugin_cache_put', query_put_cache, f"plugin:{key}", json.dumps(result, ensure_ascii=False, default=str),
+                             int(time()) + plugin.cache_ttl, plugin=plugin.name)
+
+            return result
+
+    # Get the statistics of the plugins' results cache (the misses of the warm-container tier include the database hits)
+    def cache_stats(self) -> dict:
+        stats = self.cache.stats()
+        requests = stats['hits'] + stats['misses']
+
+        return {
+            'size': stats['size'],
+            'memory_hits': stats['hits'],
+            'persistent_hits': self.persistent_hits,
+            'misses': stats['misses'] - self.persistent_hits,
+            'hit_rate': (stats['hits'] + self.persistent_hits) / requests if requests else 0.0,
+        }
+
+    # Report the statistics of the plugins' results cache (the counters are cumulative, so they are reported once in a while)
+    def report_cache_stats(self):
+        with self.lock:
+            if monotonic() - self.reported < PLUGIN_CACHE_REPORT_INTERVAL:
+                return
+
+            self.reported = monotonic()
+
+        ReportMetric('plugin_cache', **self.cache_stats())
+
+    # Wait for the result of the plugin's call until its timeout (the failed call returns the error to the chat model)
+    def get_result(self, plugin: Plugin, future, started: float) -> dict:
+        try:
+            return future.result(timeout=max(0.0, started + plugin.timeout - monotonic()))
+        except FutureTimeoutError:
+            # The call which has not started yet is cancelled, and the running one is stopped by the library's timeout
+            future.cancel()
+            return PluginError('timeout', f"The plugin '{plugin.name}' did not respond in {plugin.timeout:g} seconds")
+        except Exception as error:
+            return PluginError('plugin_failed', f"{type(error).__name__}: {error}")
+
+# Get the key of the plugin's cached result (the arguments are normalized, so the same requests share the result)
+def GetPluginCacheKey(name: str, arguments: dict) -> str:
+    normalized = {argument: " ".join(value.casefold().split()) if isinstance(value, str) else value for argument, value in arguments.items()}
+
+    return sha1(f"{name}\n{json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)}".encode()).hexdigest()
+
+# Create the error returned to the chat model instead of the plugin's result
+def PluginError(type: str, message: str) -> dict:
+    return {
+        'error': {
+            'type': type,
+            'message': message
+        }
+    }
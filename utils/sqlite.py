@@ -0,0 +1,287 @@
+# Import necessary modules, classes and functions
+import json
+import sqlite3
+from contextlib import contextmanager
+from decimal import Decimal
+from threading import local
+from time import time
+
+# Define environment variables
+SQLITE_PATH: str = 'bot.sqlite3'
+
+# Initialize environment variables
+def InitEnvVars(vars: dict):
+    global SQLITE_PATH
+
+    SQLITE_PATH = vars.get('SQLITE_PATH') or SQLITE_PATH
+
+# Define service variables (sqlite3 connections cannot be shared by the threads, so every thread gets its own one)
+sqlite_local = local()
+
+# Define the schema of the database (the role is duplicated to the indexed column, and the budget is stored apart from the info to keep its precision)
+SCHEMA = """
+create table if not exists users (
+    id integer primary key,
+    role text,
+    info text not null,
+    budget text
+);
+create index if not exists users_role on users (role, id);
+create table if not exists history (
+    chat_id integer not null,
+    turn text not null,
+    role text not null,
+    content text not null,
+    tokens integer not null,
+    expire_at integer not null,
+    primary key (chat_id, turn)
+) without rowid;
+create table if not exists cache (
+    id text primary key,
+    value text not null,
+    expire_at integer not null
+) without rowid;
+"""
+
+# Define the response of the successful write (the same as the one of DocAPI)
+RESPONSE_OK = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+# Query to the database for finding user's information
+def query_find(id: Decimal) -> dict:
+    row = _get_connection().execute("select id, role, info, budget from users where id = ?", (int(id),)).fetchone()
+
+    return {'Item': _user_from_row(row)} if row else {}
+
+# Query to the database for finding the information of several users at once
+def query_find_batch(ids: list[Decimal]) -> dict:
+    connection = _get_connection()
+    users = []
+
+    # The number of the statement's parameters is limited, so the ids are queried in chunks
+    for start in range(0, len(ids), 500):
+        chunk = [int(id) for id in ids[start:start + 500]]
+        rows = connection.execute(f"select id, role, info, budget from users where id in ({', '.join('?' * len(chunk))})", chunk)
+        users += [_user_from_row(row) for row in rows]
+
+    return {'Items': users}
+
+# Query to the database for getting one page of users' information by the specified role (ordered by the users' ids)
+def query_search_page(role: str, limit: int, start_id: Decimal | None = None, forward: bool = True) -> dict:
+    if forward:
+        rows = _get_connection().execute(
+            "select id, role, info, budget from users where role = ? and id > ? order by id limit ?",
+            (role, -1 if start_id is None else int(start_id), limit)
+        ).fetchall()
+    else:
+        rows = _get_connection().execute(
+            "select id, role, info, budget from users where role = ? and id < ? order by id desc limit ?",
+            (role, 2 ** 63 - 1 if start_id is None else int(start_id), limit)
+        ).fetchall()
+
+    response = {'Items': [_user_from_row(row) for row in rows]}
+
+    if len(rows) == limit:
+        response['LastEvaluatedKey'] = {'role': role, 'id': Decimal(rows[-1][0])}
+
+    return response
+
+# Query to the database for setting the specified fields of user's information (creating the user if necessary)
+def query_upsert(id: Decimal, defaults: dict, **fields) -> dict:
+    with _transaction() as connection:
+        row = connection.execute("select id, role, info, budget from users where id = ?", (int(id),)).fetchone()
+
+        if row:
+            user = _user_from_row(row)
+            user['info'] = {field: value for field, value in defaults.items() if field not in user['info']} | user['info'] | fields
+
+            if 'role' in fields:
+                user['role'] = fields['role']
+        else:
+            user = {'id': Decimal(int(id)), 'info': defaults | fields, 'role': (defaults | fields)['role']}
+
+        _save_user(connection, user)
+
+    return {'Attributes': user} | RESPONSE_OK
+
+# Query to the database for atomically changing user's budget (None if the budget would become less than the minimum)
+def query_add_budget(id: Decimal, amount: Decimal, minimum: Decimal | None = Decimal(0)) -> dict | None:
+    with _transaction() as connection:
+        row = connection.execute("select id, role, info, budget from users where id = ?", (int(id),)).fetchone()
+
+        if not row:
+            return None
+
+        # The missing budget is the same as the zero one
+        user = _user_from_row(row)
+        budget = user['info'].get('budget', Decimal(0)) + amount
+
+        if minimum is not None and budget < minimum:
+            return None
+
+        user['info']['budget'] = budget
+        connection.execute("update users set budget = ? where id = ?", (str(budget), int(id)))
+
+    return {'Attributes': user} | RESPONSE_OK
+
+# Query to the database for atomically setting user's budget to zero (None if the budget is not less than the specified limit)
+def query_clear_budget(id: Decimal, limit: Decimal) -> dict | None:
+    with _transaction() as connection:
+        row = connection.execute("select id, role, info, budget from users where id = ?", (int(id),)).fetchone()
+
+        if not row or Decimal(row[3] or 0) >= limit:
+            return None
+
+        user = _user_from_row(row)
+        user['info']['budget'] = Decimal(0)
+        connection.execute("update users set budget = ? where id = ?", ('0', int(id)))
+
+    return {'Attributes': user} | RESPONSE_OK
+
+# Query to the database for reserving the amount from user's budget (None if the budget is not enough)
+def query_reserve_budget(id: Decimal, amount: Decimal) -> dict | None:
+    return query_add_budget(id, -amount)
+
+# Query to the database for committing the reserved amount (the unspent part is returned to user's budget)
+def query_commit_budget(id: Decimal, reserved: Decimal, spent: Decimal) -> dict | None:
+    return query_add_budget(id, reserved - min(spent, reserved), minimum=None)
+
+# Query to the database for deleting user's information
+def query_delete(id: Decimal) -> dict:
+    with _transaction() as connection:
+        connection.execute("delete from users where id = ?", (int(id),))
+
+    return RESPONSE_OK
+
+# Query to the database for appending the turns to the conversation's history (all of them are written at once)
+def query_append_history(turns: list[dict]) -> dict:
+    with _transaction() as connection:
+        connection.executemany(
+            "insert or replace into history (chat_id, turn, role, content, tokens, expire_at) values (?, ?, ?, ?, ?, ?)",
+            [(int(turn['chat_id']), turn['turn'], turn['role'], turn['content'], int(turn['tokens']), int(turn['expire_at'])) for turn in turns]
+        )
+
+    return RESPONSE_OK
+
+# Query to the database for getting one page of the conversation's history (starting with the newest turns)
+def query_load_history(chat_id: Decimal, limit: int, start_key: dict | None = None) -> dict:
+    if start_key:
+        rows = _get_connection().execute(
+            "select chat_id, turn, role, content, tokens, expire_at from history where chat_id = ? and turn < ? and expire_at > ? order by turn desc limit ?",
+            (int(chat_id), start_key['turn'], int(time()), limit)
+        ).fetchall()
+    else:
+        rows = _get_connection().execute(
+            "select chat_id, turn, role, content, tokens, expire_at from history where chat_id = ? and expire_at > ? order by turn desc limit ?",
+            (int(chat_id), int(time()), limit)
+        ).fetchall()
+
+    items = [{
+        'chat_id': Decimal(row[0]),
+        'turn': row[1],
+        'role': row[2],
+        'content': row[3],
+        'tokens': Decimal(row[4]),
+        'expire_at': Decimal(row[5])
+    } for row in rows]
+
+    response = {'Items': items}
+
+    if len(rows) == limit:
+        response['LastEvaluatedKey'] = {'chat_id': Decimal(rows[-1][0]), 'turn': rows[-1][1]}
+
+    return response
+
+# Query to the database for getting the cached value (None if it is missing or expired)
+def query_get_cache(id: str) -> dict | None:
+    row = _get_connection().execute("select value, expire_at from cache where id = ? and expire_at > ?", (id, int(time()))).fetchone()
+
+    return {'id': id, 'value': row[0], 'expire_at': Decimal(row[1])} if row else None
+
+# Query to the database for caching the value until the specified time (in seconds since the epoch)
+def query_put_cache(id: str, value, expire_at: int) -> dict:
+    with _transaction() as connection:
+        connection.execute("insert or replace into cache (id, value, expire_at) values (?, ?, ?)", (id, value, int(expire_at)))
+
+    return RESPONSE_OK
+
+# Query to the database for caching the value only if there is no unexpired one (None if there is, so the value is claimed once)
+def query_claim_cache(id: str, value, expire_at: int) -> dict | None:
+    with _transaction() as connection:
+        cursor = connection.execute(
+            "insert into cache (id, value, expire_at) values (?, ?, ?) on conflict (id) do update set value = excluded.value, expire_at = excluded.expire_at where cache.expire_at <= ?",
+            (id, value, int(expire_at), int(time()))
+        )
+
+    return RESPONSE_OK if cursor.rowcount == 1 else None
+
+# Get the errors of the database which the callers may survive
+def storage_errors() -> tuple[type[Exception], ...]:
+    return (sqlite3.Error,)
+
+# Service method for converting the row of the users table to user's information (the numbers are Decimal, like in DocAPI)
+def _user_from_row(row: tuple) -> dict:
+    id, role, info, budget = row
+
+    user = {
+        'id': Decimal(id),
+        'info': json.loads(info, parse_int=Decimal, parse_float=Decimal)
+    }
+
+    if budget is not None:
+        user['info']['budget'] = Decimal(budget)
+    if role is not None:
+        user['role'] = role
+
+    return user
+
+# Service method for writing user's information to the users table
+def _save_user(connection: sqlite3.Connection, user: dict):
+    info = {field: value for field, value in user['info'].items() if field != 'budget'}
+    budget = user['info'].get('budget', None)
+
+    connection.execute(
+        "insert or replace into users (id, role, info, budget) values (?, ?, ?, ?)",
+        (int(user['id']), user.get('role', None), json.dumps(info, ensure_ascii=False, default=_encode_number), None if budget is None else str(budget))
+    )
+
+# Service method for encoding the Decimal numbers of user's information to JSON (they are decoded back to Decimal)
+def _encode_number(value: Decimal) -> int | float:
+    if not isinstance(value, Decimal):
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    return int(value) if value == value.to_integral_value() else float(value)
+
+# Service method for running the statements in one write transaction (the other writers wait for it)
+@contextmanager
+def _transaction(connection: sqlite3.Connection | None = None):
+    connection = connection or _get_connection()
+    connection.execute("begin immediate")
+
+    try:
+        yield connection
+    except BaseException:
+        connection.execute("rollback")
+        raise
+
+    connection.execute("commit")
+
+# Service method for initializing the connection of the current thread (the statements are prepared once and cached by it)
+def _get_connection() -> sqlite3.Connection:
+    connection = getattr(sqlite_local, 'connection', None)
+    if connection is not None:
+        return connection
+
+    connection = sqlite3.connect(SQLITE_PATH, isolation_level=None, cached_statements=256)
+    connection.execute("pragma journal_mode = wal")
+    connection.execute("pragma synchronous = normal")
+    connection.execute("pragma busy_timeout = 5000")
+    connection.executescript(SCHEMA)
+
+    # The expired rows are deleted when a connection is opened (DocAPI deletes them by the TTL)
+    with _transaction(connection):
+        connection.execute("delete from history where expire_at <= ?", (int(time()),))
+        connection.execute("delete from cache where expire_at <= ?", (int(time()),))
+
+    sqlite_local.connection = connection
+
+    return connection
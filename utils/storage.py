@@ -0,0 +1,134 @@
+# Import necessary modules, classes and functions
+from decimal import Decimal
+from types import ModuleType
+from typing import Callable, Protocol
+import utils.yandexcloud as yandexcloud
+from utils.tracing import Traced, ReportError
+
+# Define environment variables
+STORAGE_BACKEND: str = 'docapi'
+
+# Initialize environment variables
+def InitEnvVars(vars: dict):
+    global STORAGE_BACKEND, backend
+
+    STORAGE_BACKEND = (vars.get('STORAGE_BACKEND') or STORAGE_BACKEND).lower()
+    backend = GetBackend(STORAGE_BACKEND)
+
+    for InitFunc in (yandexcloud.InitEnvVars, backend.InitEnvVars):
+        InitFunc(vars)
+
+# The interface of the storage backends (the responses have the shapes of the DocAPI ones, so the backends are interchangeable)
+class StorageBackend(Protocol):
+    def InitEnvVars(self, vars: dict): ...
+    def query_find(self, id: Decimal) -> dict: ...
+    def query_find_batch(self, ids: list[Decimal]) -> dict: ...
+    def query_search_page(self, role: str, limit: int, start_id: Decimal | None = None, forward: bool = True) -> dict: ...
+    def query_upsert(self, id: Decimal, defaults: dict, **fields) -> dict: ...
+    def query_add_budget(self, id: Decimal, amount: Decimal, minimum: Decimal | None = Decimal(0)) -> dict | None: ...
+    def query_clear_budget(self, id: Decimal, limit: Decimal) -> dict | None: ...
+    def query_reserve_budget(self, id: Decimal, amount: Decimal) -> dict | None: ...
+    def query_commit_budget(self, id: Decimal, reserved: Decimal, spent: Decimal) -> dict | None: ...
+    def query_delete(self, id: Decimal) -> dict: ...
+    def query_append_history(self, turns: list[dict]) -> dict: ...
+    def query_load_history(self, chat_id: Decimal, limit: int, start_key: dict | None = None) -> dict: ...
+    def query_get_cache(self, id: str) -> dict | None: ...
+    def query_put_cache(self, id: str, value, expire_at: int) -> dict: ...
+    def query_claim_cache(self, id: str, value, expire_at: int) -> dict | None: ...
+    def storage_errors(self) -> tuple[type[Exception], ...]: ...
+
+# Get the storage backend by its name (the embedded SQLite one is imported only if it is chosen)
+def GetBackend(name: str) -> StorageBackend | ModuleType:
+    match name:
+        case 'docapi':
+            return yandexcloud
+        case 'sqlite':
+            import utils.sqlite as sqlite
+            return sqlite
+        case _:
+            raise ValueError(f"There is no storage backend '{name}'")
+
+# Define the chosen storage backend
+backend: StorageBackend | ModuleType = yandexcloud
+
+# Get the errors of the chosen storage which the callers may survive (like the missing table or the failed connection)
+def GetStorageErrors() -> tuple[type[Exception], ...]:
+    return backend.storage_errors()
+
+# Make the query which is only an optimization (like the caches): the storage's error is reported, and the default is returned instead
+def TryQuery(name: str, query: Callable, *args, default=None, **fields):
+    try:
+        return query(*args)
+    except GetStorageErrors() as error:
+        ReportError(name, error, **fields)
+        return default
+
+# Query to the storage for finding user's information
+@Traced('db.query_find')
+def query_find(id: Decimal) -> dict:
+    return backend.query_find(id)
+
+# Query to the storage for finding the information of several users at once
+@Traced('db.query_find_batch')
+def query_find_batch(ids: list[Decimal]) -> dict:
+    return backend.query_find_batch(ids)
+
+# Query to the storage for getting one page of users' information by the specified role
+@Traced('db.query_search_page')
+def query_search_page(role: str, limit: int, start_id: Decimal | None = None, forward: bool = True) -> dict:
+    return backend.query_search_page(role, limit, start_id, forward)
+
+# Query to the storage for setting the specified fields of user's information
+@Traced('db.query_upsert')
+def query_upsert(id: Decimal, defaults: dict, **fields) -> dict:
+    return backend.query_upsert(id, defaults, **fields)
+
+# Query to the storage for atomically changing user's budget
+@Traced('db.query_add_budget')
+def query_add_budget(id: Decimal, amount: Decimal, minimum: Decimal | None = Decimal(0)) -> dict | None:
+    return backend.query_add_budget(id, amount, minimum)
+
+# Query to the storage for atomically setting user's budget to zero
+@Traced('db.query_clear_budget')
+def query_clear_budget(id: Decimal, limit: Decimal) -> dict | None:
+    return backend.query_clear_budget(id, limit)
+
+# Query to the storage for reserving the amount from user's budget
+@Traced('db.query_reserve_budget')
+def query_reserve_budget(id: Decimal, amount: Decimal) -> dict | None:
+    return backend.query_reserve_budget(id, amount)
+
+# Query to the storage for committing the reserved amount
+@Traced('db.query_commit_budget')
+def query_commit_budget(id: Decimal, reserved: Decimal, spent: Decimal) -> dict | None:
+    return backend.query_commit_budget(id, reserved, spent)
+
+# Query to the storage for deleting user's information
+@Traced('db.query_delete')
+def query_delete(id: Decimal) -> dict:
+    return backend.query_delete(id)
+
+# Query to the storage for appending the turns to the conversation's history
+@Traced('db.query_append_history')
+def query_append_history(turns: list[dict]) -> dict:
+    return backend.query_append_history(turns)
+
+# Query to the storage for getting one page of the conversation's history
+@Traced('db.query_load_history')
+def query_load_history(chat_id: Decimal, limit: int, start_key: dict | None = None) -> dict:
+    return backend.query_load_history(chat_id, limit, start_key)
+
+# Query to the storage for getting the cached value
+@Traced('db.query_get_cache')
+def query_get_cache(id: str) -> dict | None:
+    return backend.query_get_cache(id)
+
+# Query to the storage for caching the value until the specified time
+@Traced('db.query_put_cache')
+def query_put_cache(id: str, value, expire_at: int) -> dict:
+    return backend.query_put_cache(id, value, expire_at)
+
+# Query to the storage for caching the value only if there is no unexpired one
+@Traced('db.query_claim_cache')
+def query_claim_cache(id: str, value, expire_at: int) -> dict | None:
+    return backend.query_claim_cache(id, value, expire_at)
@@ -1,21 +1,107 @@
 # Import necessary modules, classes and functions
+import json
+from inspect import signature
+from functools import partial
+from hashlib import sha1
+from time import monotonic, time, time_ns
+from threading import Lock
+from typing import Iterable
 from telebot import TeleBot
-from telebot.types import BotCommand, BotCommandScopeChat
+from telebot.types import BotCommand, BotCommandScopeChat, Message
 from decimal import Decimal
-from utils.yandexcloud import query_find, query_search, query_insert, query_update, query_delete
+from utils.cache import LRUCache
+from utils.openai import CountTokens
+from utils.tracing import StartSpan, GetPayloadSize, ReportMetric
+from utils.storage import (query_find, query_find_batch, query_search_page, query_upsert, query_delete,
+                           query_add_budget, query_clear_budget, query_reserve_budget, query_commit_budget,
+                           query_append_history, query_load_history, query_get_cache, query_put_cache, query_claim_cache,
+                           TryQuery)
 
 # Define environment variables
 TELEGRAM_BOT_TOKEN: str | None = None
 OWNER_TELEGRAM_ID: int | None = None
 OWNER_TELEGRAM_NAME: str | None = None
+USER_CACHE_SIZE: int = 1024
+USER_CACHE_TTL: float = 5.0
+USER_CACHE_STRICT: bool = False
+STREAM_EDIT_INTERVAL: float = 1.0
+STREAM_MIN_DELTA: int = 32
+HISTORY_TTL: int = 30 * 24 * 60 * 60
+HISTORY_SUMMARY_THRESHOLD: int = 3000
+RESPONSE_CACHE: bool = False
+RESPONSE_CACHE_SIZE: int = 256
+RESPONSE_CACHE_TTL: int = 24 * 60 * 60
+RESPONSE_CACHE_PERSISTENT: bool = True
+RESPONSE_CACHE_HISTORY: bool = False
+RESPONSE_CACHE_PROMPT_LIMIT: int = 256
+UPDATE_DEDUP: bool = True
+UPDATE_DEDUP_TTL: int = 24 * 60 * 60
+UPDATE_DEDUP_CACHE_SIZE: int = 4096
 
 # Initialize environment variables
 def InitEnvVars(env_vars: dict):
     global TELEGRAM_BOT_TOKEN, OWNER_TELEGRAM_ID, OWNER_TELEGRAM_NAME
+    global USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_STRICT, user_cache
+    global STREAM_EDIT_INTERVAL, STREAM_MIN_DELTA, HISTORY_TTL, HISTORY_SUMMARY_THRESHOLD
+    global RESPONSE_CACHE, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_PERSISTENT, RESPONSE_CACHE_HISTORY
+    global RESPONSE_CACHE_PROMPT_LIMIT, response_cache
+    global UPDATE_DEDUP, UPDATE_DEDUP_TTL, UPDATE_DEDUP_CACHE_SIZE, claimed_updates
     
     TELEGRAM_BOT_TOKEN = env_vars.get('TELEGRAM_BOT_TOKEN')
     OWNER_TELEGRAM_ID = env_vars.get('OWNER_TELEGRAM_ID')
     OWNER_TELEGRAM_NAME = env_vars.get('OWNER_TELEGRAM_NAME')
+    USER_CACHE_SIZE = int(env_vars.get('USER_CACHE_SIZE') or USER_CACHE_SIZE)
+    USER_CACHE_TTL = float(env_vars.get('USER_CACHE_TTL') or USER_CACHE_TTL)
+    USER_CACHE_STRICT = (env_vars.get('USER_CACHE_STRICT') or '').lower() in ('1', 'true', 'yes')
+    STREAM_EDIT_INTERVAL = float(env_vars.get('STREAM_EDIT_INTERVAL') or STREAM_EDIT_INTERVAL)
+    STREAM_MIN_DELTA = int(env_vars.get('STREAM_MIN_DELTA') or STREAM_MIN_DELTA)
+    HISTORY_TTL = int(env_vars.get('HISTORY_TTL') or HISTORY_TTL)
+    HISTORY_SUMMARY_THRESHOLD = int(env_vars.get('HISTORY_SUMMARY_THRESHOLD') or HISTORY_SUMMARY_THRESHOLD)
+    RESPONSE_CACHE = (env_vars.get('RESPONSE_CACHE') or '').lower() in ('1', 'true', 'yes')
+    RESPONSE_CACHE_SIZE = int(env_vars.get('RESPONSE_CACHE_SIZE') or RESPONSE_CACHE_SIZE)
+    RESPONSE_CACHE_TTL = int(env_vars.get('RESPONSE_CACHE_TTL') or RESPONSE_CACHE_TTL)
+    RESPONSE_CACHE_PERSISTENT = (env_vars.get('RESPONSE_CACHE_PERSISTENT') or 'true').lower() in ('1', 'true', 'yes')
+    RESPONSE_CACHE_HISTORY = (env_vars.get('RESPONSE_CACHE_HISTORY') or '').lower() in ('1', 'true', 'yes')
+    RESPONSE_CACHE_PROMPT_LIMIT = int(env_vars.get('RESPONSE_CACHE_PROMPT_LIMIT') or RESPONSE_CACHE_PROMPT_LIMIT)
+    UPDATE_DEDUP = (env_vars.get('UPDATE_DEDUP') or 'true').lower() in ('1', 'true', 'yes')
+    UPDATE_DEDUP_TTL = int(env_vars.get('UPDATE_DEDUP_TTL') or UPDATE_DEDUP_TTL)
+    UPDATE_DEDUP_CACHE_SIZE = int(env_vars.get('UPDATE_DEDUP_CACHE_SIZE') or UPDATE_DEDUP_CACHE_SIZE)
+
+    user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+    response_cache = LRUCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+    claimed_updates = LRUCache(UPDATE_DEDUP_CACHE_SIZE, UPDATE_DEDUP_TTL)
+
+# Define the maximum number of the attempts to decrease the budget which is changed concurrently
+BUDGET_UPDATE_ATTEMPTS = 5
+
+# Define the warm-container cache of the users' information
+user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# Define the warm-container tier of the cached responses of the chat models (the persistent tier is in the database)
+response_cache = LRUCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+response_cache_persistent_hits = 0
+response_cache_lock = Lock()
+
+# Define the warm-container set of the claimed updates (the claims of all containers are in the database)
+claimed_updates = LRUCache(UPDATE_DEDUP_CACHE_SIZE, UPDATE_DEDUP_TTL)
+
+# Define the information stored for new users of the bot
+DEFAULT_USER_INFO = {
+    'name': 'unknown',
+    'role': 'banned',
+    'language': 'en',
+    'model': 'gpt-3.5-turbo',
+    'budget': Decimal(0),
+}
+
+# Define the information returned for users missing in the database
+UNKNOWN_USER_INFO = {
+    'name': 'unknown',
+    'role': 'unknown',
+    'language': 'unknown',
+    'model': 'unknown',
+    'budget': Decimal(0),
+}
 
 # Define base commands for the bot
 BASE_COMMANDS = [
@@ -41,25 +127,268 @@ OWNER_COMMANDS = ADMIN_COMMANDS + [
     BotCommand('users', 'Manage users and admins of the bot'),
 ]
 
-# Update the bot's commands for the specified user
-def UpdateBotCommands(telegram_bot: TeleBot, chat_id: int, user_id: int):
-    match GetCategory(user_id):
-        case 'owner':
-            telegram_bot.set_my_commands(scope=BotCommandScopeChat(chat_id), commands=OWNER_COMMANDS)
-        case 'admin':
-            telegram_bot.set_my_commands(scope=BotCommandScopeChat(chat_id), commands=ADMIN_COMMANDS)
-        case 'user':
-            telegram_bot.set_my_commands(scope=BotCommandScopeChat(chat_id), commands=USER_COMMANDS)
-        case 'banned':
-            telegram_bot.set_my_commands(scope=BotCommandScopeChat(chat_id), commands=BASE_COMMANDS)
-        case _:
-            telegram_bot.set_my_commands(scope=BotCommandScopeChat(chat_id), commands=BASE_COMMANDS)
-            SetCategory(user_id, 'banned')
-            SetName(user_id, telegram_bot.get_chat_member(chat_id, user_id).user.username)
+# The wrapper of the bot, which returns the last reply of the update handler in the webhook response instead of sending it
+class WebhookReply():
+    # Define the bot's methods that can be deferred and their Bot API names and parameters
+    METHODS = {
+        'send_message': ('sendMessage', ('chat_id', 'text', 'parse_mode', 'disable_notification', 'reply_markup')),
+        'edit_message_text': ('editMessageText', ('text', 'chat_id', 'message_id', 'inline_message_id', 'parse_mode', 'reply_markup')),
+        'answer_callback_query': ('answerCallbackQuery', ('callback_query_id', 'text', 'show_alert', 'url', 'cache_time')),
+    }
+
+    def __init__(self, telegram_bot: TeleBot):
+        self.telegram_bot = telegram_bot
+        self.pending = None
+
+    # Get the bot's method (any call except the deferrable ones sends the deferred reply first to keep the order)
+    def __getattr__(self, name: str):
+        if name in self.METHODS:
+            return partial(self.defer, name)
+
+        self.flush()
+
+        return getattr(self.telegram_bot, name)
+
+    # Defer the call of the bot's method (the deferred calls return nothing)
+    def defer(self, name: str, *args, **kwargs):
+        method, parameters = self.METHODS[name]
+        arguments = signature(getattr(self.telegram_bot, name)).bind(*args, **kwargs).arguments
+
+        self.flush()
+
+        # The calls with the parameters unsupported in the webhook response are never deferred
+        if any(value is not None for parameter, value in arguments.items() if parameter not in parameters):
+            return getattr(self.telegram_bot, name)(*args, **kwargs)
+
+        self.pending = (name, args, kwargs, method, arguments)
+
+    # Send the deferred reply with the usual Bot API call
+    def flush(self):
+        if self.pending is None:
+            return
+
+        name, args, kwargs, _, _ = self.pending
+        self.pending = None
+
+        getattr(self.telegram_bot, name)(*args, **kwargs)
+
+    # Get the deferred reply as the body of the webhook response (None if there is no reply)
+    def response(self) -> dict | None:
+        if self.pending is None:
+            return None
+
+        _, _, _, method, arguments = self.pending
+        self.pending = None
+
+        body = {'method': method}
+
+        for parameter, value in arguments.items():
+            if value is None:
+                continue
+
+            # The keyboards may be serialized in advance, and the body has to contain them as objects
+            if hasattr(value, 'to_dict'):
+                value = value.to_dict()
+            elif parameter == 'reply_markup' and isinstance(value, str):
+                value = json.loads(value)
+
+            body[parameter] = value
+
+        return body
+
+# Get the bot sending the replies immediately (the deferred reply is sent first)
+def GetDirectBot(telegram_bot: TeleBot | WebhookReply) -> TeleBot:
+    if isinstance(telegram_bot, WebhookReply):
+        telegram_bot.flush()
+        return telegram_bot.telegram_bot
+
+    return telegram_bot
+
+# Trace the calls of Bot API methods (the request function of the library is wrapped once, when the tracing is enabled)
+def TraceBotAPI():
+    from telebot import apihelper
+
+    make_request = apihelper._make_request
+
+    if getattr(make_request, 'traced', False):
+        return
+
+    def traced_request(token, method_name, method='get', params=None, files=None):
+        with StartSpan(f"telegram.{method_name}") as span:
+            result = make_request(token, method_name, method, params=params, files=files)
+
+            if span:
+                span.set(request_bytes=GetPayloadSize(params), response_bytes=GetPayloadSize(result))
+
+        return result
+
+    traced_request.traced = True
+    apihelper._make_request = traced_request
+
+# Define the maximum length of the text of the message
+MESSAGE_LENGTH_LIMIT = 4096
+
+# Define the text of the message shown until the first part of the streamed text comes
+STREAM_PLACEHOLDER = "…"
+
+# Send the streamed text as the reply to the message, editing it progressively (the whole text is returned)
+def StreamMessage(telegram_bot: TeleBot | WebhookReply, message: Message, parts: Iterable[str]) -> str:
+    # The message is edited many times, so the edits cannot be deferred to the webhook response
+    telegram_bot = GetDirectBot(telegram_bot)
+    chat_id = message.chat.id
+
+    message_id = telegram_bot.send_message(chat_id, STREAM_PLACEHOLDER, reply_to_message_id=message.message_id).message_id
+    received = []
+    text = ''
+    shown = STREAM_PLACEHOLDER
+    edited_at = monotonic()
+
+    for part in parts:
+        received.append(part)
+        text += part
+
+        # The text which does not fit into the message is continued in the next one
+        while len(text) > MESSAGE_LENGTH_LIMIT:
+            head, text = SplitMessageText(text)
+
+            if not head:
+                continue
+
+            # The first head finishes the current message, and the next ones (of the same long part) are sent as the new messages
+            if message_id is None:
+                telegram_bot.send_message(chat_id, head)
+            elif head != shown.rstrip():
+                telegram_bot.edit_message_text(head, chat_id, message_id)
+
+            message_id = None
+            shown = ''
+
+        # The next message is sent only when its text comes (Telegram rejects the empty ones)
+        if message_id is None:
+            text = text.lstrip()
+
+            if text:
+                message_id = telegram_bot.send_message(chat_id, text).message_id
+                shown = text
+                edited_at = monotonic()
+
+            continue
+
+        # The edits are throttled to stay under the rate limits of Telegram
+        if len(text) - len(shown) >= STREAM_MIN_DELTA and monotonic() - edited_at >= STREAM_EDIT_INTERVAL and text.strip():
+            telegram_bot.edit_message_text(text, chat_id, message_id)
+            shown = text
+            edited_at = monotonic()
+
+    # Telegram strips the trailing whitespace, so the text differing only by it is not edited again
+    if message_id is not None and text.strip() and text.rstrip() != shown.rstrip():
+        telegram_bot.edit_message_text(text, chat_id, message_id)
+
+    return "".join(received)
+
+# Send the whole text as the reply to the message (the text which does not fit into one message is continued in the next ones)
+def SendMessage(telegram_bot: TeleBot | WebhookReply, message: Message, text: str) -> str:
+    rest = text
+    reply_to_message_id = message.message_id
+
+    while len(rest) > MESSAGE_LENGTH_LIMIT:
+        head, rest = SplitMessageText(rest)
+
+        if head:
+            telegram_bot.send_message(message.chat.id, head, reply_to_message_id=reply_to_message_id)
+            reply_to_message_id = None
+
+    # The whitespace left after the split is not sent as a separate message
+    if rest or reply_to_message_id is not None:
+        telegram_bot.send_message(message.chat.id, rest, reply_to_message_id=reply_to_message_id)
+
+    return text
+
+# Split the text into the part fitting into one message (preferably at a line or a word boundary) and the rest
+# The whitespace around the split is dropped, so neither part starts or ends with it (and each of them may be empty)
+def SplitMessageText(text: str) -> tuple[str, str]:
+    head = text[:MESSAGE_LENGTH_LIMIT]
+    position = max(head.rfind('\n'), head.rfind(' '))
+
+    if position <= 0:
+        position = MESSAGE_LENGTH_LIMIT
+
+    return text[:position].rstrip(), text[position:].lstrip()
+
+# Get the marker of the bot's startup configuration (it changes only with the base commands or the owner)
+def GetStartupMarker(owner_id: int, owner_name: str) -> str:
+    configuration = [f"{command.command}:{command.description}" for command in BASE_COMMANDS] + [f"{owner_id}:{owner_name}"]
+
+    return sha1("\n".join(configuration).encode()).hexdigest()[:16]
+
+# Define the command sets of the bot for each category of users
+COMMAND_SETS = {
+    'owner': OWNER_COMMANDS,
+    'admin': ADMIN_COMMANDS,
+    'user': USER_COMMANDS,
+    'base': BASE_COMMANDS,
+}
+
+# Define the command sets already pushed to the chats by this container
+pushed_commands: dict[int, str] = {}
+
+# Update the bot's commands for the specified user (only if the user's category has changed since the last update)
+def UpdateBotCommands(telegram_bot: TeleBot, chat_id: int, user: dict):
+    user_id = int(user['id'])
+
+    if GetCategory(user_id, user) == 'unknown':
+        name = telegram_bot.get_chat_member(chat_id, user_id).user.username
+        SetUserInfo(user_id, user, role='banned', name=name or 'unknown')
+
+    commands = GetCommandSet(GetCategory(user_id, user))
+
+    if GetPushedCommands(chat_id, user) == commands:
+        return
+
+    telegram_bot.set_my_commands(scope=BotCommandScopeChat(chat_id), commands=COMMAND_SETS[commands])
+    SetPushedCommands(chat_id, commands, user)
+
+# Get the name of the command set for the specified category of users
+def GetCommandSet(role: str) -> str:
+    if role in ('owner', 'admin', 'user'):
+        return role
+
+    return 'base'
+
+# Get the name of the command set last pushed to the chat
+def GetPushedCommands(chat_id: int, user: dict) -> str | None:
+    # The command set of the user's private chat is stored next to the user's information
+    if chat_id == int(user['id']):
+        return user['info'].get('commands', None)
+
+    return pushed_commands.get(chat_id, None)
+
+# Save the name of the command set pushed to the chat
+def SetPushedCommands(chat_id: int, commands: str, user: dict) -> bool:
+    pushed_commands[chat_id] = commands
+
+    if chat_id != int(user['id']):
+        return True
+
+    return SetUserInfo(int(user['id']), user, commands=commands)
+
+# Get the user's context (the information loaded once per update and passed through the handlers)
+def GetUserContext(user_id: int, authorization: bool = False) -> dict:
+    # In the strict mode the context used for authorization checks is always read from the database
+    user = GetUserInfo(user_id, strict=authorization and USER_CACHE_STRICT)
+
+    if user:
+        return user
+
+    return {
+        'id': Decimal(user_id),
+        'info': dict(UNKNOWN_USER_INFO)
+    }
 
 # Get the user's name
-def GetName(user_id: int) -> str:
-    user = GetUserInfo(user_id)
+def GetName(user_id: int, user: dict | None = None) -> str:
+    if user is None:
+        user = GetUserInfo(user_id)
 
     if user:
         return user['info']['name']
@@ -67,8 +396,9 @@ def GetName(user_id: int) -> str:
     return 'unknown'
 
 # Get the user's category
-def GetCategory(user_id: int) -> str:
-    user = GetUserInfo(user_id)
+def GetCategory(user_id: int, user: dict | None = None) -> str:
+    if user is None:
+        user = GetUserInfo(user_id)
     
     if user:
         return user['info']['role']
@@ -76,8 +406,9 @@ def GetCategory(user_id: int) -> str:
     return 'unknown'
 
 # Get the user's language
-def GetLanguage(user_id: int) -> str:
-    user = GetUserInfo(user_id)
+def GetLanguage(user_id: int, user: dict | None = None) -> str:
+    if user is None:
+        user = GetUserInfo(user_id)
 
     if user:
         return user['info']['language']
@@ -85,8 +416,9 @@ def GetLanguage(user_id: int) -> str:
     return 'unknown'
 
 # Get the user's chat model
-def GetModel(user_id: int) -> str:
-    user = GetUserInfo(user_id)
+def GetModel(user_id: int, user: dict | None = None) -> str:
+    if user is None:
+        user = GetUserInfo(user_id)
 
     if user:
         return user['info']['model']
@@ -94,8 +426,9 @@ def GetModel(user_id: int) -> str:
     return 'unknown'
 
 # Get the user's remaining budget
-def GetBudget(user_id: int) -> Decimal:
-    user = GetUserInfo(user_id)
+def GetBudget(user_id: int, user: dict | None = None) -> Decimal:
+    if user is None:
+        user = GetUserInfo(user_id)
 
     if user:
         return user['info']['budget']
@@ -103,166 +436,370 @@ def GetBudget(user_id: int) -> Decimal:
     return Decimal(0)
 
 # Set the user's name
-def SetName(id: int, name: str) -> bool:
+def SetName(id: int, name: str, user: dict | None = None) -> bool:
     if len(name) > 32:
         return False
 
-    user = GetUserInfo(id)
-    
-    if user:
-        response = query_update(
-            id=Decimal(id),
-            name=name,
-            role=user['info']['role'],
-            language=user['info']['language'],
-            model=user['info']['model'],
-            budget=user['info']['budget']
-        )
-    else:
-        response = query_insert(
-            id=Decimal(id),
-            name=name,
-            role="banned",
-            language="en",
-            model="gpt-3.5-turbo",
-            remaining_budget=Decimal(0)
-        )
-    
-    return response.get('ResponseMetadata', {}).get('HTTPStatusCode', None) == 200
+    return SetUserInfo(id, user, name=name)
 
 # Set the user's category
-def SetCategory(id: int, role: str) -> bool:
+def SetCategory(id: int, role: str, user: dict | None = None) -> bool:
     if role not in ('owner', 'admin', 'user', 'banned'):
         return False
 
-    user = GetUserInfo(id)
-    
-    if user:
-        response = query_update(
-            id=Decimal(id),
-            name=user['info']['name'],
-            role=role,
-            language=user['info']['language'],
-            model=user['info']['model'],
-            budget=user['info']['budget']
-        )
-    else:
-        response = query_insert(
-            id=Decimal(id),
-            name="unknown",
-            role=role,
-            language="en",
-            model="gpt-3.5-turbo",
-            budget=Decimal(0)
-        )
-    
-    return response.get('ResponseMetadata', {}).get('HTTPStatusCode', None) == 200
+    # Make the next update from the user's private chat resync the bot's commands
+    pushed_commands.pop(int(id), None)
+
+    return SetUserInfo(id, user, role=role)
 
 # Set the user's language
-def SetLanguage(id: int, language: str) -> bool:
+def SetLanguage(id: int, language: str, user: dict | None = None) -> bool:
     if language not in ('en', 'ru'):
         return False
 
-    user = GetUserInfo(id)
-    
-    if user:
-        response = query_update(
-            id=Decimal(id),
-            name=user['info']['name'],
-            role=user['info']['role'],
-            language=language,
-            model=user['info']['model'],
-            budget=user['info']['budget']
-        )
-    else:
-        response = query_insert(
-            id=Decimal(id),
-            name="unknown",
-            role="banned",
-            language=language,
-            model="gpt-3.5-turbo",
-            budget=Decimal(0)
-        )
-    
-    return response.get('ResponseMetadata', {}).get('HTTPStatusCode', None) == 200
+    return SetUserInfo(id, user, language=language)
 
 # Set the user's chat model
-def SetModel(id: int, model: str) -> bool:
+def SetModel(id: int, model: str, user: dict | None = None) -> bool:
     if model not in ('gpt-3.5-turbo', 'gpt-4'):
         return False
 
-    user = GetUserInfo(id)
-    
-    if user:
-        response = query_update(
-            id=Decimal(id),
-            name=user['info']['name'],
-            role=user['info']['role'],
-            language=user['info']['language'],
-            model=model,
-            budget=user['info']['budget']
-        )
-    else:
-        response = query_insert(
-            id=Decimal(id),
-            name="unknown",
-            role="banned",
-            language="en",
-            model=model,
-            budget=Decimal(0)
-        )
-    
-    return response.get('ResponseMetadata', {}).get('HTTPStatusCode', None) == 200
+    return SetUserInfo(id, user, model=model)
 
 # Set the user's remaining budget
-def SetBudget(id: int, budget: Decimal) -> bool:
+def SetBudget(id: int, budget: Decimal, user: dict | None = None) -> bool:
     if budget < 0:
         return False
 
-    user = GetUserInfo(id)
-    
-    if user:
-        response = query_update(
-            id=Decimal(id),
-            name=user['info']['name'],
-            role=user['info']['role'],
-            language=user['info']['language'],
-            model=user['info']['model'],
-            budget=budget
-        )
+    return SetUserInfo(id, user, budget=budget)
+
+# Increase the user's remaining budget (the new budget is returned)
+def IncreaseBudget(id: int, amount: Decimal, user: dict | None = None) -> Decimal | None:
+    if amount < 0:
+        return None
+
+    return SetBudgetFromResponse(id, user, query_add_budget(Decimal(id), amount, minimum=None))
+
+# Decrease the user's remaining budget, but not below zero (the new budget is returned)
+def DecreaseBudget(id: int, amount: Decimal, user: dict | None = None) -> Decimal | None:
+    if amount < 0:
+        return None
+
+    # The concurrent changes of the budget are retried, but not forever (None if every attempt has failed)
+    for _ in range(BUDGET_UPDATE_ATTEMPTS):
+        response = query_add_budget(Decimal(id), -amount)
+
+        # The budget is less than the amount, so it is set to zero (unless it was increased concurrently)
+        if response is None:
+            response = query_clear_budget(Decimal(id), amount)
+
+        if response is not None:
+            return SetBudgetFromResponse(id, user, response)
+
+        if GetUserInfo(id, strict=True) is None:
+            return None
+
+    return None
+
+# Reserve the amount from the user's remaining budget before the paid request
+def ReserveBudget(id: int, amount: Decimal, user: dict | None = None) -> bool:
+    return SetBudgetFromResponse(id, user, query_reserve_budget(Decimal(id), amount)) is not None
+
+# Commit the amount reserved from the user's remaining budget after the paid request
+def CommitBudget(id: int, reserved: Decimal, spent: Decimal, user: dict | None = None) -> bool:
+    # Nothing is returned to the budget if the whole reserved amount is spent
+    if spent >= reserved:
+        return True
+
+    return SetBudgetFromResponse(id, user, query_commit_budget(Decimal(id), reserved, spent)) is not None
+
+# Save the user's budget returned by the database to the user's context and to the cache
+def SetBudgetFromResponse(id: int, user: dict | None, response: dict | None) -> Decimal | None:
+    if response is None:
+        return None
+
+    budget = response['Attributes']['info']['budget']
+
+    if user is not None:
+        user['info']['budget'] = budget
+        user_cache.set(int(id), CopyUserInfo(user))
     else:
-        response = query_insert(
-            id=Decimal(id),
-            name="unknown",
-            role="banned",
-            language="en",
-            model="gpt-3.5-turbo",
-            budget=budget
-        )
-    
-    return response.get('ResponseMetadata', {}).get('HTTPStatusCode', None) == 200
+        user_cache.delete(int(id))
+
+    return budget
+
+# Write the changed fields of the user's information to the database (and to the user's context, if it is passed)
+def SetUserInfo(id: int, user: dict | None, **changes) -> bool:
+    response = query_upsert(Decimal(id), DEFAULT_USER_INFO, **changes)
+
+    if response.get('ResponseMetadata', {}).get('HTTPStatusCode', None) != 200:
+        return False
+
+    item = response['Attributes']
+
+    if user is not None:
+        user['info'].update(item['info'])
+
+    user_cache.set(int(id), CopyUserInfo(item))
+
+    return True
+
+# Get the information about the user from the cache or from the database
+def GetUserInfo(user_id: int, strict: bool = False) -> dict | None:
+    if not strict:
+        user = user_cache.get(int(user_id))
+
+        if user is not None:
+            return CopyUserInfo(user)
 
-# Get the information about the user from the database
-def GetUserInfo(user_id: int) -> dict | None:
     response = query_find(Decimal(user_id))
+    user = response.get('Item', None)
+
+    if user is not None:
+        user_cache.set(int(user_id), CopyUserInfo(user))
+
+    return user
+
+# Get the information about several users from the database at once and put it to the cache
+def PrefetchUserInfo(user_ids: list[int]):
+    # In the strict mode the users' information is read again for the authorization checks anyway
+    if USER_CACHE_STRICT:
+        return
+
+    user_ids = [user_id for user_id in set(user_ids) if not user_cache.contains(int(user_id))]
+
+    if not user_ids:
+        return
+
+    response = query_find_batch([Decimal(user_id) for user_id in user_ids])
+
+    for user in response.get('Items', []):
+        user_cache.set(int(user['id']), CopyUserInfo(user))
+
+# Copy the information about the user (so the cached one is never changed by the handlers)
+def CopyUserInfo(user: dict) -> dict:
+    return dict(user, info=dict(user['info']))
+
+# Get one page of the users of the specified category, starting after (or before) the user with the specified id
+def GetUsersPageByCategory(user_role: str, limit: int, start_id: int | None = None, forward: bool = True) -> tuple[list[dict], bool, bool]:
+    # One extra user is requested to find out whether there is one more page in this direction
+    response = query_search_page(user_role, limit + 1, None if start_id is None else Decimal(start_id), forward)
+    users = response.get('Items', [])
+
+    has_more = len(users) > limit
+    users = users[:limit]
+
+    if forward:
+        return users, start_id is not None, has_more
+
+    return users[::-1], has_more, True
+
+# Define the number of the conversation's turns read from the database at once
+HISTORY_PAGE_SIZE = 50
+
+# Append the messages to the conversation's history (the tokens of every turn are counted once and stored with it)
+def AppendHistory(chat_id: int, messages: list[dict]) -> list[dict]:
+    now = time_ns()
+
+    turns = [NewHistoryTurn(chat_id, f"{now + number:020d}", message) for number, message in enumerate(messages)]
+    query_append_history(turns)
+
+    return turns
 
-    return response.get('Item', None)
+# Get the newest turns of the conversation's history fitting into the token limit (in the chronological order)
+def LoadHistory(chat_id: int, token_limit: int) -> list[dict]:
+    turns = []
+    tokens = 0
+    start_key = None
+
+    while True:
+        response = query_load_history(Decimal(chat_id), HISTORY_PAGE_SIZE, start_key)
+
+        for turn in response.get('Items', []):
+            # The turns before the reset are never loaded again (they expire later)
+            if turn['role'] == 'reset' or tokens + int(turn['tokens']) > token_limit:
+                return turns[::-1]
+
+            tokens += int(turn['tokens'])
+            turns.append(turn)
+
+            # The turns before the summary are already folded into it
+            if turn['role'] == 'summary':
+                return turns[::-1]
+
+        start_key = response.get('LastEvaluatedKey', None)
+
+        if start_key is None:
+            return turns[::-1]
+
+# Get the newest messages of the conversation's history fitting into the token limit (in the chronological order)
+def GetHistory(chat_id: int, token_limit: int) -> list[dict]:
+    return HistoryToMessages(LoadHistory(chat_id, token_limit))
+
+# Convert the turns of the conversation's history to the messages for the chat model
+def HistoryToMessages(turns: list[dict]) -> list[dict]:
+    messages = []
+
+    for turn in turns:
+        if turn['role'] == 'summary':
+            messages.append({'role': 'system', 'content': f"Summary of the earlier conversation:\n{turn['content']}"})
+        else:
+            messages.append({'role': turn['role'], 'content': turn['content']})
+
+    return messages
+
+# Get the oldest turns of the conversation's history to be folded into the summary (none while the history is short enough)
+def GetHistoryToSummarize(turns: list[dict]) -> list[dict]:
+    tokens = sum(int(turn['tokens']) for turn in turns)
+
+    if tokens <= HISTORY_SUMMARY_THRESHOLD:
+        return []
+
+    # The newest turns are kept as they are, and the older ones (with the previous summary) are folded
+    folded = []
+
+    for turn in turns:
+        if tokens <= HISTORY_SUMMARY_THRESHOLD // 2:
+            break
+
+        folded.append(turn)
+        tokens -= int(turn['tokens'])
+
+    return folded
+
+# Save the summary of the conversation's turns up to the specified one (it replaces them in the loaded history)
+def SaveHistorySummary(chat_id: int, last_turn: str, summary: str, tokens: int | None = None) -> dict:
+    # The summary's key is placed right after the last summarized turn and before the next one
+    turn = NewHistoryTurn(chat_id, f"{last_turn}~", {'role': 'summary', 'content': summary, 'tokens': tokens or CountTokens(summary)})
+    query_append_history([turn])
+
+    return turn
+
+# Reset the conversation's history with a single write
+def ResetHistory(chat_id: int) -> bool:
+    return bool(AppendHistory(chat_id, [{'role': 'reset', 'content': '', 'tokens': 0}]))
+
+# Create the turn of the conversation's history
+def NewHistoryTurn(chat_id: int, key: str, message: dict) -> dict:
+    return {
+        'chat_id': Decimal(chat_id),
+        'turn': key,
+        'role': message['role'],
+        'content': message['content'],
+        'tokens': Decimal(message['tokens'] if 'tokens' in message else CountTokens(message['content'])),
+        'expire_at': Decimal(int(time()) + HISTORY_TTL)
+    }
+
+# Get the key of the cached response of the chat model to the request (None if the response must not be cached)
+def GetResponseCacheKey(model: str, request: dict, turns: list[dict]) -> str | None:
+    if not RESPONSE_CACHE or len(request['content']) > RESPONSE_CACHE_PROMPT_LIMIT:
+        return None
+
+    # The responses depending on the earlier conversation are cached only if it is allowed explicitly
+    if turns and not RESPONSE_CACHE_HISTORY:
+        return None
+
+    prompt = " ".join(request['content'].casefold().split())
+    history = sha1(json.dumps(HistoryToMessages(turns), ensure_ascii=False).encode()).hexdigest()
+
+    return sha1(f"{model}\n{history}\n{prompt}".encode()).hexdigest()
+
+# Get the cached response of the chat model from the cache or from the database (None if it is not cached)
+def GetCachedResponse(key: str) -> str | None:
+    global response_cache_persistent_hits
+
+    text = response_cache.get(key)
+
+    if text is not None:
+        ReportResponseCache('memory_hit')
+        return text
+
+    if RESPONSE_CACHE_PERSISTENT:
+        item = TryQuery('response_cache_get', query_get_cache, f"response:{key}")
+
+        if item is not None:
+            response_cache.set(key, item['value'], min(RESPONSE_CACHE_TTL, int(item['expire_at']) - time()))
+
+            with response_cache_lock:
+                response_cache_persistent_hits += 1
+
+            ReportResponseCache('persistent_hit')
+            return item['value']
+
+    ReportResponseCache('miss')
 
-# Get the information about the user from the list of users
-def GetUserFromList(user_id: int, users: list[dict]) -> dict | None:
-    for user in users:
-        if user.get('id', None) == Decimal(user_id):
-            return user
     return None
 
-# Get the information about the users of the specified category from the database
-def GetUsersByCategory(user_role: str) -> list[dict]:
-    response = query_search(user_role)
+# Cache the response of the chat model in both tiers
+def SetCachedResponse(key: str, text: str):
+    response_cache.set(key, text)
+
+    if not RESPONSE_CACHE_PERSISTENT:
+        return
+
+    TryQuery('response_cache_put', query_put_cache, f"response:{key}", text, int(time()) + RESPONSE_CACHE_TTL)
+
+# Report the result of the lookup in the response cache
+def ReportResponseCache(result: str):
+    stats = response_cache.stats()
+
+    # The misses of the warm-container tier include the hits of the persistent one
+    ReportMetric(
+        'response_cache',
+        result=result,
+        memory_hits=stats['hits'],
+        persistent_hits=response_cache_persistent_hits,
+        misses=stats['misses'] - response_cache_persistent_hits,
+        size=stats['size']
+    )
+
+# Claim the update before handling it (False if it is already claimed, like the webhook delivery retried by Telegram)
+def ClaimUpdate(update_id: int) -> bool:
+    if not UPDATE_DEDUP:
+        return True
+
+    # The fast retries usually come to the same warm container, so they are acknowledged without the database
+    if claimed_updates.contains(int(update_id)):
+        ReportDuplicateUpdate(update_id, 'memory')
+        return False
+
+    # The claim only protects from the duplicates, so the update is handled if the database fails
+    response = TryQuery('update_claim', query_claim_cache, GetUpdateClaimKey(update_id), 'claimed', int(time()) + UPDATE_DEDUP_TTL,
+                        default=False, update_id=int(update_id))
+
+    if response is False:
+        return True
+
+    claimed = response is not None
+
+    claimed_updates.set(int(update_id), True)
+
+    if not claimed:
+        ReportDuplicateUpdate(update_id, 'database')
+
+    return claimed
+
+# Release the claim of the update whose handling has failed, so its next delivery is handled again
+def ReleaseUpdate(update_id: int):
+    if not UPDATE_DEDUP:
+        return
+
+    claimed_updates.delete(int(update_id))
+
+    # The expired claim is the same as the missing one
+    TryQuery('update_release', query_put_cache, GetUpdateClaimKey(update_id), 'released', 0, update_id=int(update_id))
+
+# Get the key of the update's claim (the updates' ids are unique only within one bot)
+def GetUpdateClaimKey(update_id: int) -> str:
+    return f"update:{(TELEGRAM_BOT_TOKEN or '').split(':')[0]}:{update_id}"
 
-    return response.get('Items', [])
+# Report the acknowledged duplicate of the update
+def ReportDuplicateUpdate(update_id: int, source: str):
+    ReportMetric('duplicate_update', update_id=int(update_id), source=source)
 
 # Delete the user's information from the database
 def DeleteUserInfo(user_id: int) -> bool:
     response = query_delete(Decimal(user_id))
+    user_cache.delete(int(user_id))
 
     return response.get('ResponseMetadata', {}).get('HTTPStatusCode', 200) == 200
\ No newline at end of file
@@ -0,0 +1,144 @@
+# Import necessary modules, classes and functions
+from typing import Callable
+
+# Define the version of the callback data encoding (the buttons with the data of other versions are reported as outdated)
+CALLBACK_VERSION = '1'
+
+# Define the maximum size of the callback data allowed by Telegram (in bytes)
+CALLBACK_DATA_LIMIT = 64
+
+# Define the roles allowed to use the callback actions
+OWNER_ROLES = ('owner',)
+STAFF_ROLES = ('owner', 'admin')
+
+# Define the callback actions: the compact code, the roles allowed to use the action (None for everybody) and the types of the arguments
+CALLBACK_ACTIONS = {
+    'language': ('l', None, (str,)),
+    'settings': ('s', STAFF_ROLES, ()),
+    'settings_language': ('sl', STAFF_ROLES, ()),
+    'settings_language_set': ('sL', STAFF_ROLES, (str,)),
+    'settings_model': ('sm', STAFF_ROLES, ()),
+    'settings_model_set': ('sM', STAFF_ROLES, (str,)),
+    'manage': ('m', OWNER_ROLES, ()),
+    'manage_role': ('mr', OWNER_ROLES, (str,)),
+    'manage_page': ('mp', OWNER_ROLES, (str, str, int)),
+    'manage_user': ('mu', OWNER_ROLES, (str, int)),
+    'manage_set_role': ('mR', OWNER_ROLES, (str, int)),
+    'manage_language': ('ml', OWNER_ROLES, (int,)),
+    'manage_language_set': ('mL', OWNER_ROLES, (str, int)),
+    'manage_model': ('mm', OWNER_ROLES, (int,)),
+    'manage_model_set': ('mM', OWNER_ROLES, (str, int)),
+    'manage_budget': ('mb', OWNER_ROLES, (int,)),
+    'manage_budget_change': ('mB', OWNER_ROLES, (str, int)),
+    'manage_delete': ('md', OWNER_ROLES, (str, int)),
+    'manage_remove': ('mD', OWNER_ROLES, (str, int)),
+}
+
+# Define the callback actions by their codes
+CALLBACK_CODES = {code: action for action, (code, _, _) in CALLBACK_ACTIONS.items()}
+
+# Define the separator of the parts of the callback data
+CALLBACK_SEPARATOR = '.'
+
+# Define the result of decoding the callback data of another version (the button of the message sent before the encoding was changed)
+CALLBACK_OUTDATED = ('outdated', ())
+
+# Encode the callback action and its arguments to the callback data (the version and the code, then the arguments, the numbers in base 36)
+def EncodeCallback(action: str, *args) -> str:
+    code, _, types = CALLBACK_ACTIONS[action]
+
+    if len(args) != len(types):
+        raise ValueError(f"The callback action '{action}' takes {len(types)} arguments, but {len(args)} were given")
+
+    parts = [CALLBACK_VERSION + code]
+
+    for arg_type, arg in zip(types, args):
+        part = PackInt(int(arg)) if arg_type is int else str(arg)
+
+        if not part or CALLBACK_SEPARATOR in part:
+            raise ValueError(f"The argument '{arg}' of the callback action '{action}' cannot be encoded")
+
+        parts.append(part)
+
+    data = CALLBACK_SEPARATOR.join(parts)
+
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"The callback data '{data}' is longer than {CALLBACK_DATA_LIMIT} bytes")
+
+    return data
+
+# Decode the callback data to the callback action and its arguments (CALLBACK_OUTDATED if the data has another version, None if it is malformed)
+def DecodeCallback(data: str) -> tuple[str, tuple] | None:
+    if not data:
+        return None
+
+    head, *parts = data.split(CALLBACK_SEPARATOR)
+
+    if head[:len(CALLBACK_VERSION)] != CALLBACK_VERSION:
+        return CALLBACK_OUTDATED
+
+    action = CALLBACK_CODES.get(head[len(CALLBACK_VERSION):], None)
+
+    if action is None:
+        return None
+
+    _, _, types = CALLBACK_ACTIONS[action]
+
+    if len(parts) != len(types):
+        return None
+
+    try:
+        args = tuple(UnpackInt(part) if arg_type is int else part for arg_type, part in zip(types, parts))
+    except ValueError:
+        return None
+
+    return action, args
+
+# Pack the number to the string in base 36
+def PackInt(number: int) -> str:
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    sign = '-' if number < 0 else ''
+    number = abs(number)
+    packed = ''
+
+    while True:
+        number, digit = divmod(number, 36)
+        packed = digits[digit] + packed
+
+        if number == 0:
+            return sign + packed
+
+# Unpack the number from the string in base 36
+def UnpackInt(packed: str) -> int:
+    return int(packed, 36)
+
+# The router of the callback queries to their handlers (by the action of the callback data)
+class CallbackRouter():
+    def __init__(self):
+        self.handlers = {}
+
+    # Register the handler of the callback action (used as the decorator)
+    def route(self, action: str) -> Callable:
+        if action not in CALLBACK_ACTIONS:
+            raise ValueError(f"There is no callback action '{action}'")
+
+        def decorator(handler: Callable) -> Callable:
+            self.handlers[action] = handler
+            return handler
+
+        return decorator
+
+    # Get the handler of the callback data, the roles allowed to use it and the arguments
+    # (CALLBACK_OUTDATED if the data has another version, None if it cannot be handled)
+    def resolve(self, data: str) -> tuple[Callable, tuple | None, tuple] | None:
+        callback = DecodeCallback(data or '')
+
+        if callback is CALLBACK_OUTDATED:
+            return CALLBACK_OUTDATED
+
+        if callback is None or callback[0] not in self.handlers:
+            return None
+
+        action, args = callback
+
+        return self.handlers[action], CALLBACK_ACTIONS[action][1], args
@@ -1,183 +1,263 @@
 # Import necessary modules, classes and functions
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-from utils.telegram import GetUsersByCategory
+from utils.telegram import GetUsersPageByCategory
+from utils.telegram_callbacks import EncodeCallback, PackInt
 
-# Generate the inline keyboard for managing all users of the bot
-def GenKBUserCategoties() -> InlineKeyboardMarkup:
+# Build the inline keyboard for managing all users of the bot
+def BuildKBUserCategoties() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="Admins", callback_data="manage_admins"))
-    keyboard.add(InlineKeyboardButton(text="Users", callback_data="manage_users"))
-    keyboard.add(InlineKeyboardButton(text="Banned Users", callback_data="manage_banned"))
+    keyboard.add(InlineKeyboardButton(text="Admins", callback_data=EncodeCallback('manage_role', 'admin')))
+    keyboard.add(InlineKeyboardButton(text="Users", callback_data=EncodeCallback('manage_role', 'user')))
+    keyboard.add(InlineKeyboardButton(text="Banned Users", callback_data=EncodeCallback('manage_role', 'banned')))
 
     return keyboard
 
-# Generate the inline keyboard for managing admins of the bot
-def GenKBAdmins() -> InlineKeyboardMarkup:
-    keyboard = InlineKeyboardMarkup(row_width=2)
-
-    for user in GetUsersByCategory('admin'):
-        keyboard.add(InlineKeyboardButton(text=user['info']['name'], callback_data=f"manage_admin_{user['id']}"))
-    
-    keyboard.add(InlineKeyboardButton(text="Back", callback_data="manage"))
+# Define the number of users on one page of the inline keyboards
+USERS_PAGE_SIZE = 10
 
-    return keyboard
-
-# Generate the inline keyboard for managing users of the bot
-def GenKBUsers() -> InlineKeyboardMarkup:
+# Generate the inline keyboard with one page of the users of the specified category
+def GenKBUsersPage(role: str, start_id: int | None = None, forward: bool = True) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    for user in GetUsersByCategory('user'):
-        keyboard.add(InlineKeyboardButton(text=user['info']['name'], callback_data=f"manage_user_{user['id']}"))
-    
-    keyboard.add(InlineKeyboardButton(text="Back", callback_data="manage"))
+    users, has_prev, has_next = GetUsersPageByCategory(role, USERS_PAGE_SIZE, start_id, forward)
 
-    return keyboard
+    for user in users:
+        keyboard.add(InlineKeyboardButton(text=user['info']['name'], callback_data=EncodeCallback('manage_user', role, user['id'])))
 
-# Generate the inline keyboard for managing banned users of the bot
-def GenKBBannedUsers() -> InlineKeyboardMarkup:
-    keyboard = InlineKeyboardMarkup(row_width=2)
+    # The page cursor is the id of the first (or the last) user on the page
+    navigation = []
 
-    for user in GetUsersByCategory('banned'):
-        keyboard.add(InlineKeyboardButton(text=user['info']['name'], callback_data=f"manage_banned_{user['id']}"))
+    if has_prev and users:
+        navigation.append(InlineKeyboardButton(text="« Prev", callback_data=EncodeCallback('manage_page', role, 'prev', users[0]['id'])))
+    if has_next and users:
+        navigation.append(InlineKeyboardButton(text="Next »", callback_data=EncodeCallback('manage_page', role, 'next', users[-1]['id'])))
+
+    if navigation:
+        keyboard.row(*navigation)
     
-    keyboard.add(InlineKeyboardButton(text="Back", callback_data="manage"))
+    keyboard.add(InlineKeyboardButton(text="Back", callback_data=EncodeCallback('manage')))
 
     return keyboard
 
-# Generate the inline keyboard for managing the admin
-def GenKBAdmin(user_id: int) -> InlineKeyboardMarkup:
+# Build the inline keyboard for managing the admin
+def BuildKBAdmin(user_id: int) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="Make User", callback_data=f"manage_role_user_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Make Banned", callback_data=f"manage_role_banned_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Delete Admin", callback_data=f"manage_delete_admin_{user_id}"))
+    keyboard.add(InlineKeyboardButton(text="Make User", callback_data=EncodeCallback('manage_set_role', 'user', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Make Banned", callback_data=EncodeCallback('manage_set_role', 'banned', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Delete Admin", callback_data=EncodeCallback('manage_delete', 'admin', user_id)))
 
-    keyboard.add(InlineKeyboardButton(text="Back", callback_data="manage_admins"))
+    keyboard.add(InlineKeyboardButton(text="Back", callback_data=EncodeCallback('manage_role', 'admin')))
 
     return keyboard
 
-# Generate the inline keyboard for managing the user
-def GenKBUser(user_id: int) -> InlineKeyboardMarkup:
+# Build the inline keyboard for managing the user
+def BuildKBUser(user_id: int) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="Language", callback_data=f"manage_language_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Chat Model", callback_data=f"manage_model_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Remaining Budget", callback_data=f"manage_budget_{user_id}"))
+    keyboard.add(InlineKeyboardButton(text="Language", callback_data=EncodeCallback('manage_language', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Chat Model", callback_data=EncodeCallback('manage_model', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Remaining Budget", callback_data=EncodeCallback('manage_budget', user_id)))
 
-    keyboard.add(InlineKeyboardButton(text="Make Admin", callback_data=f"manage_role_admin_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Make Banned", callback_data=f"manage_role_banned_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Delete User", callback_data=f"manage_delete_user_{user_id}"))
+    keyboard.add(InlineKeyboardButton(text="Make Admin", callback_data=EncodeCallback('manage_set_role', 'admin', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Make Banned", callback_data=EncodeCallback('manage_set_role', 'banned', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Delete User", callback_data=EncodeCallback('manage_delete', 'user', user_id)))
 
-    keyboard.add(InlineKeyboardButton(text="Back", callback_data="manage_users"))
+    keyboard.add(InlineKeyboardButton(text="Back", callback_data=EncodeCallback('manage_role', 'user')))
 
     return keyboard
 
-# Generate the inline keyboard for managing the banned user
-def GenKBBanned(user_id: int) -> InlineKeyboardMarkup:
+# Build the inline keyboard for managing the banned user
+def BuildKBBanned(user_id: int) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="Make Admin", callback_data=f"manage_role_admin_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Make User", callback_data=f"manage_role_user_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Delete Banned User", callback_data=f"manage_delete_banned_{user_id}"))
+    keyboard.add(InlineKeyboardButton(text="Make Admin", callback_data=EncodeCallback('manage_set_role', 'admin', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Make User", callback_data=EncodeCallback('manage_set_role', 'user', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Delete Banned User", callback_data=EncodeCallback('manage_delete', 'banned', user_id)))
 
-    keyboard.add(InlineKeyboardButton(text="Back", callback_data="manage_banned"))
+    keyboard.add(InlineKeyboardButton(text="Back", callback_data=EncodeCallback('manage_role', 'banned')))
 
     return keyboard
 
-# Generate the inline keyboard for managing the user's language
-def GenKBLanguage(user_id: int) -> InlineKeyboardMarkup:
+# Build the inline keyboard for managing the user's language
+def BuildKBLanguage(user_id: int) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="English", callback_data=f"manage_language_en_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Russian", callback_data=f"manage_language_ru_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Leave unchanged", callback_data=f"manage_user_{user_id}"))
+    keyboard.add(InlineKeyboardButton(text="English", callback_data=EncodeCallback('manage_language_set', 'en', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Russian", callback_data=EncodeCallback('manage_language_set', 'ru', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Leave unchanged", callback_data=EncodeCallback('manage_user', 'user', user_id)))
 
     return keyboard
 
-# Generate the inline keyboard for managing the user's chat model
-def GenKBModel(user_id: int) -> InlineKeyboardMarkup:
+# Build the inline keyboard for managing the user's chat model
+def BuildKBModel(user_id: int) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="GPT-3.5-Turbo", callback_data=f"manage_model_gpt35_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="GPT-4", callback_data=f"manage_model_gpt4_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Leave unchanged", callback_data=f"manage_user_{user_id}"))
+    keyboard.add(InlineKeyboardButton(text="GPT-3.5-Turbo", callback_data=EncodeCallback('manage_model_set', 'gpt35', user_id)))
+    keyboard.add(InlineKeyboardButton(text="GPT-4", callback_data=EncodeCallback('manage_model_set', 'gpt4', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Leave unchanged", callback_data=EncodeCallback('manage_user', 'user', user_id)))
 
     return keyboard
 
-# Generate the inline keyboard for managing the user's remaining budget
-def GenKBBudget(user_id: int) -> InlineKeyboardMarkup:
+# Build the inline keyboard for managing the user's remaining budget
+def BuildKBBudget(user_id: int) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="Add 0.1$", callback_data=f"manage_budget_increase_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Remove 0.1$", callback_data=f"manage_budget_decrease_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="Leave unchanged", callback_data=f"manage_user_{user_id}"))
+    keyboard.add(InlineKeyboardButton(text="Add 0.1$", callback_data=EncodeCallback('manage_budget_change', 'increase', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Remove 0.1$", callback_data=EncodeCallback('manage_budget_change', 'decrease', user_id)))
+    keyboard.add(InlineKeyboardButton(text="Leave unchanged", callback_data=EncodeCallback('manage_user', 'user', user_id)))
 
     return keyboard
 
-# Generate the inline keyboard for confirming deleting the admin
-def GenKBDeleteAdmin(user_id: int) -> InlineKeyboardMarkup:
+# Build the inline keyboard for confirming deleting the admin
+def BuildKBDeleteAdmin(user_id: int) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="Yes", callback_data=f"manage_remove_admin_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="No", callback_data=f"manage_admin_{user_id}"))
+    keyboard.add(InlineKeyboardButton(text="Yes", callback_data=EncodeCallback('manage_remove', 'admin', user_id)))
+    keyboard.add(InlineKeyboardButton(text="No", callback_data=EncodeCallback('manage_user', 'admin', user_id)))
 
     return keyboard
 
-# Generate the inline keyboard for confirming deleting the user
-def GenKBDeleteUser(user_id: int) -> InlineKeyboardMarkup:
+# Build the inline keyboard for confirming deleting the user
+def BuildKBDeleteUser(user_id: int) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="Yes", callback_data=f"manage_remove_user_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="No", callback_data=f"manage_user_{user_id}"))
+    keyboard.add(InlineKeyboardButton(text="Yes", callback_data=EncodeCallback('manage_remove', 'user', user_id)))
+    keyboard.add(InlineKeyboardButton(text="No", callback_data=EncodeCallback('manage_user', 'user', user_id)))
 
     return keyboard
 
-# Generate the inline keyboard for confirming deleting the banned user
-def GenKBDeleteBanned(user_id: int) -> InlineKeyboardMarkup:
+# Build the inline keyboard for confirming deleting the banned user
+def BuildKBDeleteBanned(user_id: int) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="Yes", callback_data=f"manage_remove_banned_{user_id}"))
-    keyboard.add(InlineKeyboardButton(text="No", callback_data=f"manage_banned_{user_id}"))
+    keyboard.add(InlineKeyboardButton(text="Yes", callback_data=EncodeCallback('manage_remove', 'banned', user_id)))
+    keyboard.add(InlineKeyboardButton(text="No", callback_data=EncodeCallback('manage_user', 'banned', user_id)))
 
     return keyboard
 
-# Generate the inline keyboard for managing the bot's language
-def GenKBLanguageGeneral() -> InlineKeyboardMarkup:
+# Build the inline keyboard for managing the bot's language
+def BuildKBLanguageGeneral() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="English", callback_data="language_en"))
-    keyboard.add(InlineKeyboardButton(text="Russian", callback_data="language_ru"))
+    keyboard.add(InlineKeyboardButton(text="English", callback_data=EncodeCallback('language', 'en')))
+    keyboard.add(InlineKeyboardButton(text="Russian", callback_data=EncodeCallback('language', 'ru')))
 
     return keyboard
 
-# Generate the inline keyboard for managing the bot's language from the settings
-def GenKBLanguageSettings() -> InlineKeyboardMarkup:
+# Build the inline keyboard for managing the bot's language from the settings
+def BuildKBLanguageSettings() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="English", callback_data="settings_language_en"))
-    keyboard.add(InlineKeyboardButton(text="Russian", callback_data="settings_language_ru"))
+    keyboard.add(InlineKeyboardButton(text="English", callback_data=EncodeCallback('settings_language_set', 'en')))
+    keyboard.add(InlineKeyboardButton(text="Russian", callback_data=EncodeCallback('settings_language_set', 'ru')))
 
-    keyboard.add(InlineKeyboardButton(text="Back", callback_data="settings"))
+    keyboard.add(InlineKeyboardButton(text="Back", callback_data=EncodeCallback('settings')))
 
     return keyboard
 
-# Generate the inline keyboard for managing the bot's chat model
-def GenKBModelSettings() -> InlineKeyboardMarkup:
+# Build the inline keyboard for managing the bot's chat model
+def BuildKBModelSettings() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="GPT-3.5-Turbo", callback_data="settings_model_gpt35"))
-    keyboard.add(InlineKeyboardButton(text="GPT-4", callback_data="settings_model_gpt4"))
+    keyboard.add(InlineKeyboardButton(text="GPT-3.5-Turbo", callback_data=EncodeCallback('settings_model_set', 'gpt35')))
+    keyboard.add(InlineKeyboardButton(text="GPT-4", callback_data=EncodeCallback('settings_model_set', 'gpt4')))
 
-    keyboard.add(InlineKeyboardButton(text="Back", callback_data="settings"))
+    keyboard.add(InlineKeyboardButton(text="Back", callback_data=EncodeCallback('settings')))
 
     return keyboard
 
-# Generate the inline keyboard for managing the bot's settings
-def GenKBSettings() -> InlineKeyboardMarkup:
+# Build the inline keyboard for managing the bot's settings
+def BuildKBSettings() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=2)
 
-    keyboard.add(InlineKeyboardButton(text="Language", callback_data="settings_language"))
-    keyboard.add(InlineKeyboardButton(text="Chat Model", callback_data="settings_model"))
+    keyboard.add(InlineKeyboardButton(text="Language", callback_data=EncodeCallback('settings_language')))
+    keyboard.add(InlineKeyboardButton(text="Chat Model", callback_data=EncodeCallback('settings_model')))
+
+    return keyboard
+
+# Define the user id standing for the real one in the keyboards' templates (its packed form never appears elsewhere)
+TEMPLATE_USER_ID = 36 ** 12 - 1
+
+# Compile the template of the serialized keyboard for any user (the keyboard is split around the user's id)
+def CompileKeyboardTemplate(build) -> list[str]:
+    return build(TEMPLATE_USER_ID).to_json().split(PackInt(TEMPLATE_USER_ID))
+
+# Render the template of the serialized keyboard for the user
+def RenderKeyboardTemplate(template: list[str], user_id: int) -> str:
+    return PackInt(int(user_id)).join(template)
+
+# Define the static keyboards serialized once per container (the handlers send them without building or serializing)
+KB_USER_CATEGORIES = BuildKBUserCategoties().to_json()
+KB_LANGUAGE_GENERAL = BuildKBLanguageGeneral().to_json()
+KB_LANGUAGE_SETTINGS = BuildKBLanguageSettings().to_json()
+KB_MODEL_SETTINGS = BuildKBModelSettings().to_json()
+KB_SETTINGS = BuildKBSettings().to_json()
+
+# Define the templates of the keyboards which differ only in the user's id
+KB_ADMIN_TEMPLATE = CompileKeyboardTemplate(BuildKBAdmin)
+KB_USER_TEMPLATE = CompileKeyboardTemplate(BuildKBUser)
+KB_BANNED_TEMPLATE = CompileKeyboardTemplate(BuildKBBanned)
+KB_LANGUAGE_TEMPLATE = CompileKeyboardTemplate(BuildKBLanguage)
+KB_MODEL_TEMPLATE = CompileKeyboardTemplate(BuildKBModel)
+KB_BUDGET_TEMPLATE = CompileKeyboardTemplate(BuildKBBudget)
+KB_DELETE_ADMIN_TEMPLATE = CompileKeyboardTemplate(BuildKBDeleteAdmin)
+KB_DELETE_USER_TEMPLATE = CompileKeyboardTemplate(BuildKBDeleteUser)
+KB_DELETE_BANNED_TEMPLATE = CompileKeyboardTemplate(BuildKBDeleteBanned)
 
-    return keyboard
\ No newline at end of file
+# Generate the inline keyboard for managing all users of the bot
+def GenKBUserCategoties() -> str:
+    return KB_USER_CATEGORIES
+
+# Generate the inline keyboard for managing the admin
+def GenKBAdmin(user_id: int) -> str:
+    return RenderKeyboardTemplate(KB_ADMIN_TEMPLATE, user_id)
+
+# Generate the inline keyboard for managing the user
+def GenKBUser(user_id: int) -> str:
+    return RenderKeyboardTemplate(KB_USER_TEMPLATE, user_id)
+
+# Generate the inline keyboard for managing the banned user
+def GenKBBanned(user_id: int) -> str:
+    return RenderKeyboardTemplate(KB_BANNED_TEMPLATE, user_id)
+
+# Generate the inline keyboard for managing the user's language
+def GenKBLanguage(user_id: int) -> str:
+    return RenderKeyboardTemplate(KB_LANGUAGE_TEMPLATE, user_id)
+
+# Generate the inline keyboard for managing the user's chat model
+def GenKBModel(user_id: int) -> str:
+    return RenderKeyboardTemplate(KB_MODEL_TEMPLATE, user_id)
+
+# Generate the inline keyboard for managing the user's remaining budget
+def GenKBBudget(user_id: int) -> str:
+    return RenderKeyboardTemplate(KB_BUDGET_TEMPLATE, user_id)
+
+# Generate the inline keyboard for confirming deleting the admin
+def GenKBDeleteAdmin(user_id: int) -> str:
+    return RenderKeyboardTemplate(KB_DELETE_ADMIN_TEMPLATE, user_id)
+
+# Generate the inline keyboard for confirming deleting the user
+def GenKBDeleteUser(user_id: int) -> str:
+    return RenderKeyboardTemplate(KB_DELETE_USER_TEMPLATE, user_id)
+
+# Generate the inline keyboard for confirming deleting the banned user
+def GenKBDeleteBanned(user_id: int) -> str:
+    return RenderKeyboardTemplate(KB_DELETE_BANNED_TEMPLATE, user_id)
+
+# Generate the inline keyboard for managing the bot's language
+def GenKBLanguageGeneral() -> str:
+    return KB_LANGUAGE_GENERAL
+
+# Generate the inline keyboard for managing the bot's language from the settings
+def GenKBLanguageSettings() -> str:
+    return KB_LANGUAGE_SETTINGS
+
+# Generate the inline keyboard for managing the bot's chat model
+def GenKBModelSettings() -> str:
+    return KB_MODEL_SETTINGS
+
+# Generate the inline keyboard for managing the bot's settings
+def GenKBSettings() -> str:
+    return KB_SETTINGS
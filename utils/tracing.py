@@ -0,0 +1,222 @@
+# Import necessary modules, classes and functions
+import json
+import random
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter, time
+from typing import Callable
+
+# Define environment variables
+TRACING_SAMPLE_RATE: float = 0.0
+TRACING_SLOW_THRESHOLD: float = 0.0
+METRICS: bool = True
+
+# Initialize environment variables
+def InitEnvVars(vars: dict):
+    global TRACING_SAMPLE_RATE, TRACING_SLOW_THRESHOLD, METRICS
+
+    TRACING_SAMPLE_RATE = min(max(float(vars.get('TRACING_SAMPLE_RATE') or TRACING_SAMPLE_RATE), 0.0), 1.0)
+    TRACING_SLOW_THRESHOLD = float(vars.get('TRACING_SLOW_THRESHOLD') or TRACING_SLOW_THRESHOLD)
+    METRICS = (vars.get('METRICS') or 'true').lower() in ('1', 'true', 'yes')
+
+# Define service variables (the current span follows the update into the threads started with its context)
+current_span: ContextVar['Span | None'] = ContextVar('current_span', default=None)
+record_exporter: Callable[[dict], None] | None = None
+
+# The trace of one update: its spans and the decision to export it
+class Trace():
+    __slots__ = ('id', 'sampled', 'started', 'spans')
+
+    def __init__(self, sampled: bool):
+        self.id = f"{random.getrandbits(64):016x}"
+        self.sampled = sampled
+        self.started = time()
+        self.spans = []
+
+    # Export the trace when its root span ends (the traces which are not sampled are exported only if they are slow)
+    def finish(self, root: 'Span'):
+        duration = root.duration * 1000
+
+        if not self.sampled and (TRACING_SLOW_THRESHOLD <= 0 or duration < TRACING_SLOW_THRESHOLD):
+            return
+
+        ExportRecord({
+            'kind': 'trace',
+            'trace': self.id,
+            'name': root.name,
+            'timestamp': self.started,
+            'duration_ms': round(duration, 3),
+            **root.attributes,
+            'spans': [span.to_dict(root.started) for span in self.spans[1:]],
+        })
+
+# The timed part of the update's handling
+class Span():
+    __slots__ = ('trace', 'id', 'parent', 'name', 'attributes', 'started', 'duration', 'token', 'detached')
+
+    def __init__(self, trace: Trace, name: str, parent: 'Span | None', attributes: dict, detached: bool = False):
+        self.trace = trace
+        self.id = len(trace.spans)
+        self.parent = parent
+        self.name = name
+        self.attributes = attributes
+        self.started = 0.0
+        self.duration = 0.0
+        self.token = None
+        self.detached = detached
+
+        trace.spans.append(self)
+
+    # Set the attributes of the span
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> 'Span':
+        self.started = perf_counter()
+
+        if not self.detached:
+            self.token = current_span.set(self)
+
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.duration = perf_counter() - self.started
+
+        if error_type is not None:
+            self.attributes['error'] = error_type.__name__
+
+        # The span closed in another context (like an abandoned generator) leaves the current span as it is
+        if self.token is not None:
+            try:
+                current_span.reset(self.token)
+            except ValueError:
+                pass
+
+        if self.parent is None:
+            self.trace.finish(self)
+
+    # Get the span for the log line (the times are in milliseconds since the start of the update)
+    def to_dict(self, started: float) -> dict:
+        return {
+            'id': self.id,
+            'parent': self.parent.id if self.parent else None,
+            'name': self.name,
+            'start_ms': round((self.started - started) * 1000, 3),
+            'duration_ms': round(self.duration * 1000, 3),
+            **self.attributes
+        }
+
+# The span of the update which is not traced (it does nothing, so the handling is not slowed down)
+class NoSpan():
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __enter__(self) -> 'NoSpan':
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        pass
+
+NO_SPAN = NoSpan()
+
+# Check if any updates are traced
+def IsTracingEnabled() -> bool:
+    return TRACING_SAMPLE_RATE > 0 or TRACING_SLOW_THRESHOLD > 0
+
+# Start the trace of the update (with the slow threshold every update is timed, but only the sampled and the slow ones are exported)
+def StartTrace(name: str, **attributes) -> Span | NoSpan:
+    if not IsTracingEnabled():
+        return NO_SPAN
+
+    sampled = random.random() < TRACING_SAMPLE_RATE
+
+    if not sampled and TRACING_SLOW_THRESHOLD <= 0:
+        return NO_SPAN
+
+    return Span(Trace(sampled), name, None, attributes)
+
+# Start the child span of the current one (nothing is done if the update is not traced)
+# The detached span does not become the current one, so it can stay open in a generator while the caller makes other calls
+def StartSpan(name: str, detached: bool = False, **attributes) -> Span | NoSpan:
+    parent = current_span.get()
+
+    if parent is None:
+        return NO_SPAN
+
+    return Span(parent.trace, name, parent, attributes, detached)
+
+# Set the attributes of the update's trace (like the name of its handler)
+def AnnotateTrace(**attributes):
+    span = current_span.get()
+
+    if span is not None:
+        span.trace.spans[0].set(**attributes)
+
+# Set the name of the handler to the trace of the update it handles
+def TracedHandler(function: Callable) -> Callable:
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        AnnotateTrace(handler=function.__name__)
+        return function(*args, **kwargs)
+
+    return wrapper
+
+# Trace the calls of the function as the child spans (the size of the result is recorded too)
+def Traced(name: str) -> Callable:
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if current_span.get() is None:
+                return function(*args, **kwargs)
+
+            with StartSpan(name) as span:
+                result = function(*args, **kwargs)
+                span.set(result_bytes=GetPayloadSize(result))
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+# Get the size of the payload in bytes as it is sent in JSON (only the traced calls pay for it)
+def GetPayloadSize(payload) -> int:
+    if payload is None:
+        return 0
+    if isinstance(payload, (str, bytes)):
+        return len(payload)
+
+    try:
+        return len(json.dumps(payload, ensure_ascii=False, default=str).encode())
+    except (TypeError, ValueError):
+        return 0
+
+# Report the metric as the structured record (nothing is exported if the metrics are turned off)
+def ReportMetric(name: str, **fields):
+    if not METRICS:
+        return
+
+    ExportRecord({'kind': 'metric', 'name': name, 'timestamp': time(), **fields})
+
+# Report the error which does not stop the bot as the structured record (the errors are always exported)
+def ReportError(name: str, error: BaseException, **fields):
+    ExportRecord({'kind': 'error', 'name': name, 'timestamp': time(), 'error': f"{type(error).__name__}: {error}", **fields})
+
+# Set the function getting the exported records (traces, metrics and errors) instead of the structured log lines (None to print them again)
+def SetRecordExporter(exporter: Callable[[dict], None] | None):
+    global record_exporter
+
+    record_exporter = exporter
+
+# Export the record (the structured log line is turned into the metrics)
+def ExportRecord(record: dict):
+    if record_exporter is not None:
+        record_exporter(record)
+        return
+
+    print(json.dumps(record, ensure_ascii=False, default=str))
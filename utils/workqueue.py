@@ -0,0 +1,181 @@
+# Import necessary modules, classes and functions
+import sqlite3
+from abc import ABC, abstractmethod
+from threading import Lock, local
+from time import sleep, time
+from uuid import uuid4
+from utils.tracing import ReportMetric
+
+# Define environment variables
+WORK_QUEUE: str = ''
+WORK_QUEUE_URL: str | None = None
+WORK_QUEUE_PATH: str = 'queue.sqlite3'
+WORK_QUEUE_VISIBILITY_TIMEOUT: int = 300
+WORK_QUEUE_MAX_ATTEMPTS: int = 5
+
+# Initialize environment variables
+def InitEnvVars(vars: dict):
+    global WORK_QUEUE, WORK_QUEUE_URL, WORK_QUEUE_PATH, WORK_QUEUE_VISIBILITY_TIMEOUT, WORK_QUEUE_MAX_ATTEMPTS, work_queue
+
+    WORK_QUEUE = (vars.get('WORK_QUEUE') or WORK_QUEUE).lower()
+    WORK_QUEUE_URL = vars.get('WORK_QUEUE_URL') or WORK_QUEUE_URL
+    WORK_QUEUE_PATH = vars.get('WORK_QUEUE_PATH') or WORK_QUEUE_PATH
+    WORK_QUEUE_VISIBILITY_TIMEOUT = int(vars.get('WORK_QUEUE_VISIBILITY_TIMEOUT') or WORK_QUEUE_VISIBILITY_TIMEOUT)
+    WORK_QUEUE_MAX_ATTEMPTS = int(vars.get('WORK_QUEUE_MAX_ATTEMPTS') or WORK_QUEUE_MAX_ATTEMPTS)
+
+    work_queue = None
+
+# Define service variables
+work_queue = None
+work_queue_lock = Lock()
+
+# Define the time (in seconds) between the checks of the embedded queue while the receiver waits for the messages
+SQLITE_QUEUE_POLL_INTERVAL = 0.05
+
+# The base class of the work queues: the messages of one group are received in their order, and the next one only after the previous is deleted
+# Every message is a dict with the group, the deduplication id and the body (the received ones have the id, the receipt and the attempts too)
+class WorkQueue(ABC):
+    # Send the messages to the queue
+    @abstractmethod
+    def send(self, messages: list[dict]): ...
+
+    # Receive up to the limit of the messages, waiting for them up to the specified time (in seconds)
+    @abstractmethod
+    def receive(self, limit: int, wait: float) -> list[dict]: ...
+
+    # Delete the handled message (the message which is not deleted is received again after the visibility timeout)
+    @abstractmethod
+    def delete(self, message: dict): ...
+
+# The work queue in the FIFO queue of Yandex Message Queue
+class MessageQueue(WorkQueue):
+    def __init__(self, url: str):
+        self.url = url
+
+    def send(self, messages: list[dict]):
+        from utils.yandexcloud import queue_send
+
+        queue_send(self.url, messages)
+
+    def receive(self, limit: int, wait: float) -> list[dict]:
+        from utils.yandexcloud import queue_receive
+
+        return queue_receive(self.url, limit, wait, WORK_QUEUE_VISIBILITY_TIMEOUT)
+
+    def delete(self, message: dict):
+        from utils.yandexcloud import queue_delete
+
+        queue_delete(self.url, message['receipt'])
+
+# The work queue in the embedded SQLite database (the local stand-in of the message queue)
+class SQLiteQueue(WorkQueue):
+    # Define the schema of the queue (only the first message of every group can be received)
+    SCHEMA = """
+    create table if not exists queue (
+        id integer primary key autoincrement,
+        group_id text not null,
+        dedup_id text not null unique,
+        body text not null,
+        visible_at real not null,
+        receipt text,
+        attempts integer not null default 0
+    );
+    create index if not exists queue_group on queue (group_id, id);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = local()
+
+    def send(self, messages: list[dict]):
+        connection = self.get_connection()
+
+        # The message with the same deduplication id is sent once, like in the FIFO queue
+        with connection:
+            connection.execute("begin immediate")
+            connection.executemany(
+                "insert or ignore into queue (group_id, dedup_id, body, visible_at) values (?, ?, ?, ?)",
+                [(message['group'], message['dedup'], message['body'], time()) for message in messages]
+            )
+
+    def receive(self, limit: int, wait: float) -> list[dict]:
+        deadline = time() + wait
+
+        while True:
+            messages = self.receive_now(limit)
+
+            if messages or time() >= deadline:
+                return messages
+
+            sleep(SQLITE_QUEUE_POLL_INTERVAL)
+
+    # Receive the first visible messages of the groups (the group whose first message is being handled is skipped)
+    def receive_now(self, limit: int) -> list[dict]:
+        connection = self.get_connection()
+        now = time()
+        messages = []
+
+        with connection:
+            connection.execute("begin immediate")
+
+            rows = connection.execute(
+                "select id, group_id, body, attempts from queue as message where visible_at <= ? and not exists "
+                "(select 1 from queue as earlier where earlier.group_id = message.group_id and earlier.id < message.id) order by id limit ?",
+                (now, limit)
+            ).fetchall()
+
+            for id, group, body, attempts in rows:
+                # The message which fails again and again is dropped, so it does not block its group forever
+                if attempts >= WORK_QUEUE_MAX_ATTEMPTS:
+                    connection.execute("delete from queue where id = ?", (id,))
+                    ReportMetric('work_queue_dropped', group=group, attempts=attempts)
+                    continue
+
+                receipt = uuid4().hex
+                connection.execute("update queue set visible_at = ?, receipt = ?, attempts = attempts + 1 where id = ?",
+                                   (now + WORK_QUEUE_VISIBILITY_TIMEOUT, receipt, id))
+                messages.append({'id': id, 'group': group, 'body': body, 'receipt': receipt, 'attempts': attempts + 1})
+
+        return messages
+
+    def delete(self, message: dict):
+        connection = self.get_connection()
+
+        # The receipt of the message received again after the visibility timeout does not delete it
+        with connection:
+            connection.execute("delete from queue where id = ? and receipt = ?", (message['id'], message['receipt']))
+
+    # Get the connection of the current thread (sqlite3 connections cannot be shared by the threads)
+    def get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            return connection
+
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        connection.execute("pragma journal_mode = wal")
+        connection.execute("pragma busy_timeout = 5000")
+        connection.executescript(self.SCHEMA)
+
+        self.local.connection = connection
+
+        return connection
+
+# Check if the updates are handled through the work queue
+def IsWorkQueueEnabled() -> bool:
+    return bool(WORK_QUEUE)
+
+# Get the configured work queue (it is created on the first use)
+def GetWorkQueue() -> WorkQueue:
+    global work_queue
+
+    with work_queue_lock:
+        if work_queue is None:
+            match WORK_QUEUE:
+                case 'ymq':
+                    work_queue = MessageQueue(WORK_QUEUE_URL)
+                case 'sqlite':
+                    work_queue = SQLiteQueue(WORK_QUEUE_PATH)
+                case _:
+                    raise ValueError(f"There is no work queue '{WORK_QUEUE}'")
+
+    return work_queue
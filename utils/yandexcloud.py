@@ -1,7 +1,11 @@
-# Import necessary modules, classes and functions
+# Import necessary modules, classes and functions (boto3 is imported on the first query to speed up cold starts)
 from decimal import Decimal
-from boto3 import Session
-from boto3.dynamodb.conditions import Key
+from threading import Lock, local
+from time import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from boto3 import Session
 
 # Define environment variables
 ACCESS_KEY_ID: str | None = None
@@ -16,9 +20,34 @@ def InitEnvVars(vars: dict):
     SECRET_ACCESS_KEY = vars.get('SECRET_ACCESS_KEY')
     DOCAPI_ENDPOINT = vars.get('DOCAPI_ENDPOINT')
 
-# Define service variables
+# Define service variables (boto3 resources are not thread-safe, so every thread gets its own resource and tables)
 boto_session = None
-docapi_table = None
+boto_session_lock = Lock()
+docapi_local = local()
+message_queue_client = None
+
+# Define the endpoint of Yandex Message Queue (the SQS-compatible API)
+MESSAGE_QUEUE_ENDPOINT = 'https://message-queue.api.cloud.yandex.net'
+
+# Define the maximum number of the messages in one request to the message queue
+MESSAGE_QUEUE_BATCH_LIMIT = 10
+
+# Define the maximum number of the attempts to upsert the user which is created or deleted concurrently
+UPSERT_ATTEMPTS = 5
+
+# Define the secondary index of the users table by their roles (the role is duplicated to the top-level attribute)
+ROLE_INDEX = 'role_index'
+
+# Define the attribute with the expiration time of the items (in seconds since the epoch), which the database deletes after it
+EXPIRE_AT_ATTRIBUTE = 'expire_at'
+
+# Define the keys of the conversations' history table: the chat's id and the turn's key (the zero-padded time_ns of the turn)
+HISTORY_TABLE = 'history'
+HISTORY_TABLE_KEYS = [('chat_id', 'HASH', 'N'), ('turn', 'RANGE', 'S')]
+
+# Define the keys of the cached values table (the responses of the chat models and the claims of the updates)
+CACHE_TABLE = 'cache'
+CACHE_TABLE_KEYS = [('id', 'HASH', 'S')]
 
 # Query to the database for finding user's information
 def query_find(id: Decimal) -> dict | None:
@@ -32,72 +61,175 @@ def query_find(id: Decimal) -> dict | None:
 
     return response
 
-# Query to the database for searching for users' information by the specified role
-def query_search(role: str):
+# Query to the database for finding the information of several users at once
+def query_find_batch(ids: list[Decimal]) -> dict:
     table = _get_docapi_table()
-
-    scan_kwargs = {
-        'FilterExpression': Key('info.role').eq(role),
-        'ProjectionExpression': "id, info.name, info.role, info.language, info.model, info.budget"
-    }
+    resource = _get_docapi_resource()
 
     users = []
 
-    done = False
-    start_key = None
+    # A single request can get at most 100 items, and the unprocessed ones have to be requested again
+    for start in range(0, len(ids), 100):
+        request_items = {
+            table.name: {
+                'Keys': [{'id': id} for id in ids[start:start + 100]]
+            }
+        }
 
-    while not done:
-        if start_key:
-            scan_kwargs['ExclusiveStartKey'] = start_key
+        while request_items:
+            response = resource.batch_get_item(RequestItems=request_items)
+            users += response.get('Responses', {}).get(table.name, [])
 
-        response = table.scan(**scan_kwargs)
-        users += response.get('Items', [])
+            request_items = response.get('UnprocessedKeys', None)
 
-        start_key = response.get('LastEvaluatedKey', None)
-        done = start_key is None
-    
     return {'Items': users}
 
-# Query to the database for inserting data about new user
-def query_insert(id: Decimal, name: str, role: str, language: str, model: str, budget: Decimal):
+# Query to the database for getting one page of users' information by the specified role (ordered by the users' ids)
+def query_search_page(role: str, limit: int, start_id: Decimal | None = None, forward: bool = True):
+    from boto3.dynamodb.conditions import Key
+
     table = _get_docapi_table()
 
-    response = table.put_item(
-        Item = {
-            'id': id,
-            'info': {
-                'name': name,
-                'role': role,
-                'language': language,
-                'model': model,
-                'budget': budget
-            }
+    query_kwargs = {
+        'IndexName': ROLE_INDEX,
+        'KeyConditionExpression': Key('role').eq(role),
+        'ProjectionExpression': "id, info.#name, info.#role",
+        'ExpressionAttributeNames': {
+            '#name': 'name',
+            '#role': 'role'
+        },
+        'ScanIndexForward': forward,
+        'Limit': limit
+    }
+
+    if start_id is not None:
+        query_kwargs['ExclusiveStartKey'] = {
+            'role': role,
+            'id': start_id
         }
+
+    return table.query(**query_kwargs)
+
+# Query to the database for setting the specified fields of user's information (creating the user if necessary)
+def query_upsert(id: Decimal, defaults: dict, **fields):
+    table = _get_docapi_table()
+    conditional_check_failed = table.meta.client.exceptions.ConditionalCheckFailedException
+
+    # Attribute names like "name", "role" and "language" are reserved words, so all of them are aliased
+    names = {f'#{field}': field for field in (defaults | fields)}
+
+    update_expression = ", ".join(
+        [f"info.#{field} = :{field}" for field in fields] +
+        [f"info.#{field} = if_not_exists(info.#{field}, :{field})" for field in defaults if field not in fields] +
+        (["#role = :role"] if 'role' in fields else [])
     )
 
+    for _ in range(UPSERT_ATTEMPTS):
+        # The user usually exists, so the fields are set in a single round trip
+        try:
+            return table.update_item(
+                Key = {
+                    'id': id
+                },
+                UpdateExpression = f"set {update_expression}",
+                ConditionExpression = "attribute_exists(id)",
+                ExpressionAttributeNames = names,
+                ExpressionAttributeValues = {f':{field}': value for field, value in (defaults | fields).items()},
+                ReturnValues = "ALL_NEW"
+            )
+        except conditional_check_failed:
+            pass
+
+        # Otherwise the user is created with the default fields (unless it was created concurrently)
+        try:
+            return table.update_item(
+                Key = {
+                    'id': id
+                },
+                UpdateExpression = "set info = :info, #role = :role",
+                ConditionExpression = "attribute_not_exists(id)",
+                ExpressionAttributeNames = {
+                    '#role': 'role'
+                },
+                ExpressionAttributeValues = {
+                    ':info': defaults | fields,
+                    ':role': (defaults | fields)['role']
+                },
+                ReturnValues = "ALL_NEW"
+            )
+        except conditional_check_failed:
+            pass
+
+    # Every attempt has raced with the concurrent creation and deletion of the user
+    raise RuntimeError(f"The user {id} was not upserted in {UPSERT_ATTEMPTS} attempts")
+
+# Query to the database for atomically changing user's budget (None if the budget would become less than the minimum)
+# The missing budget is the same as the zero one, and the user must exist
+def query_add_budget(id: Decimal, amount: Decimal, minimum: Decimal | None = Decimal(0)):
+    table = _get_docapi_table()
+
+    condition_expression = "attribute_exists(id)"
+    expression_attribute_values = {
+        ':a': amount,
+        ':z': Decimal(0)
+    }
+
+    if minimum is not None:
+        expression_attribute_values[':m'] = minimum - amount
+
+        if minimum - amount <= 0:
+            condition_expression = "attribute_exists(id) and (attribute_not_exists(info.budget) or info.budget >= :m)"
+        else:
+            condition_expression = "info.budget >= :m"
+
+    # ADD works only with top-level attributes, so the nested budget is changed with an arithmetic SET
+    try:
+        response = table.update_item(
+            Key = {
+                'id': id
+            },
+            UpdateExpression = "set info.budget = if_not_exists(info.budget, :z) + :a",
+            ConditionExpression = condition_expression,
+            ExpressionAttributeValues = expression_attribute_values,
+            ReturnValues = "ALL_NEW"
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+
     return response
 
-# Query to the database for updating user's information
-def query_update(id: Decimal, name: str, role: str, language: str, model: str, budget: Decimal):
+# Query to the database for atomically setting user's budget to zero (None if the budget is not less than the specified limit)
+# The missing budget is the same as the zero one, and the user must exist
+def query_clear_budget(id: Decimal, limit: Decimal):
     table = _get_docapi_table()
 
-    response = table.update_item(
-        Key = {
-            'id': id
-        },
-        UpdateExpression = "set info.name = :n, info.role = :r, info.language = :l, info.model = :m, info.budget = :b",
-        ExpressionAttributeValues = {
-            ':n': name,
-            ':r': role,
-            ':l': language,
-            ':m': model,
-            ':b': budget
-        },
-        ReturnValues = "UPDATED_NEW"
-    )
+    try:
+        response = table.update_item(
+            Key = {
+                'id': id
+            },
+            UpdateExpression = "set info.budget = :z",
+            ConditionExpression = "attribute_exists(id) and (attribute_not_exists(info.budget) or info.budget < :l)",
+            ExpressionAttributeValues = {
+                ':z': Decimal(0),
+                ':l': limit
+            },
+            ReturnValues = "ALL_NEW"
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
 
     return response
 
+# Query to the database for reserving the amount from user's budget (None if the budget is not enough)
+def query_reserve_budget(id: Decimal, amount: Decimal):
+    return query_add_budget(id, -amount)
+
+# Query to the database for committing the reserved amount (the unspent part is returned to user's budget)
+def query_commit_budget(id: Decimal, reserved: Decimal, spent: Decimal):
+    # Never charge more than was reserved, so the commit needs no condition and cannot fail
+    return query_add_budget(id, reserved - min(spent, reserved), minimum=None)
+
 # Query to the database for deleting user's information
 def query_delete(id: Decimal):
     table = _get_docapi_table()
@@ -110,29 +242,315 @@ def query_delete(id: Decimal):
 
     return response
 
+# Query to the database for appending the turns to the conversation's history (all of them are written at once)
+def query_append_history(turns: list[dict]):
+    table = _get_history_table()
+    resource = _get_docapi_resource()
+
+    request_items = {
+        table.name: [{'PutRequest': {'Item': turn}} for turn in turns]
+    }
+
+    while request_items:
+        response = resource.batch_write_item(RequestItems=request_items)
+        request_items = response.get('UnprocessedItems', None)
+
+    return response
+
+# Query to the database for getting one page of the conversation's history (starting with the newest turns)
+def query_load_history(chat_id: Decimal, limit: int, start_key: dict | None = None):
+    from boto3.dynamodb.conditions import Key
+
+    table = _get_history_table()
+
+    query_kwargs = {
+        'KeyConditionExpression': Key('chat_id').eq(chat_id),
+        'ScanIndexForward': False,
+        'Limit': limit
+    }
+
+    if start_key:
+        query_kwargs['ExclusiveStartKey'] = start_key
+
+    return table.query(**query_kwargs)
+
+# Query to the database for getting the cached value (None if it is missing or expired)
+def query_get_cache(id: str) -> dict | None:
+    table = _get_cache_table()
+
+    item = table.get_item(
+        Key = {
+            'id': id
+        }
+    ).get('Item', None)
+
+    # The expired items are deleted by the database with some delay, so they are skipped here
+    if item is None or item['expire_at'] <= time():
+        return None
+
+    return item
+
+# Query to the database for caching the value until the specified time (in seconds since the epoch)
+def query_put_cache(id: str, value, expire_at: int):
+    table = _get_cache_table()
+
+    response = table.put_item(
+        Item = {
+            'id': id,
+            'value': value,
+            'expire_at': Decimal(expire_at)
+        }
+    )
+
+    return response
+
+# Query to the database for caching the value only if there is no unexpired one (None if there is, so the value is claimed once)
+def query_claim_cache(id: str, value, expire_at: int):
+    table = _get_cache_table()
+
+    try:
+        response = table.put_item(
+            Item = {
+                'id': id,
+                'value': value,
+                'expire_at': Decimal(expire_at)
+            },
+            ConditionExpression = "attribute_not_exists(id) or expire_at <= :n",
+            ExpressionAttributeValues = {
+                ':n': Decimal(int(time()))
+            }
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+
+    return response
+
+# Query to the message queue for sending the messages to the FIFO queue (the messages of one group are received in their order)
+def queue_send(url: str, messages: list[dict]):
+    client = _get_message_queue_client()
+
+    for start in range(0, len(messages), MESSAGE_QUEUE_BATCH_LIMIT):
+        response = client.send_message_batch(
+            QueueUrl = url,
+            Entries = [{
+                'Id': str(number),
+                'MessageBody': message['body'],
+                'MessageGroupId': message['group'],
+                'MessageDeduplicationId': message['dedup']
+            } for number, message in enumerate(messages[start:start + MESSAGE_QUEUE_BATCH_LIMIT])]
+        )
+
+        # The messages which are not sent make the whole request fail, so the webhook is retried by Telegram
+        if response.get('Failed'):
+            raise RuntimeError(f"The messages were not sent to the queue: {response['Failed']}")
+
+# Query to the message queue for receiving the messages (they are hidden from other receivers until the visibility timeout)
+def queue_receive(url: str, limit: int, wait: float, visibility_timeout: int) -> list[dict]:
+    response = _get_message_queue_client().receive_message(
+        QueueUrl = url,
+        MaxNumberOfMessages = min(limit, MESSAGE_QUEUE_BATCH_LIMIT),
+        WaitTimeSeconds = int(wait),
+        VisibilityTimeout = visibility_timeout,
+        AttributeNames = ['MessageGroupId', 'ApproximateReceiveCount']
+    )
+
+    return [{
+        'id': message['MessageId'],
+        'group': message['Attributes']['MessageGroupId'],
+        'body': message['Body'],
+        'receipt': message['ReceiptHandle'],
+        'attempts': int(message['Attributes'].get('ApproximateReceiveCount', 1))
+    } for message in response.get('Messages', [])]
+
+# Query to the message queue for deleting the handled message
+def queue_delete(url: str, receipt: str):
+    _get_message_queue_client().delete_message(
+        QueueUrl = url,
+        ReceiptHandle = receipt
+    )
+
+# Get the errors of the database which the callers may survive (botocore is imported only when the error is handled)
+def storage_errors() -> tuple[type[Exception], ...]:
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    return (BotoCoreError, ClientError)
+
+# Create the role index and copy the roles of existing users to the top-level attribute (the one-off migration)
+def migrate_role_index() -> int:
+    from boto3.dynamodb.conditions import Attr
+
+    table = _get_docapi_table()
+    table.reload()
+
+    if not any(index['IndexName'] == ROLE_INDEX for index in table.global_secondary_indexes or []):
+        table.update(
+            AttributeDefinitions = [
+                {'AttributeName': 'id', 'AttributeType': 'N'},
+                {'AttributeName': 'role', 'AttributeType': 'S'}
+            ],
+            GlobalSecondaryIndexUpdates = [{
+                'Create': {
+                    'IndexName': ROLE_INDEX,
+                    'KeySchema': [
+                        {'AttributeName': 'role', 'KeyType': 'HASH'},
+                        {'AttributeName': 'id', 'KeyType': 'RANGE'}
+                    ],
+                    'Projection': {
+                        'ProjectionType': 'ALL'
+                    }
+                }
+            }]
+        )
+
+    scan_kwargs = {
+        'FilterExpression': Attr('role').not_exists(),
+        'ProjectionExpression': "id, info.#role",
+        'ExpressionAttributeNames': {
+            '#role': 'role'
+        }
+    }
+
+    migrated = 0
+
+    done = False
+    start_key = None
+
+    while not done:
+        if start_key:
+            scan_kwargs['ExclusiveStartKey'] = start_key
+
+        response = table.scan(**scan_kwargs)
+
+        for user in response.get('Items', []):
+            # The role may be set concurrently by the bot, so the newer one is never overwritten
+            table.update_item(
+                Key = {
+                    'id': user['id']
+                },
+                UpdateExpression = "set #role = if_not_exists(#role, :role)",
+                ExpressionAttributeNames = {
+                    '#role': 'role'
+                },
+                ExpressionAttributeValues = {
+                    ':role': user['info']['role']
+                }
+            )
+            migrated += 1
+
+        start_key = response.get('LastEvaluatedKey', None)
+        done = start_key is None
+
+    return migrated
+
+# Create the conversations' history table with the expiration of its turns (the one-off migration, True if it is created)
+def migrate_history_table() -> bool:
+    return migrate_expiring_table(HISTORY_TABLE, HISTORY_TABLE_KEYS)
+
+# Create the cached values table with the expiration of its items (the one-off migration, True if it is created)
+def migrate_cache_table() -> bool:
+    return migrate_expiring_table(CACHE_TABLE, CACHE_TABLE_KEYS)
+
+# Create the table with the specified keys (name, key type, attribute type) and turn on the expiration of its items
+def migrate_expiring_table(name: str, keys: list[tuple[str, str, str]]) -> bool:
+    resource = _get_docapi_resource()
+    client = resource.meta.client
+
+    created = False
+
+    try:
+        client.describe_table(TableName=name)
+    except client.exceptions.ResourceNotFoundException:
+        resource.create_table(
+            TableName = name,
+            KeySchema = [{'AttributeName': key, 'KeyType': key_type} for key, key_type, _ in keys],
+            AttributeDefinitions = [{'AttributeName': key, 'AttributeType': attribute_type} for key, _, attribute_type in keys],
+            BillingMode = 'PAY_PER_REQUEST'
+        )
+        client.get_waiter('table_exists').wait(TableName=name)
+        created = True
+
+    time_to_live = client.describe_time_to_live(TableName=name).get('TimeToLiveDescription', {})
+
+    if time_to_live.get('TimeToLiveStatus') not in ('ENABLED', 'ENABLING'):
+        client.update_time_to_live(
+            TableName = name,
+            TimeToLiveSpecification = {
+                'Enabled': True,
+                'AttributeName': EXPIRE_AT_ATTRIBUTE
+            }
+        )
+
+    return created
+
 # Service method for initializing docapi table (table from YDB database)
 def _get_docapi_table():
-    global docapi_table
-    if docapi_table is not None:
-        return docapi_table
+    return _get_docapi_local_table('users')
+
+# Service method for initializing docapi table of the conversations' history (table from YDB database)
+def _get_history_table():
+    return _get_docapi_local_table(HISTORY_TABLE)
+
+# Service method for initializing docapi table of the cached values (table from YDB database)
+def _get_cache_table():
+    return _get_docapi_local_table(CACHE_TABLE)
+
+# Service method for initializing docapi table of the current thread
+def _get_docapi_local_table(name: str):
+    tables = getattr(docapi_local, 'tables', None)
+
+    if tables is None:
+        tables = docapi_local.tables = {}
 
-    docapi_table = _get_boto_session().resource(
-        'dynamodb',
-        endpoint_url=DOCAPI_ENDPOINT,
-        region_name='ru-central1'
-    ).Table('users')
+    if name not in tables:
+        tables[name] = _get_docapi_resource().Table(name)
 
-    return docapi_table
+    return tables[name]
+
+# Service method for initializing docapi resource of the current thread (YDB database)
+def _get_docapi_resource():
+    docapi_resource = getattr(docapi_local, 'resource', None)
+    if docapi_resource is not None:
+        return docapi_resource
+
+    # The session is shared by the threads, so the resources are created from it one at a time
+    with boto_session_lock:
+        docapi_resource = _get_boto_session().resource(
+            'dynamodb',
+            endpoint_url=DOCAPI_ENDPOINT,
+            region_name='ru-central1'
+        )
+
+    docapi_local.resource = docapi_resource
+
+    return docapi_resource
 
 # Service method for initializing boto session
-def _get_boto_session() -> Session:
+def _get_boto_session() -> 'Session':
     global boto_session
     if boto_session is not None:
         return boto_session
 
+    from boto3 import Session
+
     boto_session = Session(
         aws_access_key_id=ACCESS_KEY_ID,
         aws_secret_access_key=SECRET_ACCESS_KEY
     )
 
-    return boto_session
\ No newline at end of file
+    return boto_session
+
+# Service method for initializing the client of the message queue (boto3 clients are thread-safe, so it is shared)
+def _get_message_queue_client():
+    global message_queue_client
+    if message_queue_client is not None:
+        return message_queue_client
+
+    with boto_session_lock:
+        if message_queue_client is None:
+            message_queue_client = _get_boto_session().client(
+                'sqs',
+                endpoint_url=MESSAGE_QUEUE_ENDPOINT,
+                region_name='ru-central1'
+            )
+
+    return message_queue_client
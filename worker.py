@@ -0,0 +1,72 @@
+# Import necessary modules, classes and functions
+import os
+import json
+import signal
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Event
+from telebot.types import Update
+from main import ProcessUpdate
+from utils.workqueue import WorkQueue, GetWorkQueue
+from utils.tracing import ReportError
+
+# Read environment variables of the worker draining the work queue
+worker_vars = {
+    'WORKER_CONCURRENCY': os.environ.get('WORKER_CONCURRENCY'),
+    'WORKER_BATCH_SIZE': os.environ.get('WORKER_BATCH_SIZE'),
+    'WORKER_WAIT': os.environ.get('WORKER_WAIT'),
+}
+
+# Define the settings of the worker
+WORKER_CONCURRENCY = int(worker_vars['WORKER_CONCURRENCY'] or 16)
+WORKER_BATCH_SIZE = int(worker_vars['WORKER_BATCH_SIZE'] or 10)
+WORKER_WAIT = float(worker_vars['WORKER_WAIT'] or 20)
+
+
+# Handle the received messages of one group in their order (the message is deleted only after it is handled)
+def HandleGroup(queue: WorkQueue, messages: list[dict]):
+    for message in messages:
+        try:
+            ProcessUpdate(Update.de_json(json.loads(message['body'])))
+        except Exception as error:
+            # The rest of the group is not handled, so it is received again after the failed message, in the same order
+            ReportError('work_queue_message', error, group=message['group'], attempts=message.get('attempts'))
+            return
+
+        queue.delete(message)
+
+# Drain the work queue until the worker is stopped (the groups are handled concurrently, and the messages of one group one by one)
+def Drain(queue: WorkQueue, stop: Event, concurrency: int = WORKER_CONCURRENCY, batch_size: int = WORKER_BATCH_SIZE, wait_time: float = WORKER_WAIT):
+    pending = set()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='update') as executor:
+        while not stop.is_set():
+            if len(pending) >= concurrency:
+                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                continue
+
+            messages = queue.receive(min(batch_size, concurrency - len(pending)), wait_time)
+            groups = {}
+
+            for message in messages:
+                groups.setdefault(message['group'], []).append(message)
+
+            for group in groups.values():
+                pending.add(executor.submit(HandleGroup, queue, group))
+
+            pending = {future for future in pending if not future.done()}
+
+        # The received messages are handled before the exit, so they are not received again after the visibility timeout
+        wait(pending)
+
+# Run the worker until it gets the signal to stop
+def Work():
+    stop = Event()
+
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: stop.set())
+
+    Drain(GetWorkQueue(), stop)
+
+
+if __name__ == '__main__':
+    Work()